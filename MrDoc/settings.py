@@ -186,6 +186,9 @@ CACHES = {
     }
 }
 
+# 每个进程缓存的文集目录数量，文档变化后按 ProjectToc 版本号失效
+PROJECT_TOC_CACHE_SIZE = CONFIG.getint('cache','project_toc_size',fallback=256)
+
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
 
@@ -265,21 +268,93 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 10
 }
 
+# 全文检索引擎
+SEARCH_ENGINE_MAP = {
+    'whoosh': 'app_doc.search.whoosh_cn_backend.WhooshEngine',
+    'sql': 'app_doc.search.sql_fts_backend.SqlEngine',
+}
+SEARCH_ENGINE = CONFIG.get('search','engine',fallback='whoosh')
+
 # 全文检索配置
 HAYSTACK_CONNECTIONS = {
     'default': {
-        # 使用whoosh引擎
-        'ENGINE': 'app_doc.search.whoosh_cn_backend.WhooshEngine',
+        # 默认使用whoosh引擎，sql 为数据库全文索引（SQLite FTS5 / PostgreSQL tsvector）
+        'ENGINE': SEARCH_ENGINE_MAP[SEARCH_ENGINE],
         # 索引文件路径
         'PATH': os.path.join(BASE_DIR, 'whoosh_index'),
     }
 }
 
 # 当添加、修改、删除数据时，自动生成索引
-HAYSTACK_SIGNAL_PROCESSOR = 'haystack.signals.RealtimeSignalProcessor'
+# 默认记录到索引更新队列，由后台线程合并后批量写入；关闭队列时在请求内实时写入
+SEARCH_INDEX_QUEUE = CONFIG.getboolean('search','index_queue',fallback=True)
+if SEARCH_INDEX_QUEUE:
+    HAYSTACK_SIGNAL_PROCESSOR = 'app_doc.search.index_queue.QueuedSignalProcessor'
+else:
+    HAYSTACK_SIGNAL_PROCESSOR = 'haystack.signals.RealtimeSignalProcessor'
+# 对象最后一次修改后等待的秒数，期间的连续修改合并为一次索引写入
+SEARCH_INDEX_QUEUE_DELAY = CONFIG.getint('search','index_queue_delay',fallback=2)
+# 对象首次修改后写入索引的最长等待秒数
+SEARCH_INDEX_QUEUE_MAX_DELAY = CONFIG.getint('search','index_queue_max_delay',fallback=30)
+# 每批处理的队列记录数量
+SEARCH_INDEX_QUEUE_BATCH_SIZE = CONFIG.getint('search','index_queue_batch_size',fallback=200)
+# 是否在 Web 进程内启动队列处理线程；关闭后需运行 python manage.py process_index_queue
+SEARCH_INDEX_QUEUE_THREAD = CONFIG.getboolean('search','index_queue_thread',fallback=True)
+# 写入索引失败后的重试等待秒数，每次失败后加倍
+SEARCH_INDEX_QUEUE_RETRY_DELAY = CONFIG.getint('search','index_queue_retry_delay',fallback=30)
+# 写入索引失败次数达到该值后不再自动重试
+SEARCH_INDEX_QUEUE_MAX_ATTEMPTS = CONFIG.getint('search','index_queue_max_attempts',fallback=5)
 # 自定义高亮
 HAYSTACK_CUSTOM_HIGHLIGHTER = "app_doc.search.highlight.MyHighLighter"
 
+# 内容搜索（正则/精确匹配）使用三元组索引筛选候选文档
+SEARCH_TRIGRAM_INDEX = CONFIG.getboolean('search','trigram_index',fallback=True)
+
+# 全局内容搜索的并行扫描进程数，0 或 1 表示不使用并行扫描
+SEARCH_SCAN_WORKERS = CONFIG.getint('search','scan_workers',fallback=0)
+# 候选文档数量达到该值时才使用并行扫描，较小的文集串行扫描
+SEARCH_SCAN_PARALLEL_MIN_DOCS = CONFIG.getint('search','scan_parallel_min_docs',fallback=2000)
+
+# 分词结果缓存，按内容哈希持久化到 whoosh_index 同级目录的 sqlite 文件
+SEARCH_TOKEN_CACHE = CONFIG.getboolean('search','token_cache',fallback=True)
+# 分词缓存最多保留的条数，超出后清理最早写入的缓存
+SEARCH_TOKEN_CACHE_MAX_ENTRIES = CONFIG.getint('search','token_cache_max_entries',fallback=200000)
+
+# 每个进程为每个索引保留的空闲搜索器数量，索引未变化时复用，0 表示每次搜索都重新打开索引
+SEARCH_SEARCHER_POOL_SIZE = CONFIG.getint('search','searcher_pool_size',fallback=8)
+# 每个索引缓存的过滤查询（文集权限范围等）匹配结果数量，索引更新后失效
+SEARCH_FILTER_CACHE_SIZE = CONFIG.getint('search','filter_cache_size',fallback=256)
+# 每个进程最多保留搜索器池的索引数量（分片模式下每个分片为一个索引），超出后关闭最久未使用的
+SEARCH_SEARCHER_POOL_MAX_INDEXES = CONFIG.getint('search','searcher_pool_max_indexes',fallback=64)
+# 全文索引是否按文集分片，开启或关闭后需要重建索引
+SEARCH_SHARDS = CONFIG.getboolean('search','shards',fallback=False)
+# 搜索结果ID列表的缓存时间（秒），0 表示不缓存；索引更新后缓存自动失效
+SEARCH_RESULT_CACHE_TIMEOUT = CONFIG.getint('search','result_cache_timeout',fallback=300)
+# 每条搜索结果缓存最多保存的结果数量
+SEARCH_RESULT_CACHE_MAX_HITS = CONFIG.getint('search','result_cache_max_hits',fallback=1000)
+# 单次全文搜索收集结果的时间预算（秒），超出后返回已收集的部分结果和估算的总数，0 表示不限制
+SEARCH_TIME_BUDGET = CONFIG.getfloat('search','time_budget',fallback=2.0)
+# 搜索日志是否先写入进程内缓冲区、由后台线程批量写库，默认开启；关闭后每次搜索同步写入
+SEARCH_LOG_BUFFER = CONFIG.getboolean('search','log_buffer',fallback=True)
+# 缓冲区最多保留的搜索日志条数，数据库长时间不可写时丢弃最早的日志
+SEARCH_LOG_BUFFER_SIZE = CONFIG.getint('search','log_buffer_size',fallback=10000)
+# 搜索日志写库的间隔秒数和每批条数
+SEARCH_LOG_FLUSH_INTERVAL = CONFIG.getint('search','log_flush_interval',fallback=5)
+SEARCH_LOG_BATCH_SIZE = CONFIG.getint('search','log_batch_size',fallback=500)
+# 热门搜索词只汇总早于该秒数的搜索日志，等待并发写入的较小ID的日志提交后再汇总
+SEARCH_LOG_ROLLUP_DELAY = CONFIG.getint('search','log_rollup_delay',fallback=300)
+# 搜索建议每个前缀返回的数量、前缀树的重建间隔（秒）和最多收录的词条数量
+SEARCH_SUGGEST_TOP_K = CONFIG.getint('search','suggest_top_k',fallback=10)
+SEARCH_SUGGEST_REFRESH_INTERVAL = CONFIG.getint('search','suggest_refresh_interval',fallback=300)
+SEARCH_SUGGEST_MAX_TERMS = CONFIG.getint('search','suggest_max_terms',fallback=50000)
+# 搜索建议接口 token 校验结果的进程内缓存秒数
+SEARCH_SUGGEST_TOKEN_TTL = CONFIG.getint('search','suggest_token_ttl',fallback=60)
+# 全文搜索是否使用后台配置的同义词扩展查询
+SEARCH_SYNONYMS = CONFIG.getboolean('search','synonyms',fallback=True)
+
+# 用户可访问文集ID集合的缓存时间（秒），缓存按数据库中的版本号失效，多进程部署无需共享缓存
+ACCESS_SCOPE_CACHE_TIMEOUT = CONFIG.getint('search','access_scope_cache_timeout',fallback=300)
+
 # Selenium 调用的driver类型 默认为Chromium
 CHROMIUM_DRIVER = CONFIG.get('selenium','driver',fallback='CHROMIUM')
 CHROMIUM_DRIVER_PATH = CONFIG.get('selenium','driver_path',fallback=None)
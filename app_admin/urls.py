@@ -45,4 +45,6 @@ urlpatterns = [
     path('api/attachment/<int:id>/', views.AdminAttachmentDetail.as_view(), name="api_admin_attachment"),  # 附件详情接口
     # 站点备份
     path('admin/backup/',views.admin_backup,name="admin_backup"),
+    # 搜索运行统计
+    path('api/search_stats/',views.admin_search_stats,name="api_admin_search_stats"),
 ]
\ No newline at end of file
@@ -22,6 +22,8 @@ from app_api.permissions_app import SuperUserPermission # 自定义权限
 from app_admin.decorators import superuser_only,open_register
 from app_doc.models import *
 from app_doc.views import jsonXssFilter
+from app_doc.search import searcher_pool, result_cache, log_buffer
+from app_doc import access_scope
 from app_admin.models import *
 from app_admin.utils import *
 from loguru import logger
@@ -654,6 +656,8 @@ def admin_project_role(request,pro_id):
                     role_value=role_value,
                     modify_time=datetime.datetime.now()
                 )
+            # update() 不触发模型信号，手动失效公开文集缓存
+            access_scope.invalidate_public()
             pro = Project.objects.get(id=int(pro_id))
             return render(request, 'app_admin/admin_project_role.html', locals())
         else:
@@ -719,6 +723,7 @@ def admin_project_colla_config(request,pro_id):
                 user = User.objects.get(username=username)
                 pro_colla = ProjectCollaborator.objects.filter(project=project[0], user=user)
                 pro_colla.update(role=role)
+                access_scope.invalidate_user(user.id)
                 return JsonResponse({'status':True,'data':_('修改成功')})
             except:
                 logger.exception(_("修改协作权限出错"))
@@ -1640,6 +1645,18 @@ def admin_backup(request):
         return JsonResponse({'status':False,'data':_("不支持的类型")})
 
 
+# 搜索运行统计（当前进程）
+@superuser_only
+@require_GET
+def admin_search_stats(request):
+    return JsonResponse({'status': True, 'data': {
+        'pid': os.getpid(),
+        'searcher_pool': searcher_pool.get_stats(),
+        'result_cache': result_cache.get_stats(),
+        'search_log_buffer': log_buffer.get_stats(),
+    }})
+
+
 # 后台管理
 @superuser_only
 def admin_center(request):
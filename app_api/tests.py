@@ -1,3 +1,173 @@
-from django.test import TestCase
+import json
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from app_api import views_search
+from app_api.models import UserToken
+from app_doc.models import Doc, Project
+from app_doc.search import suggest_trie, trigram_index
+from app_doc.tests import WhooshIndexMixin, expire_search_budget
+
+
+class ApiTestMixin:
+    """创建测试用户、Token 和文集"""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        queue_settings = override_settings(SEARCH_INDEX_QUEUE_THREAD=False)
+        queue_settings.enable()
+        self.addCleanup(queue_settings.disable)
+        self.user = User.objects.create_user('tester', password='password')
+        self.token = UserToken.objects.create(user=self.user, token='test-token').token
+        self.project = Project.objects.create(name='公开文集', intro='', role=0, create_user=self.user)
+
+    def create_doc(self, name, content='', project=None, **kwargs):
+        kwargs.setdefault('status', 1)
+        return Doc.objects.create(
+            name=name, pre_content=content, content=content,
+            top_doc=(project or self.project).id, create_user=self.user, **kwargs
+        )
+
+
+class SearchSuggestApiTest(ApiTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        private = Project.objects.create(name='私密文集', intro='', role=1, create_user=self.user)
+        self.create_doc('公开文档标题')
+        self.create_doc('公开私密文档标题', project=private)
+        suggest_trie._trie = None
+        self.addCleanup(setattr, suggest_trie, '_trie', None)
+        views_search._suggest_tokens.clear()
+        self.addCleanup(views_search._suggest_tokens.clear)
+
+    def test_token_required(self):
+        resp = self.client.get('/api/search/suggest/', {'q': '公开'})
+        self.assertFalse(resp.json()['status'])
+        resp = self.client.get('/api/search/suggest/', {'q': '公开', 'token': 'invalid'})
+        self.assertFalse(resp.json()['status'])
+
+    def test_suggest_with_token(self):
+        resp = self.client.get('/api/search/suggest/', {'q': '公开', 'token': self.token})
+        data = resp.json()
+        self.assertTrue(data['status'])
+        self.assertIn('公开文档标题', data['data'])
+        self.assertNotIn('公开私密文档标题', data['data'])
+
+    def test_token_check_is_cached(self):
+        self.client.get('/api/search/suggest/', {'q': '公开', 'token': self.token})
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.client.get('/api/search/suggest/', {'q': '公开文', 'token': self.token})
+        self.assertTrue(resp.json()['status'])
+        self.assertFalse([q for q in queries.captured_queries if 'app_api_usertoken' in q['sql']])
+        UserToken.objects.filter(token=self.token).update(token='new-token')
+        with override_settings(SEARCH_SUGGEST_TOKEN_TTL=0):
+            views_search._suggest_tokens.clear()
+            resp = self.client.get('/api/search/suggest/', {'q': '公开', 'token': self.token})
+        self.assertFalse(resp.json()['status'])
+
+
+@override_settings(SEARCH_SCAN_WORKERS=0)
+class SearchContentNdjsonTest(ApiTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.docs = [self.create_doc('文档{}'.format(i), '第一行\n匹配 keyword {}\n'.format(i)) for i in range(6)]
+
+    def get_lines(self, **params):
+        params = dict({'token': self.token, 'pattern': 'keyword', 'search_mode': 'regex', 'format': 'ndjson'}, **params)
+        resp = self.client.get('/api/search_content/', params)
+        self.assertEqual(resp['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        return [json.loads(line) for line in b''.join(resp.streaming_content).decode('utf-8').splitlines()]
+
+    def test_stops_scanning_when_page_is_full(self):
+        scanned = []
+        original = trigram_index.iter_docs
+
+        def iter_docs(docs_query, candidate_ids=None):
+            for doc in original(docs_query, candidate_ids):
+                scanned.append(doc.id)
+                yield doc
+
+        with mock.patch.object(trigram_index, 'iter_docs', side_effect=iter_docs):
+            lines = self.get_lines(limit=2)
+        self.assertEqual([line['doc_id'] for line in lines[:-1]], [d.id for d in self.docs[:2]])
+        summary = lines[-1]['summary']
+        self.assertEqual(summary['returned_docs'], 2)
+        self.assertFalse(summary['complete'])
+        self.assertEqual(scanned, [d.id for d in self.docs[:2]])
+
+    def test_last_page_is_complete(self):
+        lines = self.get_lines(limit=4, page=2)
+        self.assertEqual([line['doc_id'] for line in lines[:-1]], [d.id for d in self.docs[4:]])
+        self.assertTrue(lines[-1]['summary']['complete'])
+
+    def test_error_line_ends_stream(self):
+        def iter_docs(docs_query, candidate_ids=None):
+            yield docs_query.get(id=self.docs[0].id)
+            raise RuntimeError('扫描失败')
+
+        with mock.patch.object(trigram_index, 'iter_docs', side_effect=iter_docs):
+            lines = self.get_lines(limit=5)
+        self.assertEqual(lines[0]['doc_id'], self.docs[0].id)
+        self.assertEqual(lines[-1], {'status': False, 'data': '扫描失败'})
+        self.assertFalse(any('summary' in line for line in lines))
+
+
+class SearchApiTest(WhooshIndexMixin, ApiTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.docs = [
+            self.create_doc('搜索接口文档{}'.format(i), '搜索接口的正文内容 {}'.format(i), editor_mode=1)
+            for i in range(12)
+        ]
+        self.update_index()
+
+    def search(self, **params):
+        return self.client.get('/api/search/', dict({'token': self.token, 'q': '搜索接口'}, **params)).json()
+
+    def test_partial_results_are_flagged(self):
+        data = self.search()['data']
+        self.assertFalse(data['partial'])
+        self.assertEqual(data['total'], 12)
+        cache.clear()
+        with expire_search_budget(4):
+            data = self.search()['data']
+        self.assertTrue(data['partial'])
+        self.assertEqual(data['total'], 4)
+        self.assertGreaterEqual(data['estimated_total'], 4)
+
+    def test_fields_select_returned_data(self):
+        data = self.search(fields='id,name,preview', limit=5)['data']
+        self.assertEqual(data['total'], 12)
+        self.assertEqual(len(data['results']), 5)
+        for item in data['results']:
+            self.assertEqual(set(item), {'id', 'name', 'preview'})
+            self.assertIn('<span class="highlighted">', item['preview'])
+        data = self.search(fields='id,content,times', limit=1)['data']
+        self.assertEqual(set(data['results'][0]), {'id', 'content', 'create_time', 'modify_time'})
+        self.assertFalse(self.search(fields='id,secret')['status'])
+
+    def test_page_is_loaded_in_one_query(self):
+        self.search()
+        with CaptureQueriesContext(connection) as queries:
+            data = self.search(fields='id,name,top_doc', limit=10)['data']
+        self.assertEqual(len(data['results']), 10)
+        doc_queries = [q['sql'] for q in queries.captured_queries if 'FROM "app_doc_doc"' in q['sql']]
+        self.assertEqual(len(doc_queries), 1)
+        # 不需要正文时不加载正文
+        self.assertNotIn('"pre_content"', doc_queries[0])
+
+    def test_draft_is_not_returned_before_index_update(self):
+        Doc.objects.filter(id=self.docs[0].id).update(status=0)
+        cache.clear()
+        ids = [item['id'] for item in self.search(fields='id', limit=20)['data']['results']]
+        self.assertEqual(len(ids), 11)
+        self.assertNotIn(self.docs[0].id, ids)
@@ -28,6 +28,7 @@ urlpatterns = [
     path('oauth0/',views.oauth0,name="oauth0"), # Token验证登录，非完整oauth
     # 搜索API
     path('search/', views_search.api_search, name="api_search"), # API搜索（支持AND/OR模式）
+    path('search/suggest/', views_search.api_search_suggest, name="api_search_suggest"), # 搜索建议（自动补全）
     path('grep_search/', views_search.api_grep_search, name="api_grep_search"), # Grep风格搜索（支持正则+上下文）
     path('search_content/', views_search.api_search_content, name="api_search_content"), # 高级内容搜索（支持exact/fuzzy/regex三种模式）
 ]
@@ -1,37 +1,18 @@
 from app_doc.models import Project,ProjectCollaborator
+from app_doc import access_scope
 from django.utils.html import strip_tags
 import markdown
 
 # 用户有浏览和、新增权限的文集列表
 def read_add_projects(user):
-    # 用户的协作文集ID列表
-    colla_list = [i.project.id for i in ProjectCollaborator.objects.filter(user=user)]
-
-    # 用户自己的文集ID列表
-    self_list = [i.id for i in Project.objects.filter(create_user=user)]
-
-    # 合并上述文集ID列表
-    view_list = list(
-        set(self_list)
-            .union(set(colla_list))
-    )
-    return view_list
+    # 用户自己的文集与协作文集ID列表，由 access_scope 缓存
+    return list(access_scope.get_readable_project_ids(user))
 
 
 # 用户有浏览、新增、和修改所有文档权限的文集列表
 def read_add_edit_projects(user):
-    # 用户的协作文集ID列表
-    colla_list = [i.project.id for i in ProjectCollaborator.objects.filter(user=user,role=1)]
-
-    # 用户自己的文集ID列表
-    self_list = [i.id for i in Project.objects.filter(create_user=user)]
-
-    # 合并上述文集ID列表
-    view_list = list(
-        set(self_list)
-            .union(set(colla_list))
-    )
-    return view_list
+    # 用户自己的文集与可修改所有文档的协作文集ID列表，由 access_scope 缓存
+    return list(access_scope.get_editable_project_ids(user))
 
 # 摘取文档部分正文
 def remove_doc_tag(doc):
@@ -13,13 +13,17 @@ from django.utils.translation import gettext_lazy as _
 from django.db.models import Q
 from app_doc.util_upload_img import upload_generation_dir,base_img_upload,url_img_upload,img_upload
 from app_doc.util_upload_file import handle_attachment_upload
-from app_doc.utils import find_doc_next,find_doc_previous
+from app_doc.utils import refresh_doc_index
 from app_api.models import UserToken
 from app_doc.models import Project, Doc, DocHistory, Image, ProjectCollaborator
 from app_api.serializers_app import ImageSerializer,ProjectSerializer
 from app_api.utils import read_add_projects,remove_doc_tag
+from app_doc import access_scope, doc_path, project_toc
+from app_doc.doc_tree import get_doc_tree
 from loguru import logger
 from haystack.query import SearchQuerySet
+from app_doc.search_utils import narrow_to_projects
+from app_doc.search import result_cache
 import time,hashlib
 import traceback,json
 import datetime
@@ -175,9 +179,9 @@ def get_projects(request):
     try:
         token = UserToken.objects.get(token=token)
         if filter == 'self':  # 自己的文集
-            view_list = list(Project.objects.filter(create_user=token.user).values_list('id', flat=True))
+            view_list = list(access_scope.get_own_project_ids(token.user))
         elif filter == 'colla':  # 协作的文集
-            view_list = list(ProjectCollaborator.objects.filter(user=token.user).values_list('project_id', flat=True))
+            view_list = list(access_scope.get_collaborated_project_ids(token.user))
         else:  # 自己和协作的文集范围
             own_list = read_add_projects(token.user)
             # public_list = list(Project.objects.filter(role=0).values_list('id', flat=True))
@@ -190,18 +194,25 @@ def get_projects(request):
         if kw == '':
             projects = Project.objects.filter(id__in=view_list).order_by(f'{sort}{sort_name}')
         else:
-            matched_ids = set()
-            try:
-                sqs = SearchQuerySet().models(Project).auto_query(kw)
-                matched_ids.update(int(result.pk) for result in sqs if int(result.pk) in view_set)
-            except Exception:
-                logger.exception("全文检索获取文集异常")
-
-            try:
-                doc_sqs = SearchQuerySet().models(Doc).auto_query(kw)
-                matched_ids.update(int(result.top_doc) for result in doc_sqs if int(result.top_doc) in view_set)
-            except Exception:
-                logger.exception("全文检索获取文集(文档命中)异常")
+            def search_projects():
+                matched = set()
+                try:
+                    sqs = SearchQuerySet().models(Project).auto_query(kw)
+                    matched.update(int(result.pk) for result in sqs if int(result.pk) in view_set)
+                except Exception:
+                    logger.exception("全文检索获取文集异常")
+
+                try:
+                    doc_sqs = SearchQuerySet().models(Doc).auto_query(kw)
+                    matched.update(int(result.top_doc) for result in doc_sqs if int(result.top_doc) in view_set)
+                except Exception:
+                    logger.exception("全文检索获取文集(文档命中)异常")
+                return sorted(matched)
+
+            # 命中的文集ID按搜索词、文集范围和索引代数缓存
+            matched_ids = set(result_cache.get_or_compute(
+                'api_projects', kw, search_projects, scope=view_set,
+            ))
 
             if matched_ids:
                 projects = Project.objects.filter(id__in=matched_ids).order_by(f'{sort}{sort_name}')
@@ -311,61 +322,20 @@ def get_level_docs(request):
         if int(pid) not in view_list:
             return JsonResponse({'status': False, 'data': _('无文集权限')})
 
-        # 查询存在上级文档的文档
-        parent_id_list = Doc.objects.filter(top_doc=pid,status=1).exclude(parent_doc=0).values_list('parent_doc',flat=True)
-        # 获取存在上级文档的上级文档ID
-        # print(parent_id_list)
-        doc_list = []
-        doc_cnt = 0
-        # 获取一级文档
-        top_docs = Doc.objects.filter(top_doc=pid,parent_doc=0,status=1).values('id','name','editor_mode','parent_doc').order_by('sort')
-        # 遍历一级文档
-        for doc in top_docs:
-            top_item = {
-                'id':doc['id'],
-                'name':doc['name'],
-                'editor_mode':doc['editor_mode'],
-                'parent_doc':doc['parent_doc'],
-                'top_doc':pid,
-                'sub':[]
-            }
-            doc_cnt += 1
-            # 如果一级文档存在下级文档，查询其二级文档
-            if doc['id'] in parent_id_list:
-                # 获取二级文档
-                sec_docs = Doc.objects.filter(top_doc=pid,parent_doc=doc['id'],status=1).values('id','name','editor_mode','parent_doc').order_by('sort')
-                for doc in sec_docs:
-                    sec_item = {
-                        'id': doc['id'],
-                        'name': doc['name'],
-                        'editor_mode':doc['editor_mode'],
-                        'parent_doc': doc['parent_doc'],
-                        'top_doc':pid,
-                        'sub': []
-                    }
-                    doc_cnt += 1
-                    # 如果二级文档存在下级文档，查询第三级文档
-                    if doc['id'] in parent_id_list:
-                        # 获取三级文档
-                        thr_docs = Doc.objects.filter(top_doc=pid,parent_doc=doc['id'],status=1).values('id','name','editor_mode','parent_doc').order_by('sort')
-                        for doc in thr_docs:
-                            item = {
-                                'id': doc['id'],
-                                'name': doc['name'],
-                                'editor_mode': doc['editor_mode'],
-                                'parent_doc': doc['parent_doc'],
-                                'top_doc':pid,
-                                'sub': []
-                            }
-                            doc_cnt += 1
-                            sec_item['sub'].append(item)
-                        top_item['sub'].append(sec_item)
-                    else:
-                        top_item['sub'].append(sec_item)
-                doc_list.append(top_item)
-            # 如果一级文档没有下级文档，直接保存
-            else:
-                doc_list.append(top_item)
+        # 一次查询获取文集全部文档，组装为任意层级的文档树
+        doc_list,doc_cnt = get_doc_tree(
+            pid,
+            ('name','editor_mode'),
+            lambda doc,level: {
+                'id': doc['id'],
+                'name': doc['name'],
+                'editor_mode': doc['editor_mode'],
+                'parent_doc': doc['parent_doc'],
+                'top_doc': pid
+            },
+            children_key='sub',
+            keep_empty=True
+        )
 
         return JsonResponse({'status': True, 'data': doc_list,'total':doc_cnt})
     except ObjectDoesNotExist:
@@ -401,15 +371,23 @@ def get_self_docs(request):
         if kw == '':
             docs = base_docs.order_by('{}modify_time'.format(sort)).distinct()
         else:
-            doc_ids = set()
-            try:
+            def search_docs():
+                matched = set()
                 # whoosh 索引偶尔丢增量，对全文检索与数据库模糊查询取并集避免漏文档
                 own_sqs = SearchQuerySet().models(Doc).filter(create_user=token.user.id).auto_query(kw)
-                doc_ids.update(int(result.pk) for result in own_sqs)
+                matched.update(int(result.pk) for result in own_sqs)
 
                 if accessible_projects:
-                    colla_sqs = SearchQuerySet().models(Doc).filter(top_doc__in=accessible_projects).auto_query(kw)
-                    doc_ids.update(int(result.pk) for result in colla_sqs)
+                    colla_sqs = narrow_to_projects(SearchQuerySet().models(Doc), accessible_projects).auto_query(kw)
+                    matched.update(int(result.pk) for result in colla_sqs)
+                return sorted(matched)
+
+            doc_ids = set()
+            try:
+                # 命中的文档ID按搜索词、用户、文集范围和索引代数缓存
+                doc_ids.update(result_cache.get_or_compute(
+                    'api_self_docs', kw, search_docs, scope=accessible_projects, user=token.user.id,
+                ))
             except Exception:
                 logger.exception("全文检索获取文档异常")
 
@@ -520,18 +498,8 @@ def get_doc_previous_next(request):
         if project.id not in view_list:
             return JsonResponse({'status': False, 'data': _('无权限')})
 
-        try:
-            previous_doc = find_doc_previous(did)
-            previous_doc_id = previous_doc.id
-        except Exception as e:
-            logger.error("获取上一篇文档异常")
-            previous_doc_id = None
-        try:
-            next_doc = find_doc_next(did)
-            next_doc_id = next_doc.id
-        except Exception as e:
-            logger.error("获取下一篇文档异常")
-            next_doc_id = None
+        # 上一篇和下一篇文档从文集阅读顺序中查找
+        order,index,previous_doc_id,next_doc_id = project_toc.get_doc_position(project.id,doc.id)
         return JsonResponse({'status': True, 'data': {'next':next_doc_id,'previous':previous_doc_id}})
     except Exception as e:
         logger.exception("获取文档上下篇文档异常")
@@ -698,6 +666,10 @@ def modify_doc(request):
                 )
             elif doc.editor_mode == 4: # 在线表格
                 pass
+            # update() 不触发模型信号，手动刷新文档路径、搜索索引和文集目录
+            doc_path.refresh_doc(doc.id)
+            refresh_doc_index([doc.id])
+            project_toc.invalidate(project_id,doc_ids=[doc.id])
             return JsonResponse({'status': True, 'data': 'ok'})
         else:
             return JsonResponse({'status':False,'data':'非法请求'})
@@ -818,6 +790,7 @@ def delete_doc(request):
                 status=3,
                 modify_time=datetime.datetime.now(),
             )
+            project_toc.invalidate(doc.top_doc,doc_ids=[doc.id])
             return JsonResponse({'status': True, 'data': 'ok'})
         else:
             return JsonResponse({'status':False,'data':'非法请求'})
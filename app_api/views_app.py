@@ -21,6 +21,8 @@ from app_api.serializers_app import *
 from app_api.auth_app import AppAuth,AppMustAuth
 from app_doc.views import validateTitle
 from app_doc.util_upload_img import img_upload,base_img_upload
+from app_doc.utils import refresh_doc_index
+from app_doc import access_scope, doc_path, project_toc
 from loguru import logger
 import datetime
 import os
@@ -107,7 +109,7 @@ class ProjectView(APIView):
         range = request.query_params.get('range',None)
         # 获取自己的文集创建的、协作的文集列表
         if range == 'self':
-            colla_list = [i.project.id for i in ProjectCollaborator.objects.filter(user=request.user)]  # 用户的协作文集列表
+            colla_list = access_scope.get_collaborated_project_ids(request.user)  # 用户的协作文集列表
             project_list = Project.objects.filter(
                 Q(create_user=request.user) | \
                 Q(id__in=colla_list)
@@ -203,7 +205,7 @@ class ProjectView(APIView):
 
             # 没有搜索 and 认证用户 and 没有筛选
             if (is_kw is False) and (is_auth) and (is_role is False):
-                colla_list = [i.project.id for i in ProjectCollaborator.objects.filter(user=request.user)]  # 用户的协作文集列表
+                colla_list = access_scope.get_collaborated_project_ids(request.user)  # 用户的协作文集列表
                 project_list = Project.objects.filter(
                     Q(role__in=role_list) | \
                     Q(role=2, role_value__contains=str(request.user.username)) | \
@@ -224,7 +226,7 @@ class ProjectView(APIView):
                 elif role in ['3', 3]:
                     project_list = Project.objects.filter(role=3).order_by("{}create_time".format(sort_str))
                 elif role in ['99', 99]:
-                    colla_list = [i.project.id for i in ProjectCollaborator.objects.filter(user=request.user)]  # 用户的协作文集列表
+                    colla_list = access_scope.get_collaborated_project_ids(request.user)  # 用户的协作文集列表
                     project_list = Project.objects.filter(id__in=colla_list).order_by("{}create_time".format(sort_str))
                 else:
                     return Response({'code':2,'data':[]})
@@ -244,7 +246,7 @@ class ProjectView(APIView):
 
             # 有搜索 and 认证用户 and 没有筛选
             elif (is_kw) and (is_auth) and (is_role is False):
-                colla_list = [i.project.id for i in ProjectCollaborator.objects.filter(user=request.user)]  # 用户的协作文集
+                colla_list = access_scope.get_collaborated_project_ids(request.user)  # 用户的协作文集
                 # 查询所有可显示的文集
                 project_list = Project.objects.filter(
                     Q(role__in=[0, 3]) | \
@@ -278,7 +280,7 @@ class ProjectView(APIView):
                         role=3
                     ).order_by("{}create_time".format(sort_str))
                 elif role in ['99', 99]:
-                    colla_list = [i.project.id for i in ProjectCollaborator.objects.filter(user=request.user)]  # 用户的协作文集列表
+                    colla_list = access_scope.get_collaborated_project_ids(request.user)  # 用户的协作文集列表
                     project_list = Project.objects.filter(
                         Q(name__icontains=kw) | Q(intro__icontains=kw),
                         id__in=colla_list
@@ -575,6 +577,10 @@ class DocView(APIView):
                         modify_time = datetime.datetime.now(),
                         status = status
                     )
+                    # update() 不触发模型信号，手动刷新文档路径、搜索索引和文集目录
+                    doc_path.refresh_doc(doc.id)
+                    refresh_doc_index([doc.id])
+                    project_toc.invalidate(doc.top_doc,doc_ids=[doc.id])
                     return Response({'code': 0,'data':_('修改成功')})
                 else:
                     return Response({'code':2,'data':_('未授权请求')})
@@ -603,16 +609,10 @@ class DocView(APIView):
                 except ObjectDoesNotExist:
                     return Response({'code': 1, 'data': '文档不存在'})
                 if (request.user == doc.create_user) or (colla_user_role == 1) or (request.user == project.create_user):
-                    # 修改状态为删除
-                    doc.status = 3
-                    doc.modify_time = datetime.datetime.now()
-                    doc.save()
-                    # 修改其下级所有文档状态为删除
-                    chr_doc = Doc.objects.filter(parent_doc=doc_id)  # 获取下级文档
-                    chr_doc_ids = chr_doc.values_list('id', flat=True)  # 提取下级文档的ID
-                    chr_doc.update(status=3, modify_time=datetime.datetime.now())  # 修改下级文档的状态为删除
-                    Doc.objects.filter(parent_doc__in=chr_doc_ids).update(status=3,
-                                                                          modify_time=datetime.datetime.now())  # 修改下级文档的下级文档状态
+                    # 修改文档及其下级所有文档的状态为删除
+                    deleted_ids = doc_path.delete_subtrees(Doc.objects.filter(id=doc.id))
+                    refresh_doc_index(deleted_ids)
+                    project_toc.invalidate_docs(deleted_ids)
 
                     return Response({'code': 0, 'data': _('删除完成')})
                 else:
@@ -5,17 +5,110 @@ MrDoc API 搜索功能
 """
 
 import re
+import json
+import threading
 import time
-from django.http import JsonResponse
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
 from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
 
+from haystack import connections
 from haystack.query import SearchQuerySet
 from app_doc.models import Doc, Project
+from app_doc.search import trigram_index, scan_engine, result_cache, suggest_trie
+from app_doc.search.scan_engine import extract_line_context
+from app_doc.search.highlight import MyHighLighter
 from app_api.models import UserToken
 
 
+# api_search 可选的返回字段及其需要从数据库加载的 Doc 字段，preview 来自全文索引中存储的内容
+SEARCH_RESULT_FIELDS = {
+    'id': (),
+    'name': ('name',),
+    'preview': (),
+    'top_doc': ('top_doc',),
+    'times': ('create_time', 'modify_time'),
+    'content': ('content', 'pre_content'),
+}
+# 搜索结果预览的长度
+SEARCH_PREVIEW_LENGTH = 200
+# 搜索建议接口进程内缓存的 token 校验结果：{token: (是否有效, 过期时间)}
+_suggest_tokens = {}
+_suggest_tokens_lock = threading.Lock()
+# 缓存的 token 数量上限，超出时清空
+SUGGEST_TOKEN_CACHE_SIZE = 10000
+
+
+def parse_search_fields(value):
+    """
+    解析 fields 参数，返回要返回的字段集合；为空时返回全部字段
+
+    Raises:
+        ValueError: 包含不支持的字段
+    """
+    fields = {f.strip().lower() for f in (value or '').split(',') if f.strip()}
+    if not fields:
+        return set(SEARCH_RESULT_FIELDS)
+    unknown = fields - set(SEARCH_RESULT_FIELDS)
+    if unknown:
+        raise ValueError('不支持的返回字段：{}，可选值为 {}'.format(
+            ','.join(sorted(unknown)), ','.join(SEARCH_RESULT_FIELDS)
+        ))
+    return fields
+
+
+def build_search_results(page_results, fields, query):
+    """
+    为一页搜索结果构造返回数据
+
+    只用一次查询批量加载当前页的文档，并且只加载 fields 需要的字段；
+    预览从全文索引存储的内容中截取搜索词所在的片段并高亮，不读取数据库中的文档正文
+    """
+    doc_ids = [int(result.pk) for result in page_results]
+    db_fields = {'id'}
+    for field in fields:
+        db_fields.update(SEARCH_RESULT_FIELDS[field])
+    # 索引更新前已改为草稿的文档不返回
+    docs = Doc.objects.filter(status=1).only(*db_fields).in_bulk(doc_ids)
+
+    previews = {}
+    if 'preview' in fields:
+        backend = connections['default'].get_backend()
+        identifiers = {
+            doc_id: '%s.%s.%s' % (result.app_label, result.model_name, result.pk)
+            for doc_id, result in zip(doc_ids, page_results)
+        }
+        stored = backend.stored_documents(identifiers.values())
+        highlighter = MyHighLighter(query, max_length=SEARCH_PREVIEW_LENGTH)
+        for doc_id, identifier in identifiers.items():
+            content = stored.get(identifier, {}).get('content')
+            previews[doc_id] = highlighter.highlight(content) if content else ''
+
+    results = []
+    for doc_id in doc_ids:
+        doc = docs.get(doc_id)
+        # 搜索结果缓存期间被删除或改为草稿的文档直接跳过
+        if doc is None:
+            continue
+        item = {'id': doc.id}
+        if 'name' in fields:
+            item['name'] = doc.name
+        if 'content' in fields:
+            # 优先使用完整内容 (content)，如果为空才使用 pre_content
+            item['content'] = doc.content if doc.content else doc.pre_content
+        if 'preview' in fields:
+            item['preview'] = previews.get(doc_id, '')
+        if 'top_doc' in fields:
+            item['top_doc'] = doc.top_doc
+        if 'times' in fields:
+            item['create_time'] = doc.create_time.strftime('%Y-%m-%d %H:%M:%S')
+            item['modify_time'] = doc.modify_time.strftime('%Y-%m-%d %H:%M:%S')
+        results.append(item)
+    return results
+
+
 def get_client_ip(request):
     """获取客户端IP地址"""
     x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
@@ -26,6 +119,113 @@ def get_client_ip(request):
     return ip
 
 
+def ndjson_response(results, page_num, limit, start_time, search_params):
+    """
+    NDJSON 流式响应
+
+    每个匹配文档输出一行 JSON（结构与普通模式 results 中的元素一致），
+    最后输出一行 {"summary": {...}}。结果按需从生成器中取出，
+    当前页填满后立即停止扫描，不再遍历剩余文档。
+    与普通模式不同，页码超出范围时不会回退到最后一页，只输出 summary。
+    """
+    limit = max(limit, 1)
+    skip = max(page_num - 1, 0) * limit
+
+    def generate():
+        returned_docs = 0
+        returned_matches = 0
+        complete = True
+        try:
+            for index, result in enumerate(results):
+                if index < skip:
+                    continue
+                yield json.dumps(result, ensure_ascii=False) + '\n'
+                returned_docs += 1
+                returned_matches += result['match_count']
+                if returned_docs >= limit:
+                    # 当前页已填满，停止扫描
+                    complete = False
+                    break
+        except Exception as e:
+            yield json.dumps({'status': False, 'data': str(e)}, ensure_ascii=False) + '\n'
+            return
+
+        summary = {
+            'page': page_num,
+            'limit': limit,
+            'returned_docs': returned_docs,
+            'returned_matches': returned_matches,
+            'complete': complete,  # False 表示扫描提前结束，后续页可能还有结果
+            'elapsed_time': int((time.time() * 1000) - start_time),
+            'search_params': search_params,
+        }
+        yield json.dumps({'summary': summary}, ensure_ascii=False) + '\n'
+
+    response = StreamingHttpResponse(generate(), content_type='application/x-ndjson; charset=utf-8')
+    response['X-Accel-Buffering'] = 'no'  # 禁止 Nginx 缓冲，保证结果即时送达
+    return response
+
+
+def iter_grep_results(sqs, pattern, candidate_ids, before, after, line_num):
+    """逐篇生成 grep 搜索的匹配文档结果"""
+    for result in sqs:
+        if candidate_ids is not None and int(result.pk) not in candidate_ids:
+            continue
+        doc = result.object
+        # 索引更新前已删除或改为草稿的文档跳过
+        if doc is None or doc.status != 1:
+            continue
+        # 优先使用完整内容 (content)，如果为空才使用 pre_content
+        content = doc.content if doc.content else doc.pre_content
+        lines = content.split('\n')
+
+        # 查找所有匹配行
+        matches = []
+        for line_idx, line in enumerate(lines):
+            if pattern.search(line):
+                # 提取上下文
+                before_lines, after_lines = extract_line_context(lines, line_idx, before, after)
+                matches.append({
+                    'line_num': line_idx + 1 if line_num else None,
+                    'line': line,
+                    'before': before_lines,
+                    'after': after_lines,
+                })
+
+        if matches:
+            yield {
+                'doc_id': doc.id,
+                'doc_name': doc.name,
+                'project_id': doc.top_doc,
+                'matches': matches,
+                'match_count': len(matches),
+            }
+
+
+def iter_content_results(doc_matches):
+    """为逐篇匹配结果补充文集名称，生成内容搜索的匹配文档结果"""
+    # 获取文集信息缓存
+    project_cache = {}
+
+    for doc_id, doc_name, top_doc, matches in doc_matches:
+        # 获取文集名称
+        if top_doc not in project_cache:
+            try:
+                project = Project.objects.get(id=top_doc)
+                project_cache[top_doc] = project.name
+            except Project.DoesNotExist:
+                project_cache[top_doc] = '未知文集'
+
+        yield {
+            'doc_id': doc_id,
+            'doc_name': doc_name,
+            'project_id': top_doc,
+            'project_name': project_cache[top_doc],
+            'matches': matches,
+            'match_count': len(matches),
+        }
+
+
 @require_http_methods(["GET"])
 def api_search(request):
     """
@@ -38,6 +238,9 @@ def api_search(request):
         field: 搜索字段 all/title/content，默认 all
         page: 页码，默认 1
         limit: 每页数量，默认 10
+        fields: 返回的字段，逗号分隔，可选 id,name,preview,top_doc,times,content，默认全部；
+                times 包含 create_time 和 modify_time，不需要正文时不要包含 content
+                preview 为索引内容中搜索词所在的片段，搜索词以 <span class="highlighted"> 标记
 
     返回:
         {
@@ -47,7 +250,9 @@ def api_search(request):
                 "total": 总数量,
                 "page": 当前页,
                 "limit": 每页数量,
-                "elapsed_time": 搜索耗时(ms)
+                "elapsed_time": 搜索耗时(ms),
+                "partial": 搜索是否超出时间预算，为 true 时只对已收集到的部分结果分页,
+                "estimated_total": 估算的命中总数，结果完整时与 total 相同
             }
         }
     """
@@ -69,10 +274,15 @@ def api_search(request):
     search_field = request.GET.get('field', 'all').lower()  # all/title/content
     page_num = int(request.GET.get('page', 1))
     limit = int(request.GET.get('limit', 10))
+    try:
+        fields = parse_search_fields(request.GET.get('fields', ''))
+    except ValueError as e:
+        return JsonResponse({'status': False, 'data': str(e)})
 
     # 执行搜索
     try:
-        sqs = SearchQuerySet().models(Doc).filter(status=1)
+        # 全文索引只收录已发布的文档（DocIndex.index_queryset），索引中没有 status 字段，不能按其过滤
+        sqs = SearchQuerySet().models(Doc)
 
         # 处理 AND/OR 模式
         if search_mode == 'and':
@@ -93,8 +303,11 @@ def api_search(request):
             # 全文搜索（标题+内容）
             sqs = sqs.auto_query(search_query)
 
-        # 分页
-        paginator = Paginator(sqs, limit)
+        # 分页：结果ID列表按搜索条件和索引代数缓存，翻页时对其切片
+        results_list = result_cache.cached_results(
+            'api_search', query, sqs, load_objects=False, mode=search_mode, field=search_field,
+        )
+        paginator = Paginator(results_list, limit)
         try:
             results_page = paginator.page(page_num)
         except PageNotAnInteger:
@@ -102,21 +315,8 @@ def api_search(request):
         except EmptyPage:
             results_page = paginator.page(paginator.num_pages)
 
-        # 构造返回结果
-        results = []
-        for result in results_page:
-            doc = result.object
-            # 优先使用完整内容 (content)，如果为空才使用 pre_content
-            full_content = doc.content if doc.content else doc.pre_content
-            results.append({
-                'id': doc.id,
-                'name': doc.name,
-                'content': full_content,  # 完整文章内容
-                'preview': full_content[:200] if full_content else '',  # 前200字符预览
-                'top_doc': doc.top_doc,
-                'create_time': doc.create_time.strftime('%Y-%m-%d %H:%M:%S'),
-                'modify_time': doc.modify_time.strftime('%Y-%m-%d %H:%M:%S'),
-            })
+        # 构造返回结果：当前页的文档一次批量加载
+        results = build_search_results(list(results_page), fields, query)
 
         elapsed_time = int((time.time() * 1000) - start_time)
 
@@ -130,6 +330,8 @@ def api_search(request):
                 'elapsed_time': elapsed_time,
                 'search_mode': search_mode,
                 'search_field': search_field,
+                'partial': results_list.partial,
+                'estimated_total': results_list.estimated_total,
             }
         })
 
@@ -137,6 +339,58 @@ def api_search(request):
         return JsonResponse({'status': False, 'data': str(e)})
 
 
+def check_suggest_token(token):
+    """
+    校验搜索建议接口的 token
+
+    输入每个字符都会请求一次建议，校验结果在进程内缓存 SEARCH_SUGGEST_TOKEN_TTL 秒，
+    缓存期间不查询数据库；重置或删除的 token 最迟在缓存过期后失效
+    """
+    if not token:
+        return False
+    now = time.monotonic()
+    with _suggest_tokens_lock:
+        cached = _suggest_tokens.get(token)
+    if cached is not None and cached[1] > now:
+        return cached[0]
+    valid = UserToken.objects.filter(token=token).exists()
+    with _suggest_tokens_lock:
+        if len(_suggest_tokens) >= SUGGEST_TOKEN_CACHE_SIZE:
+            _suggest_tokens.clear()
+        _suggest_tokens[token] = (valid, now + getattr(settings, 'SEARCH_SUGGEST_TOKEN_TTL', 60))
+    return valid
+
+
+@require_http_methods(["GET"])
+def api_search_suggest(request):
+    """
+    搜索建议（自动补全）接口
+
+    建议来自热门搜索词、公开文集名称和公开文档标题，查询只读取进程内的前缀树
+
+    参数:
+        token: API Token (必需)
+        q: 用户已输入的前缀，为空时返回热门建议
+        limit: 返回数量，默认 10，最多为配置的 suggest_top_k
+
+    返回:
+        {"status": true, "data": ["建议1", "建议2", ...]}
+    """
+    # 验证 token
+    if not check_suggest_token(request.GET.get('token', '')):
+        return JsonResponse({'status': False, 'data': 'token无效'})
+
+    try:
+        limit = int(request.GET.get('limit', 10))
+    except ValueError:
+        limit = 10
+    try:
+        suggestions = suggest_trie.suggest(request.GET.get('q', ''), max(limit, 1))
+    except Exception as e:
+        return JsonResponse({'status': False, 'data': str(e)})
+    return JsonResponse({'status': True, 'data': suggestions})
+
+
 @require_http_methods(["GET"])
 def api_grep_search(request):
     """
@@ -155,6 +409,9 @@ def api_grep_search(request):
         ignore_case: 是否忽略大小写，默认 False
         page: 页码，默认 1
         limit: 每页文档数量，默认 10
+        format: 响应格式 json/ndjson，默认 json；
+                ndjson 为流式响应，每个匹配文档一行，最后一行为 {"summary": {...}}，
+                当前页填满后即停止扫描
 
     返回:
         {
@@ -209,10 +466,12 @@ def api_grep_search(request):
     # 分页参数
     page_num = int(request.GET.get('page', 1))
     limit = int(request.GET.get('limit', 10))
+    response_format = request.GET.get('format', 'json').lower()  # json/ndjson
 
     try:
         # 第一步：使用 Haystack 全文搜索获取文档列表
-        sqs = SearchQuerySet().models(Doc).filter(status=1)
+        # 全文索引只收录已发布的文档（DocIndex.index_queryset），索引中没有 status 字段，不能按其过滤
+        sqs = SearchQuerySet().models(Doc)
 
         # 处理 AND/OR 模式
         if search_mode == 'and':
@@ -229,67 +488,43 @@ def api_grep_search(request):
         else:
             sqs = sqs.auto_query(search_query)
 
+        # 准备正则表达式
+        if use_regex:
+            try:
+                flags = re.IGNORECASE if ignore_case else 0
+                pattern = re.compile(query, flags)
+            except re.error as e:
+                return JsonResponse({'status': False, 'data': f'正则表达式错误: {str(e)}'})
+        else:
+            # 普通文本搜索，转义特殊字符
+            escaped_query = re.escape(query)
+            flags = re.IGNORECASE if ignore_case else 0
+            pattern = re.compile(escaped_query, flags)
+
+        # 使用三元组索引筛选可能匹配的文档，跳过不可能匹配的文档的加载
+        candidate_ids = trigram_index.candidate_doc_ids(
+            pattern.pattern, Doc.objects.filter(status=1)
+        )
+
+        search_params = {
+            'query': query,
+            'regex': use_regex,
+            'mode': search_mode,
+            'field': search_field,
+            'before': before,
+            'after': after,
+            'ignore_case': ignore_case,
+        }
+
         # 第二步：对每个文档内容进行正则匹配和上下文提取
-        all_results = []
-        total_matches = 0
+        results = iter_grep_results(sqs, pattern, candidate_ids, before, after, line_num)
 
-        for result in sqs:
-            doc = result.object
-            # 优先使用完整内容 (content)，如果为空才使用 pre_content
-            content = doc.content if doc.content else doc.pre_content
-            lines = content.split('\n')
-
-            # 准备正则表达式
-            if use_regex:
-                try:
-                    flags = re.IGNORECASE if ignore_case else 0
-                    pattern = re.compile(query, flags)
-                except re.error as e:
-                    return JsonResponse({'status': False, 'data': f'正则表达式错误: {str(e)}'})
-            else:
-                # 普通文本搜索，转义特殊字符
-                escaped_query = re.escape(query)
-                flags = re.IGNORECASE if ignore_case else 0
-                pattern = re.compile(escaped_query, flags)
-
-            # 查找所有匹配行
-            matches = []
-            for line_idx, line in enumerate(lines):
-                if pattern.search(line):
-                    # 提取上下文
-                    before_lines = []
-                    if before > 0:
-                        start = max(0, line_idx - before)
-                        before_lines = [
-                            {'line_num': i + 1, 'line': lines[i]}
-                            for i in range(start, line_idx)
-                        ]
-
-                    after_lines = []
-                    if after > 0:
-                        end = min(len(lines), line_idx + after + 1)
-                        after_lines = [
-                            {'line_num': i + 1, 'line': lines[i]}
-                            for i in range(line_idx + 1, end)
-                        ]
-
-                    match_info = {
-                        'line_num': line_idx + 1 if line_num else None,
-                        'line': line,
-                        'before': before_lines if before > 0 else [],
-                        'after': after_lines if after > 0 else [],
-                    }
-                    matches.append(match_info)
-                    total_matches += 1
-
-            if matches:
-                all_results.append({
-                    'doc_id': doc.id,
-                    'doc_name': doc.name,
-                    'project_id': doc.top_doc,
-                    'matches': matches,
-                    'match_count': len(matches),
-                })
+        # NDJSON 流式模式：逐篇输出，当前页填满即停止
+        if response_format == 'ndjson':
+            return ndjson_response(results, page_num, limit, start_time, search_params)
+
+        all_results = list(results)
+        total_matches = sum(r['match_count'] for r in all_results)
 
         # 第三步：分页
         paginator = Paginator(all_results, limit)
@@ -311,15 +546,7 @@ def api_grep_search(request):
                 'page': results_page.number,
                 'limit': limit,
                 'elapsed_time': elapsed_time,
-                'search_params': {
-                    'query': query,
-                    'regex': use_regex,
-                    'mode': search_mode,
-                    'field': search_field,
-                    'before': before,
-                    'after': after,
-                    'ignore_case': ignore_case,
-                }
+                'search_params': search_params,
             }
         })
 
@@ -355,6 +582,9 @@ def api_search_content(request):
         context_lines: (兼容参数) 统一设置前后行数，优先级低于 before_lines/after_lines
         page: 页码，默认 1
         limit: 每页文档数量，默认 20
+        format: 响应格式 json/ndjson，默认 json；
+                ndjson 为流式响应，每个匹配文档一行，最后一行为 {"summary": {...}}，
+                当前页填满或达到 max_results 后即停止扫描
 
     返回:
         {
@@ -426,6 +656,7 @@ def api_search_content(request):
 
     page_num = int(params.get('page', 1))
     limit = int(params.get('limit', 20))
+    response_format = str(params.get('format', 'json')).lower()  # json/ndjson
 
     # 验证搜索模式
     if search_mode not in ['exact', 'fuzzy', 'regex']:
@@ -472,88 +703,39 @@ def api_search_content(request):
             flags = 0 if case_sensitive else re.IGNORECASE
             compiled_pattern = re.compile(escaped_pattern, flags)
 
-        # 第三步：对每个文档进行搜索
-        all_results = []
-        total_matches = 0
-        docs_found = 0
-
-        # 获取文集信息缓存
-        project_cache = {}
-
-        for doc in docs_query:
-            # 检查是否已达到最大文档数
-            if docs_found >= max_results:
-                break
-
-            # 获取文档内容
-            content = doc.content if doc.content else doc.pre_content
-            if not content:
-                continue
-
-            lines = content.split('\n')
+        search_params = {
+            'pattern': pattern,
+            'search_mode': search_mode,
+            'case_sensitive': case_sensitive,
+            'pid': pid,
+            'max_results': max_results,
+            'before_lines': before_lines,
+            'after_lines': after_lines,
+        }
 
-            # 查找所有匹配行
-            matches = []
-            doc_match_count = 0
+        # 第三步：对每个文档进行搜索
+        # 使用三元组索引筛选候选文档，模式中没有可用的三元组时逐篇扫描
+        candidate_ids = trigram_index.candidate_doc_ids(compiled_pattern.pattern, docs_query)
+        if pid == 0 and candidate_ids is None and scan_engine.get_worker_count() > 1:
+            candidate_ids = set(docs_query.values_list('id', flat=True))
+        if pid == 0 and candidate_ids is not None and scan_engine.should_parallelize(len(candidate_ids)):
+            # 全局搜索且候选文档较多：使用进程池并行扫描
+            doc_matches = scan_engine.iter_parallel_matches(
+                candidate_ids, compiled_pattern, before_lines, after_lines, max_results
+            )
+        else:
+            doc_matches = scan_engine.iter_serial_matches(
+                trigram_index.iter_docs(docs_query, candidate_ids),
+                compiled_pattern, before_lines, after_lines, max_results
+            )
+        results = iter_content_results(doc_matches)
 
-            for line_idx, line in enumerate(lines):
-                # 检查是否已达到最大匹配数
-                if total_matches >= max_results:
-                    break
+        # NDJSON 流式模式：逐篇输出，当前页填满或达到 max_results 即停止
+        if response_format == 'ndjson':
+            return ndjson_response(results, page_num, limit, start_time, search_params)
 
-                match = compiled_pattern.search(line)
-                if match:
-                    # 计算匹配位置
-                    match_positions = []
-                    for m in compiled_pattern.finditer(line):
-                        match_positions.append([m.start(), m.end()])
-
-                    # 提取上下文（使用独立的 before_lines 和 after_lines）
-                    before_context = []
-                    if before_lines > 0:
-                        start = max(0, line_idx - before_lines)
-                        before_context = [
-                            {'line_num': i + 1, 'line': lines[i]}
-                            for i in range(start, line_idx)
-                        ]
-
-                    after_context = []
-                    if after_lines > 0:
-                        end = min(len(lines), line_idx + after_lines + 1)
-                        after_context = [
-                            {'line_num': i + 1, 'line': lines[i]}
-                            for i in range(line_idx + 1, end)
-                        ]
-
-                    match_info = {
-                        'line_num': line_idx + 1,
-                        'line': line,
-                        'match_positions': match_positions,
-                        'before_context': before_context,
-                        'after_context': after_context,
-                    }
-                    matches.append(match_info)
-                    doc_match_count += 1
-                    total_matches += 1
-
-            if matches:
-                # 获取文集名称
-                if doc.top_doc not in project_cache:
-                    try:
-                        project = Project.objects.get(id=doc.top_doc)
-                        project_cache[doc.top_doc] = project.name
-                    except Project.DoesNotExist:
-                        project_cache[doc.top_doc] = '未知文集'
-
-                all_results.append({
-                    'doc_id': doc.id,
-                    'doc_name': doc.name,
-                    'project_id': doc.top_doc,
-                    'project_name': project_cache[doc.top_doc],
-                    'matches': matches,
-                    'match_count': doc_match_count,
-                })
-                docs_found += 1
+        all_results = list(results)
+        total_matches = sum(r['match_count'] for r in all_results)
 
         # 第四步：分页
         paginator = Paginator(all_results, limit)
@@ -575,15 +757,7 @@ def api_search_content(request):
                 'page': results_page.number,
                 'limit': limit,
                 'elapsed_time': elapsed_time,
-                'search_params': {
-                    'pattern': pattern,
-                    'search_mode': search_mode,
-                    'case_sensitive': case_sensitive,
-                    'pid': pid,
-                    'max_results': max_results,
-                    'before_lines': before_lines,
-                    'after_lines': after_lines,
-                }
+                'search_params': search_params,
             }
         })
 
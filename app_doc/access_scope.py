@@ -0,0 +1,113 @@
+# coding:utf-8
+# @文件: access_scope.py
+# 用户可访问的文集范围
+# 每个用户创建的文集、参与协作的文集，以及所有用户共用的公开文集ID集合缓存在 Django 缓存中；
+# 缓存键包含保存在数据库中的版本号（AccessScopeVersion），文集新建/删除/权限变化、协作成员增删改时
+# 通过信号增加版本号，默认的进程内缓存（locmem）在所有进程中同时失效；
+# 使用 QuerySet.update() 批量修改的地方需要手动调用 invalidate_public / invalidate_user
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+
+from app_doc.models import AccessScopeVersion, Project, ProjectCollaborator
+
+
+PUBLIC_VERSION_KEY = 'public'
+USER_VERSION_KEY = 'user:{}'
+CACHE_KEY = 'access_scope:{}:{}'
+
+
+def _get_timeout():
+    return getattr(settings, 'ACCESS_SCOPE_CACHE_TIMEOUT', 300)
+
+
+def get_versions(*keys):
+    """一次查询获取多个版本号（文集范围、同义词等），没有记录的版本号为 0"""
+    versions = dict(AccessScopeVersion.objects.filter(key__in=keys).values_list('key', 'version'))
+    return [versions.get(key, 0) for key in keys]
+
+
+def bump_versions(keys):
+    keys = set(keys)
+    if not keys:
+        return
+    # 先补齐缺少的记录再统一加一，并发修改时版本号不会漏加
+    AccessScopeVersion.objects.bulk_create(
+        [AccessScopeVersion(key=key) for key in keys], ignore_conflicts=True
+    )
+    AccessScopeVersion.objects.filter(key__in=keys).update(version=F('version') + 1)
+
+
+def _get_public_ids(version):
+    key = CACHE_KEY.format(PUBLIC_VERSION_KEY, version)
+    ids = cache.get(key)
+    if ids is None:
+        ids = frozenset(Project.objects.filter(role=0).values_list('id', flat=True))
+        cache.set(key, ids, _get_timeout())
+    return ids
+
+
+def get_public_project_ids():
+    """公开文集ID集合，所有用户（包括游客）共用"""
+    return _get_public_ids(*get_versions(PUBLIC_VERSION_KEY))
+
+
+def _get_user_scope(user, version=None):
+    version_key = USER_VERSION_KEY.format(user.id)
+    if version is None:
+        version, = get_versions(version_key)
+    key = CACHE_KEY.format(version_key, version)
+    scope = cache.get(key)
+    if scope is None:
+        collaborators = ProjectCollaborator.objects.filter(user_id=user.id).values_list('project_id', 'role')
+        scope = {
+            # 自己创建的文集
+            'own': frozenset(Project.objects.filter(create_user_id=user.id).values_list('id', flat=True)),
+            # 参与协作的文集
+            'colla': frozenset(project_id for project_id, _ in collaborators),
+            # 协作模式为可修改所有文档的协作文集
+            'colla_edit': frozenset(project_id for project_id, role in collaborators if role == 1),
+        }
+        cache.set(key, scope, _get_timeout())
+    return scope
+
+
+def get_own_project_ids(user):
+    """用户创建的文集ID集合"""
+    return _get_user_scope(user)['own']
+
+
+def get_collaborated_project_ids(user):
+    """用户参与协作的文集ID集合"""
+    return _get_user_scope(user)['colla']
+
+
+def get_readable_project_ids(user):
+    """用户创建和参与协作的文集ID集合（不含他人的公开文集）"""
+    scope = _get_user_scope(user)
+    return scope['own'] | scope['colla']
+
+
+def get_editable_project_ids(user):
+    """用户创建的以及协作模式为可修改所有文档的文集ID集合"""
+    scope = _get_user_scope(user)
+    return scope['own'] | scope['colla_edit']
+
+
+def get_visible_project_ids(user):
+    """用户可浏览的文集ID集合：公开文集 + 自己创建的文集 + 参与协作的文集，游客只有公开文集"""
+    if user is None or not user.is_authenticated:
+        return get_public_project_ids()
+    # 公开文集和用户的版本号一次查询
+    public_version, user_version = get_versions(PUBLIC_VERSION_KEY, USER_VERSION_KEY.format(user.id))
+    scope = _get_user_scope(user, user_version)
+    return _get_public_ids(public_version) | scope['own'] | scope['colla']
+
+
+def invalidate_public():
+    bump_versions([PUBLIC_VERSION_KEY])
+
+
+def invalidate_user(*user_ids):
+    bump_versions([USER_VERSION_KEY.format(i) for i in user_ids if i is not None])
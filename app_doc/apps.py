@@ -3,3 +3,11 @@ from django.apps import AppConfig
 
 class AppDocConfig(AppConfig):
     name = 'app_doc'
+
+    def ready(self):
+        # 注册文档模型信号
+        from app_doc import signals  # noqa
+        # 处理第一个请求时继续处理上次运行遗留的索引更新队列；不在此处查询数据库，migrate 等命令不受影响
+        from django.core.signals import request_started
+        from app_doc.search import index_queue
+        request_started.connect(index_queue.resume_pending, dispatch_uid='app_doc_resume_index_queue')
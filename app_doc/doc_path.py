@@ -0,0 +1,289 @@
+# coding:utf-8
+# @文件: doc_path.py
+# 文档层级路径
+# Doc.path 保存从一级文档到文档自身的文档ID链，如 /12/57/301/，文档及其全部下级文档即 path 以该文档 path 开头的文档。
+# 下级文档树的移动、删除各用一条 UPDATE 语句完成，复制为一次批量插入加一次批量更新，不再逐级查询下级文档。
+# 模型 save() 修改上级文档时由信号维护路径；使用 QuerySet.update() 修改 parent_doc 的地方需要手动调用
+# refresh_doc / rebuild_project；已有数据使用 rebuild_doc_path 命令生成路径
+
+import datetime
+from collections import defaultdict
+
+from django.db import connection, transaction
+from django.db.models import Case, F, Max, Q, Value, When
+from django.db.models.functions import Concat, Length, Substr
+from loguru import logger
+
+from app_doc.models import Doc
+
+
+# 路径的最大长度，超出时文档层级过深，不生成路径（不写入截断的路径）
+PATH_MAX_LENGTH = Doc._meta.get_field('path').max_length
+
+
+def make_path(parent_path, doc_id):
+    """由上级文档的路径生成文档路径，一级文档的上级路径为空；路径超出最大长度时抛出 ValueError"""
+    path = '{}{}/'.format(parent_path or '/', doc_id)
+    if len(path) > PATH_MAX_LENGTH:
+        raise ValueError("文档层级过深")
+    return path
+
+
+def build_paths(rows, base_paths=None):
+    """
+    由 (文档ID, 上级文档ID) 列表计算各文档的路径，返回 {文档ID: 路径}
+
+    上级文档不在 rows 中的文档以 base_paths 中上级文档的路径为前缀，没有时作为一级文档；
+    上级关系出现环时，环上第一个文档作为一级文档；层级过深的文档及其下级文档的路径为空字符串
+    """
+    base_paths = base_paths or {}
+    ids = {doc_id for doc_id, parent_id in rows}
+    children = defaultdict(list)
+    roots = []
+    for doc_id, parent_id in rows:
+        if parent_id and parent_id in ids and parent_id != doc_id:
+            children[parent_id].append(doc_id)
+        else:
+            roots.append((doc_id, base_paths.get(parent_id, '')))
+
+    paths = {}
+    # 先从一级文档开始遍历，剩下未遍历到的文档在环上
+    starts = roots + [(doc_id, '') for doc_id, parent_id in rows]
+    for root_id, prefix in starts:
+        if root_id in paths:
+            continue
+        stack = [(root_id, prefix)]
+        while stack:
+            doc_id, prefix = stack.pop()
+            if doc_id in paths:
+                continue
+            try:
+                paths[doc_id] = make_path(prefix, doc_id) if prefix is not None else ''
+            except ValueError:
+                paths[doc_id] = ''
+            stack.extend((child_id, paths[doc_id] or None) for child_id in children.get(doc_id, ()))
+    return paths
+
+
+def rebuild_project(pro_id, batch_size=500):
+    """重新计算文集全部文档的路径，只写入变化的文档，返回更新的文档数量"""
+    rows = list(Doc.objects.filter(top_doc=pro_id).values_list('id', 'parent_doc', 'path'))
+    ids = {row[0] for row in rows}
+    # 上级文档在其他文集中时沿用其路径
+    outside = {row[1] for row in rows if row[1] and row[1] not in ids}
+    base_paths = dict(Doc.objects.filter(id__in=outside).exclude(path='').values_list('id', 'path')) if outside else {}
+    paths = build_paths([(doc_id, parent_id) for doc_id, parent_id, path in rows], base_paths)
+    changed = [Doc(id=doc_id, path=paths[doc_id]) for doc_id, parent_id, path in rows if paths[doc_id] != path]
+    too_deep = sum(1 for path in paths.values() if not path)
+    if too_deep:
+        logger.warning("文集{}中有{}篇文档层级过深，未生成层级路径".format(pro_id, too_deep))
+    if changed:
+        Doc.objects.bulk_update(changed, ['path'], batch_size=batch_size)
+    return len(changed)
+
+
+def rebuild_docs(doc_ids):
+    """重新计算指定文档所属文集的文档路径，用于批量修改上级文档之后"""
+    doc_ids = [i for i in doc_ids if i]
+    if doc_ids:
+        for pro_id in Doc.objects.filter(id__in=doc_ids).values_list('top_doc', flat=True).distinct():
+            rebuild_project(pro_id)
+
+
+def ensure_project(pro_id):
+    """文集存在还没有路径的文档（如升级后未执行 rebuild_doc_path）时先生成路径"""
+    if Doc.objects.filter(top_doc=pro_id, path='').exists():
+        rebuild_project(pro_id)
+
+
+def get_path(doc_id):
+    """获取文档的路径，文档不存在时返回空字符串"""
+    doc = Doc.objects.filter(id=doc_id).values('top_doc', 'path').first()
+    if doc is None:
+        return ''
+    if not doc['path']:
+        rebuild_project(doc['top_doc'])
+        return Doc.objects.filter(id=doc_id).values_list('path', flat=True).first()
+    return doc['path']
+
+
+def _require_path(doc_id):
+    """获取文档的路径，文档层级过深没有路径时抛出 ValueError，避免以空路径匹配全部文档"""
+    path = get_path(doc_id)
+    if not path:
+        raise ValueError("文档层级过深")
+    return path
+
+
+def _replace_prefix(old_path, new_path, **fields):
+    """
+    将路径以 old_path 开头的文档（文档自身及全部下级文档）的路径前缀替换为 new_path，一条 UPDATE 语句
+
+    新路径变长时先检查最长的下级文档路径，超出最大长度时抛出 ValueError，不修改任何文档
+    """
+    subtree = Doc.objects.filter(path__startswith=old_path)
+    if len(new_path) > len(old_path):
+        longest = subtree.aggregate(longest=Max(Length('path')))['longest'] or len(old_path)
+        if longest - len(old_path) + len(new_path) > PATH_MAX_LENGTH:
+            raise ValueError("文档层级过深")
+    return subtree.update(
+        path=Concat(Value(new_path), Substr('path', len(old_path) + 1)),
+        **fields
+    )
+
+
+def refresh_doc(doc_id):
+    """文档的上级文档修改后更新文档及其下级文档的路径"""
+    doc = Doc.objects.filter(id=doc_id).values('id', 'parent_doc', 'top_doc', 'path').first()
+    if doc is None:
+        return
+    if not doc['path']:
+        rebuild_project(doc['top_doc'])
+        return
+    parent_path = get_path(doc['parent_doc']) if doc['parent_doc'] else ''
+    # 上级文档为自身的下级文档时作为一级文档处理，避免路径无限增长
+    if parent_path.startswith(doc['path']):
+        logger.warning("文档{}的上级文档关系出现环".format(doc_id))
+        parent_path = ''
+    try:
+        if doc['parent_doc'] and not parent_path:
+            raise ValueError("文档层级过深")
+        new_path = make_path(parent_path, doc_id)
+        if new_path != doc['path']:
+            _replace_prefix(doc['path'], new_path)
+    except ValueError:
+        # 上级文档已经修改，层级过深时清空路径，不保留指向原上级文档的路径
+        logger.warning("文档{}的层级过深，未生成层级路径".format(doc_id))
+        Doc.objects.filter(path__startswith=doc['path']).update(path='')
+
+
+def get_subtree_ids(path):
+    """路径对应文档及其全部下级文档的ID"""
+    return list(Doc.objects.filter(path__startswith=path).values_list('id', flat=True))
+
+
+def _get_target_path(doc, parent_id):
+    """文档移动或复制到 parent_id 下时的上级路径，parent_id 为文档自身或其下级文档时抛出 ValueError"""
+    if not parent_id:
+        return ''
+    parent_path = _require_path(parent_id)
+    if parent_path.startswith(doc.path):
+        raise ValueError("不能移动到文档自身或其下级文档中")
+    return parent_path
+
+
+def move_subtree(doc, parent_id, pro_id):
+    """
+    连同全部下级文档移动到指定文集的上级文档下，返回移动的文档ID列表
+
+    所属文集、上级文档、路径在一条 UPDATE 语句中修改
+    """
+    parent_id, pro_id = int(parent_id or 0), int(pro_id)
+    ensure_project(doc.top_doc)
+    doc.path = _require_path(doc.id)
+    parent_path = _get_target_path(doc, parent_id)
+    with transaction.atomic():
+        doc_ids = get_subtree_ids(doc.path)
+        _replace_prefix(
+            doc.path, make_path(parent_path, doc.id),
+            top_doc=pro_id,
+            parent_doc=Case(When(id=doc.id, then=Value(parent_id)), default=F('parent_doc')),
+        )
+    return doc_ids
+
+
+def lift_children(doc):
+    """文档的下级文档改为所在文集的一级文档，各层级的路径在一条 UPDATE 语句中修改，返回受影响的文档ID列表"""
+    ensure_project(doc.top_doc)
+    path = _require_path(doc.id)
+    descendants = Doc.objects.filter(path__startswith=path).exclude(id=doc.id)
+    doc_ids = list(descendants.values_list('id', flat=True))
+    # /a/b/doc/c/d/ 去掉 /a/b/doc 前缀后为 /c/d/
+    descendants.update(
+        path=Substr('path', len(path)),
+        parent_doc=Case(When(parent_doc=doc.id, then=Value(0)), default=F('parent_doc')),
+    )
+    return doc_ids
+
+
+def copy_subtree(doc, parent_id, pro_id, user):
+    """
+    复制文档及其全部下级文档（不含回收站中的文档）到指定文集的上级文档下，返回 (新的文档, 新文档ID列表)
+
+    新文档一次批量插入，上级文档和路径一次批量更新；数据库不支持批量插入返回ID时逐个插入
+    """
+    parent_id, pro_id = int(parent_id or 0), int(pro_id)
+    ensure_project(doc.top_doc)
+    doc.path = _require_path(doc.id)
+    parent_path = _get_target_path(doc, parent_id)
+    # 复制源文档路径中文档自身之前的部分，用于取得相对路径 /doc/c/d/
+    base_len = len(doc.path) - len(str(doc.id)) - 1
+    sources = list(Doc.objects.filter(
+        Q(id=doc.id) | Q(status__in=[0, 1]), path__startswith=doc.path
+    ).order_by('path'))
+    source_ids = {d.id for d in sources}
+    # 上级文档在回收站中的文档不复制
+    sources = [
+        d for d in sources
+        if all(int(i) in source_ids for i in d.path[base_len:].strip('/').split('/'))
+    ]
+    # 复制后的文档ID位数可能变多，按目标文档ID位数估算最长路径
+    id_len = len(str(Doc.objects.aggregate(max_id=Max('id'))['max_id'] + len(sources)))
+    depth = max(d.path[base_len:].count('/') - 1 for d in sources)
+    if len(parent_path or '/') + depth * (id_len + 1) > PATH_MAX_LENGTH:
+        raise ValueError("文档层级过深")
+
+    now = datetime.datetime.now()
+    copies = [Doc(
+        name=d.name,
+        pre_content=d.pre_content,
+        content=d.content,
+        parent_doc=0,
+        top_doc=pro_id,
+        sort=d.sort,
+        editor_mode=d.editor_mode,
+        open_children=d.open_children,
+        show_children=d.show_children,
+        create_user=user,
+        create_time=now,
+        modify_time=now,
+        # 文档状态说明：0表示草稿状态，1表示发布状态
+        status=d.status,
+    ) for d in sources]
+    with transaction.atomic():
+        if connection.features.can_return_rows_from_bulk_insert:
+            Doc.objects.bulk_create(copies, batch_size=500)
+        else:
+            for copy in copies:
+                copy.save()
+        id_map = {d.id: c.id for d, c in zip(sources, copies)}
+        for d, c in zip(sources, copies):
+            c.parent_doc = parent_id if d.id == doc.id else id_map[d.parent_doc]
+            c.path = (parent_path or '/') + ''.join(
+                '{}/'.format(id_map[int(i)]) for i in d.path[base_len:].strip('/').split('/')
+            )
+        Doc.objects.bulk_update(copies, ['parent_doc', 'path'], batch_size=500)
+    return copies[0], [c.id for c in copies]
+
+
+def delete_subtrees(docs):
+    """
+    将文档及其全部下级文档移入回收站，docs 为要删除的文档查询集，返回受影响的文档ID列表
+
+    多个文档的下级文档树在一条 UPDATE 语句中修改状态；调用方需刷新返回文档的搜索索引和文集目录
+    """
+    docs = list(docs.values_list('id', 'top_doc', 'path'))
+    if not docs:
+        return []
+    for pro_id in {d[1] for d in docs}:
+        ensure_project(pro_id)
+    query = Q()
+    for doc_id, pro_id, path in docs:
+        path = path or get_path(doc_id)
+        # 层级过深没有路径的文档只删除自身
+        query |= Q(path__startswith=path) if path else Q(id=doc_id)
+    subtree = Doc.objects.filter(query)
+    with transaction.atomic():
+        doc_ids = list(subtree.values_list('id', flat=True))
+        subtree.update(status=3, modify_time=datetime.datetime.now())
+    return doc_ids
@@ -0,0 +1,74 @@
+# coding:utf-8
+# @文件: doc_tree.py
+# 文集文档树
+# 一次查询取出文集的全部文档（只取需要的字段），在内存中按 上级文档ID → 下级文档列表 组装为任意层级的树；
+# 各个目录接口需要的节点格式不同，由调用方传入的 make_item 函数生成节点
+
+from collections import defaultdict
+
+from app_doc.models import Doc
+
+
+def get_doc_rows(pro_id, fields, status=1):
+    """一次查询获取文集的文档字段字典列表，按 sort 排序；status 为 None 时不限文档状态"""
+    docs = Doc.objects.filter(top_doc=pro_id)
+    if status is not None:
+        docs = docs.filter(status=status)
+    fields = list(dict.fromkeys(['id', 'parent_doc'] + list(fields)))
+    return list(docs.order_by('sort', 'id').values(*fields))
+
+
+def build_doc_tree(rows, make_item, children_key='children', keep_empty=False):
+    """将文档字段字典列表组装为树，返回 (树, 节点数量)
+
+    make_item(row, level) 返回节点字典，level 从 1 开始；
+    存在下级文档的节点在 children_key 中保存下级节点，keep_empty 为 True 时没有下级文档的节点也保存空列表；
+    上级文档不在 rows 中（已删除或状态不符）的文档及其下级文档不会出现在树中
+    """
+    children = defaultdict(list)
+    for row in rows:
+        children[row['parent_doc']].append(row)
+
+    tree = []
+    count = 0
+    visited = set()
+    # 使用显式栈代替递归，层级再深也不会超出递归深度限制
+    stack = [(0, tree, 1)]
+    while stack:
+        parent_id, nodes, level = stack.pop()
+        for row in children.get(parent_id, ()):
+            # 上级文档关系出现环时每个文档只出现一次
+            if row['id'] in visited:
+                continue
+            visited.add(row['id'])
+            item = make_item(row, level)
+            nodes.append(item)
+            count += 1
+            if row['id'] in children:
+                item[children_key] = []
+                stack.append((row['id'], item[children_key], level + 1))
+            elif keep_empty:
+                item[children_key] = []
+    return tree, count
+
+
+def get_doc_tree(pro_id, fields, make_item, status=1, children_key='children', keep_empty=False):
+    """获取文集的文档树，返回 (树, 节点数量)"""
+    rows = get_doc_rows(pro_id, fields, status=status)
+    return build_doc_tree(rows, make_item, children_key=children_key, keep_empty=keep_empty)
+
+
+def iter_sort_data(sort_data, children_key='children'):
+    """遍历前端提交的文档排序树，依次返回 (文档ID, 上级文档ID, 排序值)
+
+    同级文档的排序值从 10 开始、间隔 10，一级文档的上级文档ID为 0
+    """
+    stack = [(0, sort_data)]
+    while stack:
+        parent_id, nodes = stack.pop()
+        sort = 10
+        for node in nodes:
+            yield node['id'], parent_id, sort
+            sort += 10
+            if node.get(children_key):
+                stack.append((node['id'], node[children_key]))
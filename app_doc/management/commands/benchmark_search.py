@@ -0,0 +1,105 @@
+# coding:utf-8
+# @文件: benchmark_search.py
+# 在同一批文档上比较不同全文搜索引擎的建立索引和搜索耗时
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import import_string
+
+from app_doc.models import Doc
+from app_doc.search_utils import get_hot_keywords
+
+
+class Command(BaseCommand):
+    help = '在同一批文档上比较 Whoosh 与数据库全文索引（sql）的建立索引和搜索耗时'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-q', '--query', action='append', default=[],
+                            help='搜索词，可指定多次；未指定时使用热门搜索词')
+        parser.add_argument('-e', '--engines', default='whoosh,sql',
+                            help='参与比较的搜索引擎，逗号分隔，取值见 SEARCH_ENGINE_MAP')
+        parser.add_argument('-r', '--repeat', type=int, default=20, help='每个搜索词的重复次数')
+        parser.add_argument('-l', '--limit', type=int, default=10, help='每次搜索返回的结果数量')
+        parser.add_argument('-u', '--using', default='default', help='索引连接名称')
+        parser.add_argument('--reindex', action='store_true',
+                            help='先清空并重建各引擎的索引，同时统计建立索引的耗时')
+        parser.add_argument('-b', '--batch-size', type=int, default=500, help='重建索引时每批写入的对象数量')
+
+    def handle(self, *args, **options):
+        from haystack import connections
+        from haystack.query import SearchQuerySet
+
+        using = options['using']
+        names = [name.strip() for name in options['engines'].split(',') if name.strip()]
+        unknown = [name for name in names if name not in settings.SEARCH_ENGINE_MAP]
+        if unknown:
+            raise CommandError('未知的搜索引擎：{}，可选：{}'.format(
+                ','.join(unknown), ','.join(settings.SEARCH_ENGINE_MAP)))
+
+        queries = options['query'] or [kw['keyword'] for kw in get_hot_keywords(10)]
+        if not queries:
+            raise CommandError('没有热门搜索词，请使用 -q 指定搜索词')
+
+        backends = {}
+        for name in names:
+            engine = import_string(settings.SEARCH_ENGINE_MAP[name])
+            connection_options = dict(settings.HAYSTACK_CONNECTIONS[using])
+            connection_options['ENGINE'] = settings.SEARCH_ENGINE_MAP[name]
+            backends[name] = engine.backend(using, **connection_options)
+
+        if options['reindex']:
+            unified_index = connections[using].get_unified_index()
+            for name, backend in backends.items():
+                start_time = time.perf_counter()
+                count = self.reindex(backend, unified_index, using, max(1, options['batch_size']))
+                self.stdout.write('{}: 建立索引 {} 个对象，耗时 {:.1f} 秒'.format(
+                    name, count, time.perf_counter() - start_time))
+
+        repeat = max(1, options['repeat'])
+        limit = max(1, options['limit'])
+        totals = {name: 0.0 for name in names}
+        self.stdout.write('{:<24} {:<4} {:<8} {:>8} {:>10} {:>10} {:>8}'.format(
+            '搜索词', '模式', '引擎', '结果数', '平均(ms)', 'P95(ms)', '重合'))
+        for query in queries:
+            for mode in ('or', 'and'):
+                search_query = ' AND '.join(query.split()) if mode == 'and' else query
+                query_string = SearchQuerySet(using=using).models(Doc).auto_query(search_query).query.build_query()
+                baseline = None
+                for name, backend in backends.items():
+                    timings = []
+                    results = None
+                    # 第一次搜索用于预热（打开索引、加载分词词典等），不计入耗时
+                    for i in range(repeat + 1):
+                        start_time = time.perf_counter()
+                        results = backend.search(query_string, models=[Doc], start_offset=0, end_offset=limit)
+                        if i:
+                            timings.append((time.perf_counter() - start_time) * 1000)
+                    timings.sort()
+                    average = sum(timings) / len(timings)
+                    totals[name] += average
+                    pks = [result.pk for result in results.get('results', [])]
+                    if baseline is None:
+                        baseline = pks
+                    overlap = len(set(pks) & set(baseline))
+                    self.stdout.write('{:<24} {:<4} {:<8} {:>8} {:>10.2f} {:>10.2f} {:>5}/{:<2}'.format(
+                        query[:24], mode, name, results.get('hits', 0), average,
+                        timings[min(len(timings) - 1, int(len(timings) * 0.95))], overlap, len(baseline)))
+
+        for name, total in totals.items():
+            self.stdout.write(self.style.SUCCESS('{}: 平均每次搜索 {:.2f} ms'.format(
+                name, total / (len(queries) * 2))))
+
+    def reindex(self, backend, unified_index, using, batch_size):
+        """清空并重建指定后端的索引，返回写入的对象数量"""
+        backend.clear()
+        count = 0
+        for model in unified_index.get_indexed_models():
+            index = unified_index.get_index(model)
+            pks = list(index.index_queryset(using=using).order_by('pk').values_list('pk', flat=True))
+            for i in range(0, len(pks), batch_size):
+                objects = list(index.index_queryset(using=using).filter(pk__in=pks[i:i + batch_size]))
+                backend.update(index, objects)
+                count += len(objects)
+        return count
@@ -0,0 +1,210 @@
+# coding:utf-8
+# @文件: benchmark_search_components.py
+# 搜索相关组件（中文分词器、搜索器复用、搜索结果高亮）的性能基准测试，与旧版实现对比
+
+import random
+import statistics
+import threading
+import time
+
+import jieba
+from django.core.management.base import BaseCommand
+from whoosh.analysis import Token
+
+from app_doc.search.chinese_analyzer import ChineseTokenizer
+
+
+SAMPLE_WORDS = [
+    '文档', '文集', '搜索', '全文检索', '中华人民共和国', '分词', '索引', '协作', '权限',
+    '目录', '编辑器', 'Markdown', 'MrDoc', 'python', 'django', 'whoosh', 'jieba',
+    '配置文件', '数据库', '部署', '服务器', '性能优化', '高亮', '排序', '用户',
+]
+
+
+def build_text(size_mb, seed=0):
+    """生成指定大小的中英文混合文本，后半部分引入前文未出现的词，模拟长文档"""
+    rnd = random.Random(seed)
+    target = int(size_mb * 1024 * 1024)  # UTF-8 字节数
+    parts = []
+    length = 0
+    n = 0
+    while length < target:
+        word = rnd.choice(SAMPLE_WORDS)
+        if length > target / 2:
+            word = '{}{}'.format(word, n)
+        parts.append(word)
+        length += len(word.encode('utf-8'))
+        n += 1
+        if n % 12 == 0:
+            parts.append('。\n')
+    return ''.join(parts)
+
+
+def legacy_tokenize(value, start_pos=0, start_char=0):
+    """旧版分词器实现：每个词调用三次 value.find() 计算位置"""
+    t = Token(True, True)
+    for w in jieba.cut_for_search(value):
+        if w.strip() and len(w) >= 1:
+            t.original = t.text = w
+            t.pos = start_pos + value.find(w)
+            t.startchar = start_char + value.find(w)
+            t.endchar = start_char + value.find(w) + len(w)
+            yield t
+
+
+def bench_tokenizer(write, size_mb):
+    text = build_text(size_mb)
+    write(f'文档大小: {len(text.encode("utf-8")) / 1024 / 1024:.2f} MB，{len(text)} 字符')
+
+    # 预热 jieba 词典
+    list(jieba.cut_for_search('预热'))
+
+    start = time.perf_counter()
+    legacy_count = sum(1 for _ in legacy_tokenize(text))
+    legacy_time = time.perf_counter() - start
+
+    tokenizer = ChineseTokenizer()
+    start = time.perf_counter()
+    tokens = [(t.text, t.pos, t.startchar, t.endchar)
+              for t in tokenizer(text, positions=True, chars=True)]
+    new_time = time.perf_counter() - start
+
+    # 校验字符偏移准确
+    wrong = sum(1 for w, _, s, e in tokens if text[s:e] != w)
+
+    write(f'旧版分词器: {legacy_count} 个词，耗时 {legacy_time:.2f} 秒')
+    write(f'新版分词器: {len(tokens)} 个词，耗时 {new_time:.2f} 秒，偏移错误 {wrong} 个')
+    write(f'加速比: {legacy_time / new_time:.1f}x')
+
+
+def bench_searcher(write, threads, queries):
+    from django.conf import settings
+    from haystack.query import SearchQuerySet
+    from app_doc.search import searcher_pool
+
+    keywords = ['文档', '搜索', '配置', '数据库', '部署', 'python', '索引', '用户']
+
+    def run(pool_size):
+        searcher_pool.clear()
+        settings.SEARCH_SEARCHER_POOL_SIZE = pool_size
+        searcher_pool._pools.clear()
+        latencies = []
+        lock = threading.Lock()
+
+        def worker(n):
+            local = []
+            for i in range(queries):
+                start = time.perf_counter()
+                list(SearchQuerySet().filter(content=keywords[(n + i) % len(keywords)])[:10])
+                local.append(time.perf_counter() - start)
+            with lock:
+                latencies.extend(local)
+
+        workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        latencies.sort()
+        return (statistics.median(latencies) * 1000,
+                latencies[int(len(latencies) * 0.95)] * 1000)
+
+    # 预热
+    list(SearchQuerySet().filter(content='预热')[:10])
+    p50, p95 = run(0)
+    write(f'不复用搜索器: p50 {p50:.1f} ms，p95 {p95:.1f} ms')
+    p50, p95 = run(getattr(settings, 'SEARCH_SEARCHER_POOL_SIZE', 8) or 8)
+    write(f'复用搜索器:   p50 {p50:.1f} ms，p95 {p95:.1f} ms')
+    write(f'搜索器池计数: {searcher_pool.get_stats()}')
+
+
+def legacy_find_window(self, highlight_locations):
+    """旧版高亮窗口选择：对所有命中位置两两比较"""
+    best_start = 0
+    best_end = self.max_length
+    words_found = []
+    for word, offset_list in highlight_locations.items():
+        words_found.extend(offset_list)
+    words_found = sorted(words_found)
+    highest_density = 0
+    if words_found[:-1][0] > self.max_length:
+        best_start = words_found[:-1][0]
+        best_end = best_start + self.max_length
+    for count, start in enumerate(words_found[:-1]):
+        current_density = 1
+        for end in words_found[count + 1:]:
+            if end - start < self.max_length:
+                current_density += 1
+            else:
+                current_density = 0
+            if current_density > highest_density:
+                best_start = start
+                best_end = start + self.max_length
+                highest_density = current_density
+    if best_start < 10:
+        best_start = 0
+        best_end = 200
+    else:
+        best_start -= 10
+        best_end -= 10
+    return (best_start, best_end)
+
+
+def bench_highlight(write, size_mb):
+    from app_doc.search.highlight import MyHighLighter, get_query_words
+    from app_doc.search.chinese_analyzer import ChineseAnalyzer
+
+    text = build_text(size_mb)
+    query = '数据库 部署'
+    kwargs = {'max_length': 200, 'html_tag': 'span', 'css_class': 'highlighted'}
+    highlighter = MyHighLighter(query, **kwargs)
+    highlighter.text_block = text
+    locations = highlighter.find_highlightable_words()
+    hits = sum(len(v) for v in locations.values())
+    write(f'文档大小: {len(text.encode("utf-8")) / 1024:.0f} KB，{len(text)} 字符，命中 {hits} 处')
+
+    start = time.perf_counter()
+    legacy_window = legacy_find_window(highlighter, locations)
+    legacy_time = time.perf_counter() - start
+    start = time.perf_counter()
+    window = highlighter.find_window(locations)
+    new_time = time.perf_counter() - start
+    write(f'旧版窗口选择: {legacy_time * 1000:.1f} ms，窗口 {legacy_window}')
+    write(f'新版窗口选择: {new_time * 1000:.2f} ms，窗口 {window}，结果{"一致" if window == legacy_window else "不一致"}')
+
+    start = time.perf_counter()
+    highlighter.highlight(text)
+    write(f'完整高亮: {(time.perf_counter() - start) * 1000:.1f} ms')
+
+    # 一页搜索结果约 10 条 × 3 个字段
+    rows = 30
+    start = time.perf_counter()
+    for _ in range(rows):
+        {t.text for t in ChineseAnalyzer()(query)}
+    legacy_time = time.perf_counter() - start
+    get_query_words.cache_clear()
+    start = time.perf_counter()
+    for _ in range(rows):
+        MyHighLighter(query, **kwargs)
+    new_time = time.perf_counter() - start
+    write(f'创建 {rows} 个高亮器: 每次新建分析器 {legacy_time * 1000:.1f} ms，复用分析器 {new_time * 1000:.2f} ms')
+
+
+class Command(BaseCommand):
+    help = '搜索组件性能基准测试：tokenizer 中文分词器，searcher 并发全文搜索延迟，highlight 搜索结果高亮'
+
+    def add_arguments(self, parser):
+        parser.add_argument('target', choices=['tokenizer', 'searcher', 'highlight'])
+        parser.add_argument('--size', type=float, default=None,
+                            help='测试文档大小（MB），默认 tokenizer 为 1，highlight 为 0.5')
+        parser.add_argument('--threads', type=int, default=8, help='并发搜索线程数')
+        parser.add_argument('--queries', type=int, default=50, help='每个线程的搜索次数')
+
+    def handle(self, *args, **options):
+        write = self.stdout.write
+        if options['target'] == 'tokenizer':
+            bench_tokenizer(write, options['size'] or 1)
+        elif options['target'] == 'searcher':
+            bench_searcher(write, options['threads'], options['queries'])
+        elif options['target'] == 'highlight':
+            bench_highlight(write, options['size'] or 0.5)
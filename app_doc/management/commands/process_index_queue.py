@@ -0,0 +1,44 @@
+# coding:utf-8
+# @文件: process_index_queue.py
+# 处理全文索引更新队列
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from loguru import logger
+
+from app_doc.search import index_queue
+
+
+class Command(BaseCommand):
+    help = '处理全文索引更新队列，将修改过的文档批量写入全文索引（配置 index_queue_thread = False 时使用）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='处理完当前队列后退出')
+        parser.add_argument('--force', action='store_true', help='忽略合并等待时间，立即处理全部记录')
+        parser.add_argument('--interval', type=float, default=1.0, help='持续运行时检查队列的间隔秒数')
+        parser.add_argument('--retry-failed', action='store_true', help='重新处理失败次数达到上限、已放弃重试的记录')
+
+    def handle(self, *args, **options):
+        if options['retry_failed']:
+            count = index_queue.retry_failed()
+            self.stdout.write(f'{count} 条放弃重试的记录已重新加入处理')
+        if options['once']:
+            count = index_queue.drain(force=options['force'])
+            self.stdout.write(self.style.SUCCESS(f'已处理 {count} 条索引更新记录'))
+            return
+
+        # 持续运行时由本命令处理队列，不在当前进程内再启动处理线程
+        settings.SEARCH_INDEX_QUEUE_THREAD = False
+        self.stdout.write(f'开始处理全文索引更新队列，检查间隔 {options["interval"]} 秒')
+        while True:
+            try:
+                close_old_connections()
+                count = index_queue.drain(force=options['force'])
+                if count:
+                    self.stdout.write(f'已处理 {count} 条索引更新记录')
+            except Exception:
+                logger.exception("处理全文索引更新队列异常")
+            time.sleep(options['interval'])
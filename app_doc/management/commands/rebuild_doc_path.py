@@ -0,0 +1,32 @@
+# coding:utf-8
+# @文件: rebuild_doc_path.py
+# 生成或修复文档层级路径（Doc.path）
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from app_doc import doc_path
+from app_doc.models import Doc
+
+
+class Command(BaseCommand):
+    help = '按上级文档关系生成文档层级路径，用于升级后回填已有文档或修复路径'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pid', type=int, default=0, help='只处理指定文集的文档，默认全部')
+        parser.add_argument('-b', '--batch-size', type=int, default=500, help='每批写入的文档数量')
+
+    def handle(self, *args, **options):
+        if options['pid'] > 0:
+            project_ids = [options['pid']]
+        else:
+            project_ids = list(Doc.objects.order_by('top_doc').values_list('top_doc', flat=True).distinct())
+        count = 0
+        for pro_id in project_ids:
+            # 每个文集在一个事务中更新，只写入路径变化的文档
+            with transaction.atomic():
+                changed = doc_path.rebuild_project(pro_id, batch_size=max(1, options['batch_size']))
+            count += changed
+            if changed:
+                self.stdout.write(f'文集 {pro_id}：更新 {changed} 篇文档的路径')
+        self.stdout.write(self.style.SUCCESS(f'文档路径生成完成，共处理 {len(project_ids)} 个文集，更新 {count} 篇文档'))
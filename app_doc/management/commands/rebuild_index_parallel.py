@@ -0,0 +1,45 @@
+# coding:utf-8
+# @文件: rebuild_index_parallel.py
+# 使用多个进程重建全文搜索索引
+
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from app_doc.search import parallel_index
+
+
+class Command(BaseCommand):
+    help = '清空并使用多个进程并行重建全文搜索索引（Whoosh），每个进程写入独立的索引段'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-k', '--workers', type=int, default=os.cpu_count() or 1,
+                            help='工作进程数量，默认为 CPU 核心数')
+        parser.add_argument('-b', '--batch-size', type=int, default=500,
+                            help='工作进程每批读取的对象数量')
+        parser.add_argument('-u', '--using', default='default', help='索引连接名称')
+        parser.add_argument('--optimize', action='store_true',
+                            help='重建完成后将各进程写入的索引段合并为一个')
+        parser.add_argument('--noinput', action='store_false', dest='interactive', default=True,
+                            help='不进行确认，直接清空并重建索引')
+
+    def handle(self, *args, **options):
+        if options['interactive']:
+            answer = input('将清空现有的全文搜索索引并重新建立，是否继续？[y/N] ')
+            if answer.strip().lower() not in ('y', 'yes'):
+                self.stdout.write('已取消')
+                return
+
+        workers = max(1, options['workers'])
+        start_time = time.time()
+        count = parallel_index.rebuild(
+            workers, batch_size=max(1, options['batch_size']),
+            using=options['using'], stdout=self.stdout,
+        )
+        if options['optimize']:
+            from haystack import connections
+            connections[options['using']].get_backend().optimize()
+        self.stdout.write(self.style.SUCCESS(
+            f'全文搜索索引重建完成，{workers} 个进程共处理 {count} 个对象，耗时 {time.time() - start_time:.1f} 秒'
+        ))
@@ -0,0 +1,22 @@
+# coding:utf-8
+# @文件: rebuild_trigram_index.py
+# 重建文档内容三元组索引
+
+from django.core.management.base import BaseCommand
+
+from app_doc.models import Doc
+from app_doc.search import trigram_index
+
+
+class Command(BaseCommand):
+    help = '重建文档内容三元组索引（用于正则/精确内容搜索的候选文档筛选）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pid', type=int, default=0, help='只重建指定文集的文档，默认全部')
+
+    def handle(self, *args, **options):
+        queryset = None
+        if options['pid'] > 0:
+            queryset = Doc.objects.filter(top_doc=options['pid'])
+        count = trigram_index.rebuild(queryset, stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(f'三元组索引重建完成，共 {count} 篇文档'))
@@ -0,0 +1,32 @@
+# coding:utf-8
+# @文件: update_hot_keywords.py
+# 汇总搜索日志并更新热门搜索词
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from loguru import logger
+
+from app_doc.search_utils import update_hot_keywords
+
+
+class Command(BaseCommand):
+    help = '增量汇总新增的搜索日志并更新热门搜索词，可配合 crontab 定期执行，或使用 --interval 持续运行'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=7, help='统计最近N天的搜索')
+        parser.add_argument('--min-count', type=int, default=2, help='计入热门搜索词的最小搜索次数')
+        parser.add_argument('--interval', type=float, default=0, help='持续运行时的更新间隔秒数，0 表示更新一次后退出')
+
+    def handle(self, *args, **options):
+        while True:
+            try:
+                close_old_connections()
+                count = update_hot_keywords(days=options['days'], min_count=options['min_count'])
+                self.stdout.write(self.style.SUCCESS(f'已更新 {count} 个热门搜索词'))
+            except Exception:
+                logger.exception("更新热门搜索词异常")
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.30 on 2026-10-17 20:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_doc', '0042_searchhotkeyword_searchsynonym_searchlog'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocTrigramState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('doc_id', models.IntegerField(unique=True, verbose_name='文档ID')),
+                ('modify_time', models.DateTimeField(verbose_name='文档修改时间')),
+                ('indexed_at', models.DateTimeField(auto_now=True, verbose_name='索引时间')),
+            ],
+            options={
+                'verbose_name': '文档三元组索引状态',
+                'verbose_name_plural': '文档三元组索引状态',
+                'db_table': 'search_doc_trigram_state',
+            },
+        ),
+        migrations.AlterField(
+            model_name='doc',
+            name='open_children',
+            field=models.BooleanField(default=True, verbose_name='展开下级目录'),
+        ),
+        migrations.CreateModel(
+            name='DocTrigram',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('doc_id', models.IntegerField(db_index=True, verbose_name='文档ID')),
+                ('trigram', models.CharField(max_length=3, verbose_name='三元组')),
+            ],
+            options={
+                'verbose_name': '文档三元组索引',
+                'verbose_name_plural': '文档三元组索引',
+                'db_table': 'search_doc_trigram',
+                'unique_together': {('trigram', 'doc_id')},
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-17 21:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_doc', '0043_doctrigram'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchIndexQueue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_label', models.CharField(max_length=100, verbose_name='模型')),
+                ('object_id', models.IntegerField(verbose_name='对象ID')),
+                ('created_at', models.DateTimeField(db_index=True, verbose_name='加入队列时间')),
+                ('updated_at', models.DateTimeField(db_index=True, verbose_name='最后修改时间')),
+            ],
+            options={
+                'verbose_name': '全文索引更新队列',
+                'verbose_name_plural': '全文索引更新队列',
+                'db_table': 'search_index_queue',
+                'unique_together': {('model_label', 'object_id')},
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.30 on 2026-10-17 21:23
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_doc', '0044_searchindexqueue'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='searchlog',
+            name='created_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='搜索时间'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.30 on 2026-10-17 21:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_doc', '0045_searchlog_created_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchRollupState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True, verbose_name='汇总名称')),
+                ('last_log_id', models.BigIntegerField(default=0, verbose_name='已汇总日志ID')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+            ],
+            options={
+                'verbose_name': '搜索日志汇总进度',
+                'verbose_name_plural': '搜索日志汇总进度',
+                'db_table': 'search_rollup_state',
+            },
+        ),
+        migrations.CreateModel(
+            name='SearchKeywordDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('query_text', models.CharField(max_length=500, verbose_name='搜索词')),
+                ('day', models.DateField(db_index=True, verbose_name='日期')),
+                ('search_count', models.IntegerField(default=0, verbose_name='搜索次数')),
+                ('last_searched_at', models.DateTimeField(verbose_name='最后搜索时间')),
+            ],
+            options={
+                'verbose_name': '搜索词每日计数',
+                'verbose_name_plural': '搜索词每日计数',
+                'db_table': 'search_keyword_daily',
+                'unique_together': {('query_text', 'day')},
+            },
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.30 on 2026-10-17 21:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_doc', '0046_searchkeyworddaily'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('identifier', models.CharField(max_length=255, unique=True, verbose_name='索引文档ID')),
+                ('django_ct', models.CharField(db_index=True, max_length=100, verbose_name='模型')),
+                ('django_id', models.CharField(max_length=64, verbose_name='对象ID')),
+                ('top_doc', models.IntegerField(db_index=True, null=True, verbose_name='文集ID')),
+                ('modify_time', models.DateTimeField(db_index=True, null=True, verbose_name='修改时间')),
+                ('create_user', models.IntegerField(null=True, verbose_name='创建用户ID')),
+                ('title_tokens', models.TextField(default='', verbose_name='标题分词')),
+                ('content_tokens', models.TextField(default='', verbose_name='内容分词')),
+                ('text_tokens', models.TextField(default='', verbose_name='全文分词')),
+                ('stored_fields', models.TextField(default='{}', verbose_name='存储字段')),
+            ],
+            options={
+                'verbose_name': '全文索引文档',
+                'verbose_name_plural': '全文索引文档',
+                'db_table': 'search_document',
+            },
+        ),
+        migrations.CreateModel(
+            name='SearchIndexState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True, verbose_name='索引名称')),
+                ('generation', models.BigIntegerField(default=0, verbose_name='索引代数')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+            ],
+            options={
+                'verbose_name': '全文索引状态',
+                'verbose_name_plural': '全文索引状态',
+                'db_table': 'search_index_state',
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.30 on 2026-10-17 21:56
+
+from django.db import migrations, models
+
+
+def clear_toc_value(apps, schema_editor):
+    # 早期版本保存的目录没有版本号，清空后按需重新生成
+    apps.get_model('app_doc', 'ProjectToc').objects.update(value='')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_doc', '0047_searchdocument'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='projecttoc',
+            name='version',
+            field=models.PositiveIntegerField(default=0, verbose_name='目录版本号'),
+        ),
+        migrations.RunPython(clear_toc_value, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-17 23:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_doc', '0048_projecttoc_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='doc',
+            name='path',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=512, verbose_name='文档路径'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.30 on 2026-10-17 22:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_doc', '0049_doc_path'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccessScopeVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=50, unique=True, verbose_name='范围')),
+                ('version', models.PositiveIntegerField(default=0, verbose_name='版本号')),
+            ],
+            options={
+                'verbose_name': '可访问文集范围版本',
+                'verbose_name_plural': '可访问文集范围版本',
+            },
+        ),
+    ]
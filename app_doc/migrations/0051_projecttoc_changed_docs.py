@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-17 22:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_doc', '0050_accessscopeversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='projecttoc',
+            name='changed_docs',
+            field=models.TextField(blank=True, default='', verbose_name='待更新的文档'),
+        ),
+    ]
@@ -0,0 +1,83 @@
+# 数据库全文搜索后端（sql_fts_backend）使用的全文索引：
+# SQLite 为以 search_document 表为外部内容表的 FTS5 虚拟表及同步触发器，PostgreSQL 为 tsvector 生成列及 GIN 索引；
+# 早期版本在首次搜索时建立了同样的对象，因此均使用 IF NOT EXISTS
+
+from django.db import migrations
+
+
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS search_document_fts USING fts5("
+    "title_tokens, content_tokens, text_tokens, content='search_document', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 0')",
+    "CREATE TRIGGER IF NOT EXISTS search_document_fts_ai AFTER INSERT ON search_document BEGIN "
+    "INSERT INTO search_document_fts(rowid, title_tokens, content_tokens, text_tokens) "
+    "VALUES (new.id, new.title_tokens, new.content_tokens, new.text_tokens); END",
+    "CREATE TRIGGER IF NOT EXISTS search_document_fts_ad AFTER DELETE ON search_document BEGIN "
+    "INSERT INTO search_document_fts(search_document_fts, rowid, title_tokens, content_tokens, text_tokens) "
+    "VALUES ('delete', old.id, old.title_tokens, old.content_tokens, old.text_tokens); END",
+    "CREATE TRIGGER IF NOT EXISTS search_document_fts_au AFTER UPDATE ON search_document BEGIN "
+    "INSERT INTO search_document_fts(search_document_fts, rowid, title_tokens, content_tokens, text_tokens) "
+    "VALUES ('delete', old.id, old.title_tokens, old.content_tokens, old.text_tokens); "
+    "INSERT INTO search_document_fts(rowid, title_tokens, content_tokens, text_tokens) "
+    "VALUES (new.id, new.title_tokens, new.content_tokens, new.text_tokens); END",
+    # 表中已有文档时为其建立索引
+    "INSERT INTO search_document_fts(search_document_fts) VALUES ('rebuild')",
+]
+SQLITE_REVERSE = [
+    "DROP TRIGGER IF EXISTS search_document_fts_ai",
+    "DROP TRIGGER IF EXISTS search_document_fts_ad",
+    "DROP TRIGGER IF EXISTS search_document_fts_au",
+    "DROP TABLE IF EXISTS search_document_fts",
+]
+
+POSTGRESQL_FORWARD = [
+    "ALTER TABLE search_document ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('simple', coalesce(title_tokens, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(content_tokens, '')), 'B') || "
+    "setweight(to_tsvector('simple', coalesce(text_tokens, '')), 'C')) STORED",
+    "CREATE INDEX IF NOT EXISTS search_document_vector_idx ON search_document USING GIN (search_vector)",
+]
+POSTGRESQL_REVERSE = [
+    "DROP INDEX IF EXISTS search_document_vector_idx",
+    "ALTER TABLE search_document DROP COLUMN IF EXISTS search_vector",
+]
+
+
+def _run(schema_editor, statements):
+    with schema_editor.connection.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql)
+
+
+def create_fts(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        from django.db import OperationalError
+        try:
+            _run(schema_editor, SQLITE_FORWARD[:1])
+        except OperationalError:
+            # SQLite 未编译 FTS5 时跳过，此时不能使用 sql 搜索引擎（启动时提示）
+            return
+        _run(schema_editor, SQLITE_FORWARD[1:])
+    elif vendor == 'postgresql':
+        _run(schema_editor, POSTGRESQL_FORWARD)
+    # 其他数据库不支持 sql 搜索引擎，无需建立全文索引
+
+
+def drop_fts(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        _run(schema_editor, SQLITE_REVERSE)
+    elif vendor == 'postgresql':
+        _run(schema_editor, POSTGRESQL_REVERSE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_doc', '0051_projecttoc_changed_docs'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts, drop_fts),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-17 23:40
+
+from django.db import migrations, models
+from django.db.models import Min
+import django.db.models.deletion
+
+
+def remove_duplicate_tocs(apps, schema_editor):
+    # 并发读取目录时可能为同一文集建立了多条记录，只保留最早的一条
+    ProjectToc = apps.get_model('app_doc', 'ProjectToc')
+    keep_ids = list(ProjectToc.objects.values('project_id').annotate(keep_id=Min('id')).values_list('keep_id', flat=True))
+    ProjectToc.objects.exclude(id__in=keep_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_doc', '0052_searchdocument_fts'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_tocs, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='projecttoc',
+            name='project',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='app_doc.project'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.30 on 2026-10-17 22:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_doc', '0053_projecttoc_project_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='searchindexqueue',
+            name='attempts',
+            field=models.IntegerField(default=0, verbose_name='失败次数'),
+        ),
+        migrations.AddField(
+            model_name='searchindexqueue',
+            name='failed',
+            field=models.BooleanField(default=False, verbose_name='是否放弃重试'),
+        ),
+        migrations.AddField(
+            model_name='searchindexqueue',
+            name='last_error',
+            field=models.TextField(blank=True, default='', verbose_name='错误信息'),
+        ),
+        migrations.AddField(
+            model_name='searchindexqueue',
+            name='next_attempt_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True, verbose_name='下次处理时间'),
+        ),
+    ]
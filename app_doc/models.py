@@ -52,8 +52,10 @@ class ProjectCollaborator(models.Model):
 
 # 文集目录模型
 class ProjectToc(models.Model):
-    project = models.ForeignKey(Project,on_delete=models.CASCADE)
+    project = models.OneToOneField(Project,on_delete=models.CASCADE) # 每个文集一条目录记录
     value = models.TextField(verbose_name="文集文档层级目录")
+    version = models.PositiveIntegerField(default=0,verbose_name="目录版本号")
+    changed_docs = models.TextField(default='',blank=True,verbose_name="待更新的文档") # 逗号分隔的文档ID，* 表示完整重新生成
 
     def __str__(self):
         return self.project
@@ -63,6 +65,19 @@ class ProjectToc(models.Model):
         verbose_name_plural = verbose_name
 
 
+# 可访问文集范围的版本号模型，版本号保存在数据库中，各进程的缓存按版本号失效
+class AccessScopeVersion(models.Model):
+    key = models.CharField(max_length=50,unique=True,verbose_name="范围") # public、user:用户ID 或 search_synonym（同义词）
+    version = models.PositiveIntegerField(default=0,verbose_name="版本号")
+
+    def __str__(self):
+        return self.key
+
+    class Meta:
+        verbose_name = '可访问文集范围版本'
+        verbose_name_plural = verbose_name
+
+
 # 文档模型
 class Doc(models.Model):
     name = models.CharField(verbose_name="文档标题",max_length=255)
@@ -80,10 +95,19 @@ class Doc(models.Model):
     editor_mode = models.IntegerField(default=1,verbose_name='编辑器模式')
     open_children = models.BooleanField(default=True,verbose_name="展开下级目录")
     show_children = models.BooleanField(verbose_name="显示下级文档",default=False)
+    # 文档层级路径：从一级文档到文档自身的文档ID链，如 /12/57/301/，由 app_doc.doc_path 维护
+    path = models.CharField(max_length=512,default='',blank=True,db_index=True,verbose_name="文档路径")
 
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        # 记录从数据库读取时的字段值，保存时据此判断目录字段、上级文档是否变化，无需再次查询
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
     class Meta:
         verbose_name = '文档'
         verbose_name_plural = verbose_name
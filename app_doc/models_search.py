@@ -5,6 +5,7 @@
 # 搜索相关模型
 
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import User
 
 
@@ -47,8 +48,8 @@ class SearchLog(models.Model):
     # 是否有点击结果
     has_click = models.BooleanField(default=False, verbose_name='是否点击结果')
 
-    # 创建时间
-    created_at = models.DateTimeField(auto_now_add=True, verbose_name='搜索时间', db_index=True)
+    # 创建时间：日志经缓冲区延迟批量写入，记录搜索发生的时间而非写库时间
+    created_at = models.DateTimeField(default=timezone.now, verbose_name='搜索时间', db_index=True)
 
     class Meta:
         db_table = 'search_log'
@@ -125,3 +126,193 @@ class SearchSynonym(models.Model):
     def get_synonym_list(self):
         """获取同义词列表"""
         return [s.strip() for s in self.synonyms.split(',') if s.strip()]
+
+
+class SearchKeywordDaily(models.Model):
+    """
+    搜索词每日计数
+    由 update_hot_keywords 从搜索日志增量汇总，热门搜索词基于此表计算
+    """
+    # 搜索词
+    query_text = models.CharField(max_length=500, verbose_name='搜索词')
+
+    # 日期
+    day = models.DateField(verbose_name='日期', db_index=True)
+
+    # 当天搜索次数
+    search_count = models.IntegerField(default=0, verbose_name='搜索次数')
+
+    # 当天最后搜索时间
+    last_searched_at = models.DateTimeField(verbose_name='最后搜索时间')
+
+    class Meta:
+        db_table = 'search_keyword_daily'
+        verbose_name = '搜索词每日计数'
+        verbose_name_plural = verbose_name
+        unique_together = (('query_text', 'day'),)
+
+    def __str__(self):
+        return f'{self.day} {self.query_text} ({self.search_count})'
+
+
+class SearchRollupState(models.Model):
+    """
+    搜索日志汇总进度
+    记录已汇总的最大搜索日志ID，每次只处理之后新增的日志
+    """
+    name = models.CharField(max_length=50, unique=True, verbose_name='汇总名称')
+
+    # 已汇总的最大搜索日志ID
+    last_log_id = models.BigIntegerField(default=0, verbose_name='已汇总日志ID')
+
+    # 更新时间
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='更新时间')
+
+    class Meta:
+        db_table = 'search_rollup_state'
+        verbose_name = '搜索日志汇总进度'
+        verbose_name_plural = verbose_name
+
+    def __str__(self):
+        return f'{self.name}: {self.last_log_id}'
+
+
+class DocTrigram(models.Model):
+    """
+    文档内容三元组（trigram）倒排索引
+    每行表示「某个三元组出现在某篇文档中」，
+    用于在正则/精确内容搜索前快速筛选候选文档
+    """
+    doc_id = models.IntegerField(verbose_name='文档ID', db_index=True)
+
+    # 经过大小写归一化的三个字符
+    trigram = models.CharField(max_length=3, verbose_name='三元组')
+
+    class Meta:
+        db_table = 'search_doc_trigram'
+        verbose_name = '文档三元组索引'
+        verbose_name_plural = verbose_name
+        unique_together = [('trigram', 'doc_id')]
+
+    def __str__(self):
+        return f'{self.trigram} → {self.doc_id}'
+
+
+class DocTrigramState(models.Model):
+    """
+    文档三元组索引状态
+    记录建立索引时文档的修改时间，修改时间不一致的文档视为过期，
+    搜索时会退回到逐篇扫描，保证结果与不使用索引时一致
+    """
+    doc_id = models.IntegerField(verbose_name='文档ID', unique=True)
+
+    # 建立索引时文档的修改时间
+    modify_time = models.DateTimeField(verbose_name='文档修改时间')
+
+    # 建立索引的时间
+    indexed_at = models.DateTimeField(auto_now=True, verbose_name='索引时间')
+
+    class Meta:
+        db_table = 'search_doc_trigram_state'
+        verbose_name = '文档三元组索引状态'
+        verbose_name_plural = verbose_name
+
+    def __str__(self):
+        return f'{self.doc_id} ({self.modify_time})'
+
+
+class SearchIndexQueue(models.Model):
+    """
+    全文索引更新队列
+    对象保存/删除时只记录待更新的对象，由后台线程或 process_index_queue 命令批量写入索引，
+    同一对象在写入前的多次修改合并为一条记录；写入失败的记录按退避时间重试，失败次数达到上限后保留在表中不再处理
+    """
+    # 模型标识，如 app_doc.Doc
+    model_label = models.CharField(max_length=100, verbose_name='模型')
+
+    object_id = models.IntegerField(verbose_name='对象ID')
+
+    # 首次加入队列的时间，用于限制索引延迟的上限
+    created_at = models.DateTimeField(verbose_name='加入队列时间', db_index=True)
+
+    # 最后一次修改的时间，用于合并连续的修改
+    updated_at = models.DateTimeField(verbose_name='最后修改时间', db_index=True)
+
+    # 写入索引失败的次数
+    attempts = models.IntegerField(default=0, verbose_name='失败次数')
+
+    # 在此时间之前不处理：正在被某个进程处理，或写入失败后等待重试
+    next_attempt_at = models.DateTimeField(null=True, blank=True, verbose_name='下次处理时间', db_index=True)
+
+    # 失败次数达到上限后不再自动重试，对象再次修改或执行 process_index_queue --retry-failed 后重新处理
+    failed = models.BooleanField(default=False, verbose_name='是否放弃重试')
+
+    # 最后一次失败的错误信息
+    last_error = models.TextField(default='', blank=True, verbose_name='错误信息')
+
+    class Meta:
+        db_table = 'search_index_queue'
+        verbose_name = '全文索引更新队列'
+        verbose_name_plural = verbose_name
+        unique_together = [('model_label', 'object_id')]
+
+    def __str__(self):
+        return f'{self.model_label}.{self.object_id}'
+
+
+class SearchDocument(models.Model):
+    """
+    数据库全文索引的文档
+    搜索引擎配置为 sql 时使用（见 app_doc.search.sql_fts_backend），每个被索引的对象一行；
+    *_tokens 字段保存 jieba 分词后以空格分隔的词序列，由 SQLite FTS5 虚拟表或 PostgreSQL tsvector 列建立倒排索引
+    """
+    # 索引文档ID，如 app_doc.doc.1
+    identifier = models.CharField(max_length=255, unique=True, verbose_name='索引文档ID')
+
+    # 模型标识，如 app_doc.doc
+    django_ct = models.CharField(max_length=100, db_index=True, verbose_name='模型')
+
+    django_id = models.CharField(max_length=64, verbose_name='对象ID')
+
+    # 用于过滤和排序的字段
+    top_doc = models.IntegerField(null=True, db_index=True, verbose_name='文集ID')
+    modify_time = models.DateTimeField(null=True, db_index=True, verbose_name='修改时间')
+    create_user = models.IntegerField(null=True, verbose_name='创建用户ID')
+
+    # 分词后的词序列
+    title_tokens = models.TextField(default='', verbose_name='标题分词')
+    content_tokens = models.TextField(default='', verbose_name='内容分词')
+    text_tokens = models.TextField(default='', verbose_name='全文分词')
+
+    # 搜索索引的全部字段值（JSON），作为搜索结果的存储字段返回
+    stored_fields = models.TextField(default='{}', verbose_name='存储字段')
+
+    class Meta:
+        db_table = 'search_document'
+        verbose_name = '全文索引文档'
+        verbose_name_plural = verbose_name
+
+    def __str__(self):
+        return self.identifier
+
+
+class SearchIndexState(models.Model):
+    """
+    全文索引状态
+    记录数据库全文索引的代数，每次写入索引后递增，用于使搜索结果缓存失效
+    """
+    name = models.CharField(max_length=50, unique=True, verbose_name='索引名称')
+
+    # 索引代数
+    generation = models.BigIntegerField(default=0, verbose_name='索引代数')
+
+    # 更新时间
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='更新时间')
+
+    class Meta:
+        db_table = 'search_index_state'
+        verbose_name = '全文索引状态'
+        verbose_name_plural = verbose_name
+
+    def __str__(self):
+        return f'{self.name}: {self.generation}'
@@ -0,0 +1,258 @@
+# coding:utf-8
+# @文件: project_toc.py
+# 文集目录缓存
+# 文集的文档目录序列化为 JSON 保存在 ProjectToc 中，同时缓存在进程内；ProjectToc.version 为目录版本号。
+# 文档新建、改名、排序、移动、发布、删除后通过信号或手动调用 invalidate 增加版本号，
+# 各进程读取目录时只查询版本号，与进程内缓存的版本一致时直接使用缓存的目录。
+# 失效时指定了修改的文档时只记录文档ID（ProjectToc.changed_docs），下次读取时只重新查询这些文档的
+# 原上级和新上级的下级文档，在已保存的目录上更新；未指定文档（如整个文集重新排序）时清空目录、完整重新生成。
+# 目录同时保存文集的阅读顺序（目录的深度优先顺序）及文档ID到序号的映射，上一篇/下一篇/序号直接查表。
+# 使用 QuerySet.update() 批量修改文档的地方需要手动调用 invalidate / invalidate_docs
+
+import json
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, TextField, Value, When
+from django.db.models.functions import Concat, Length
+from django.db.models.lookups import GreaterThan
+
+from app_doc.doc_tree import get_doc_tree
+from app_doc.models import Doc, ProjectToc
+
+
+# 影响文集目录的文档字段
+TOC_FIELDS = ('name', 'sort', 'parent_doc', 'top_doc', 'status', 'editor_mode', 'open_children')
+# 目录节点保存的文档字段
+NODE_FIELDS = ('name', 'open_children', 'editor_mode')
+# 待更新的文档ID超过该长度时不再记录，下次读取时完整重新生成目录
+CHANGED_DOCS_MAX_LENGTH = 2000
+# 表示需要完整重新生成目录的标记
+CHANGED_ALL = '*'
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _cache_size():
+    return getattr(settings, 'PROJECT_TOC_CACHE_SIZE', 256)
+
+
+def _make_node(doc, level=None):
+    return {
+        'id': doc['id'],
+        'name': doc['name'],
+        'open_children': doc['open_children'],
+        'editor_mode': doc['editor_mode'],
+    }
+
+
+def build_toc(pro_id):
+    """从数据库生成文集目录，返回 (目录, 文档数量)"""
+    return get_doc_tree(pro_id, NODE_FIELDS, _make_node)
+
+
+def _child_rows(pro_id, parent_ids):
+    """指定上级文档的已发布下级文档，按目录顺序"""
+    return Doc.objects.filter(top_doc=pro_id, status=1, parent_doc__in=parent_ids).order_by(
+        'sort', 'id'
+    ).values('id', 'parent_doc', *NODE_FIELDS)
+
+
+def update_toc(pro_id, toc, doc_ids):
+    """
+    按修改过的文档更新已保存的目录，返回 (目录, 文档数量, 阅读顺序)，无法更新时返回 None
+
+    只重新查询这些文档原上级和新上级的下级文档，其余节点及其下级原样保留；
+    新出现在目录中的文档（新建、发布、移入）逐层查询其下级文档。会直接修改传入的目录
+    """
+    nodes = {}
+    parents = {}
+    stack = [(0, node) for node in toc]
+    while stack:
+        parent_id, node = stack.pop()
+        nodes[node['id']] = node
+        parents[node['id']] = parent_id
+        stack.extend((node['id'], child) for child in node.get('children', ()))
+
+    # 原上级和新上级（仍在目录中时）的下级文档需要重新查询
+    dirty = {parents[i] for i in doc_ids if i in parents}
+    for row in Doc.objects.filter(id__in=doc_ids, top_doc=pro_id, status=1).values('parent_doc'):
+        if row['parent_doc'] == 0 or row['parent_doc'] in nodes:
+            dirty.add(row['parent_doc'])
+
+    children = {parent_id: [] for parent_id in dirty}
+    for row in _child_rows(pro_id, dirty):
+        children[row['parent_doc']].append(row)
+    added = []
+    for parent_id, rows in children.items():
+        items = []
+        for row in rows:
+            node = nodes.get(row['id'])
+            if node is None:
+                node = _make_node(row)
+                added.append(node)
+            else:
+                node.update((field, row[field]) for field in NODE_FIELDS)
+            items.append(node)
+        if parent_id == 0:
+            toc[:] = items
+        elif items:
+            nodes[parent_id]['children'] = items
+        else:
+            nodes[parent_id].pop('children', None)
+
+    # 新出现的文档逐层补充下级文档
+    visited = set(nodes)
+    while added:
+        parent_nodes = {node['id']: node for node in added}
+        added = []
+        for row in _child_rows(pro_id, parent_nodes):
+            if row['id'] in visited:
+                continue
+            visited.add(row['id'])
+            node = nodes.get(row['id']) or _make_node(row)
+            if row['id'] not in nodes:
+                added.append(node)
+            parent_nodes[row['parent_doc']].setdefault('children', []).append(node)
+
+    # 上级文档关系出现环等情况时同一节点会出现多次，改为完整重新生成
+    order = get_reading_order(toc)
+    if len(order) != len(set(order)):
+        return None
+    return toc, len(order), order
+
+
+def get_reading_order(toc):
+    """目录的深度优先顺序，即文档的阅读顺序；同一节点出现多次时只遍历一次，避免环导致死循环"""
+    order = []
+    visited = set()
+    stack = list(reversed(toc))
+    while stack:
+        node = stack.pop()
+        order.append(node['id'])
+        if id(node) in visited:
+            continue
+        visited.add(id(node))
+        stack.extend(reversed(node.get('children', ())))
+    return order
+
+
+def get_version(pro_id):
+    """
+    文集目录的版本，(ProjectToc ID, 版本号)
+
+    文集还没有目录记录时新建一条（每个文集只有一条记录，并发请求不会重复建立）；
+    记录随文集删除，重新建立的记录ID不同，因此版本不会与旧版本重复
+    """
+    version = ProjectToc.objects.filter(project_id=pro_id).values_list('id', 'version').first()
+    if version is None:
+        toc, created = ProjectToc.objects.get_or_create(project_id=pro_id, defaults={'value': ''})
+        version = (toc.id, toc.version)
+    return version
+
+
+def _load(pro_id):
+    """读取文集目录缓存，返回 (版本, 目录, 文档数量, 阅读顺序, 文档ID到阅读序号的映射)"""
+    pro_id = int(pro_id)
+    version = get_version(pro_id)
+    with _cache_lock:
+        cached = _cache.get(pro_id)
+        if cached is not None and cached[0] == version:
+            _cache.move_to_end(pro_id)
+            return cached
+
+    toc_id, toc_version = version
+    value, changed = ProjectToc.objects.filter(id=toc_id, version=toc_version).values_list(
+        'value', 'changed_docs'
+    ).first() or ('', '')
+    saved = True
+    data = json.loads(value) if value and changed != CHANGED_ALL else None
+    if data is not None and not changed:
+        toc, count = data['toc'], data['count']
+        order = data.get('order')
+        if order is None:
+            order = get_reading_order(toc)
+    else:
+        doc_ids = {int(i) for i in changed.split(',') if i} if data is not None else None
+        updated = update_toc(pro_id, data['toc'], doc_ids) if doc_ids else None
+        if updated is not None:
+            toc, count, order = updated
+        else:
+            toc, count = build_toc(pro_id)
+            order = get_reading_order(toc)
+        # 只在版本号未变化时保存，生成期间目录被失效则不保存，下次读取时重新生成
+        saved = ProjectToc.objects.filter(id=toc_id, version=toc_version).update(
+            value=json.dumps({'toc': toc, 'count': count, 'order': order}, ensure_ascii=False),
+            changed_docs='',
+        )
+
+    entry = (version, toc, count, order, {doc_id: i for i, doc_id in enumerate(order)})
+    if saved:
+        with _cache_lock:
+            _cache[pro_id] = entry
+            _cache.move_to_end(pro_id)
+            while len(_cache) > max(0, _cache_size()):
+                _cache.popitem(last=False)
+    return entry
+
+
+def get_toc(pro_id):
+    """
+    获取文集目录，返回 (目录, 文档数量, 版本)
+
+    返回的目录可能为多个请求共用的缓存对象，调用方不能修改
+    """
+    version, toc, count, order, positions = _load(pro_id)
+    return toc, count, version
+
+
+def get_doc_position(pro_id, doc_id):
+    """
+    文档在文集阅读顺序中的位置，返回 (阅读顺序, 序号, 上一篇文档ID, 下一篇文档ID)
+
+    序号从 1 开始；文档不在目录中（草稿、上级文档未发布等）时序号和上一篇/下一篇均为 None。
+    返回的阅读顺序为共用的缓存对象，调用方不能修改
+    """
+    version, toc, count, order, positions = _load(pro_id)
+    i = positions.get(int(doc_id))
+    if i is None:
+        return order, None, None, None
+    previous_id = order[i - 1] if i > 0 else None
+    next_id = order[i + 1] if i + 1 < len(order) else None
+    return order, i + 1, previous_id, next_id
+
+
+def _invalidate(project_ids, doc_ids=None):
+    tocs = ProjectToc.objects.filter(project_id__in=project_ids)
+    if not doc_ids:
+        tocs.update(version=F('version') + 1, value='', changed_docs='')
+        return
+    # 追加待更新的文档ID；已需要完整重新生成或记录过长时标记为完整重新生成
+    tocs.update(version=F('version') + 1, changed_docs=Case(
+        When(changed_docs=CHANGED_ALL, then=Value(CHANGED_ALL)),
+        When(GreaterThan(Length('changed_docs'), CHANGED_DOCS_MAX_LENGTH), then=Value(CHANGED_ALL)),
+        default=Concat(F('changed_docs'), Value(''.join(',{}'.format(i) for i in sorted(doc_ids)))),
+        output_field=TextField(),
+    ))
+
+
+def invalidate(*project_ids, doc_ids=None):
+    """
+    文集目录失效，在当前事务提交后增加版本号，避免其他进程在提交前按旧数据重新生成目录
+
+    doc_ids 为修改过的文档ID，指定时下次读取只更新这些文档所在的部分目录，否则完整重新生成
+    """
+    project_ids = {int(i) for i in project_ids if i}
+    doc_ids = {int(i) for i in doc_ids or () if i}
+    if project_ids:
+        transaction.on_commit(lambda: _invalidate(project_ids, doc_ids))
+
+
+def invalidate_docs(doc_ids):
+    """指定文档所属的文集目录失效，只更新这些文档所在的部分目录"""
+    doc_ids = [i for i in doc_ids if i]
+    if doc_ids:
+        invalidate(*Doc.objects.filter(id__in=doc_ids).values_list('top_doc', flat=True).distinct(), doc_ids=doc_ids)
@@ -15,6 +15,8 @@ from whoosh.util.text import rcompile
 import jieba
 import os
 
+from app_doc.search import token_cache
+
 # 获取当前文件所在目录
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -99,20 +101,21 @@ class ChineseTokenizer(Tokenizer):
             #         t.startchar = start_char + match.start()
             #         t.endchar = start_char + match.end()
             #     yield t
-            # 使用 cut_for_search 模式替代 cut_all，提高搜索准确性
-            # cut_for_search 会在精确模式基础上对长词再次切分，更适合搜索场景
-            seglist = jieba.cut_for_search(value)
-            for w in seglist:
-                # 过滤掉空白字符和单字符（可选，根据需求调整）
-                if w.strip() and len(w) >= 1:
-                    t.original = t.text = w
-                    t.boost = 1.0
-                    if positions:
-                        t.pos = start_pos + value.find(w)
-                    if chars:
-                        t.startchar = start_char + value.find(w)
-                        t.endchar = start_char + value.find(w) + len(w)
-                    yield t
+            # 使用 jieba.tokenize 的 search 模式：在精确模式基础上对长词再次切分，更适合搜索场景
+            # tokenize 会直接给出每个词在原文中的起止位置，单次遍历即可得到准确的字符偏移，
+            # 重复出现的词也能获得各自的位置；分词结果经 token_cache 缓存，已过滤空白字符
+            pos = start_pos
+            for w, start, end in token_cache.segment(value):
+                t.original = t.text = w
+                t.boost = 1.0
+                t.stopped = False
+                if positions:
+                    t.pos = pos
+                    pos += 1
+                if chars:
+                    t.startchar = start_char + start
+                    t.endchar = start_char + end
+                yield t
         else:
             # When gaps=True, iterate through the matches and
             # yield the text between them.
@@ -3,11 +3,37 @@
 # @创建者：州的先生
 # #日期：2020/11/24
 # 博客地址：zmister.com
+import threading
+from bisect import bisect_left
+from functools import lru_cache
+
 from haystack.utils import Highlighter
 from django.utils.html import strip_tags
 from app_doc.search.chinese_analyzer import ChineseAnalyzer as StemmingAnalyzer
 
 
+_analyzer = None
+_analyzer_lock = threading.Lock()
+
+
+def get_analyzer():
+    """进程内共用的分词器，避免每条搜索结果都重新构建分析器"""
+    global _analyzer
+    if _analyzer is None:
+        with _analyzer_lock:
+            if _analyzer is None:
+                _analyzer = StemmingAnalyzer()
+    return _analyzer
+
+
+@lru_cache(maxsize=256)
+def get_query_words(query):
+    """搜索词分词后的词集合，按搜索词缓存；同一结果页的每条结果、每个字段都使用相同的搜索词"""
+    return frozenset(
+        token.text.lower() for token in get_analyzer()(query) if token.text.replace(" ", '') != ''
+    )
+
+
 class MyHighLighter(Highlighter):
 
     def __init__(self, query, **kwargs):
@@ -27,10 +53,7 @@ class MyHighLighter(Highlighter):
         # self.query_words = set(
         #     [word.lower() for word in self.query.split() if not word.startswith("-")]
         # )
-        sa = StemmingAnalyzer()
-        self.query_words = set(
-            [token.text.lower() for token in sa(query) if token.text.replace(" ",'') != '']
-        )
+        self.query_words = get_query_words(query)
         # print(self.query_words)
 
     def highlight(self, text_block):
@@ -45,25 +68,15 @@ class MyHighLighter(Highlighter):
         best_start = 0
         best_end = self.max_length
 
-        # First, make sure we have words.
-        if not len(highlight_locations):
-            return (best_start, best_end)
-
-        words_found = []
-
-        # Next, make sure we found any words at all.
-        for word, offset_list in highlight_locations.items():
-            if len(offset_list):
-                # Add all of the locations to the list.
-                words_found.extend(offset_list)
-
-        if not len(words_found):
+        # 汇总所有搜索词的出现位置
+        words_found = sorted(
+            offset for offset_list in highlight_locations.values() for offset in offset_list
+        )
+        if not words_found:
             return (best_start, best_end)
 
         # 只有一个搜索词被发现
         if len(words_found) == 1:
-            # return (words_found[0], words_found[0] + self.max_length)  #
-            # new added
             best_start = words_found[0]
             best_end = words_found[0] + self.max_length
 
@@ -75,37 +88,25 @@ class MyHighLighter(Highlighter):
                     best_start = 0
             return (best_start, best_end)
 
-        # Sort the list so it's in ascending order.
-        words_found = sorted(words_found)
-
-        # We now have a denormalized list of all positions were a word was
-        # found. We'll iterate through and find the densest window we can by
-        # counting the number of found offsets (-1 to fit in the window).
-        highest_density = 0
-
-        if words_found[:-1][0] > self.max_length:
-            best_start = words_found[:-1][0]
+        # 没有两个命中位置落在同一窗口内时，使用第一个命中位置（位于文本开头附近时从头显示）
+        if words_found[0] > self.max_length:
+            best_start = words_found[0]
             best_end = best_start + self.max_length
 
-        for count, start in enumerate(words_found[:-1]):
-            current_density = 1
-
-            for end in words_found[count + 1:]:
-                if end - start < self.max_length:
-                    current_density += 1
-                else:
-                    current_density = 0
-
-                # Only replace if we have a bigger (not equal density) so we
-                # give deference to windows earlier in the document.
-                if current_density > highest_density:
-                    # print(start)
-                    if start == 0:
-                        best_start = start
-                    else:
-                        best_start = start
-                    best_end = start + self.max_length
-                    highest_density = current_density
+        # 双指针滑动窗口：以每个出现位置为窗口起点，end 指向第一个落在窗口之外的位置，
+        # 窗口内的命中数即为 end - i；end 只会向后移动，整体为线性时间。
+        # 只在命中数严格更大时替换，命中数相同时优先选择靠前的窗口
+        highest_density = 1
+        end = 0
+        for i, start in enumerate(words_found):
+            while end < len(words_found) and words_found[end] - start < self.max_length:
+                end += 1
+            current_density = end - i
+            if current_density > highest_density:
+                best_start = start
+                best_end = start + self.max_length
+                highest_density = current_density
+
         if best_start < 10:
             best_start = 0
             best_end = 200
@@ -120,10 +121,13 @@ class MyHighLighter(Highlighter):
         text = self.text_block[start_offset:end_offset]
 
         # Invert highlight_locations to a location -> term list
+        # 只取落在窗口内的位置（各词的位置列表本身有序），窗口外的大量命中无需排序和比对
         term_list = []
 
         for term, locations in highlight_locations.items():
-            term_list += [(loc - start_offset, term) for loc in locations]
+            lo = bisect_left(locations, start_offset)
+            hi = bisect_left(locations, end_offset, lo)
+            term_list += [(loc - start_offset, term) for loc in locations[lo:hi]]
 
         loc_to_term = sorted(term_list)
 
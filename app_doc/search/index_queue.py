@@ -0,0 +1,289 @@
+# coding:utf-8
+# @文件: index_queue.py
+# 全文索引更新队列
+# 对象保存/删除时只在 search_index_queue 表中记录待更新的对象，请求内不再写入 Whoosh 索引；
+# 后台线程（或 process_index_queue 命令）按批取出队列，同一批对象只打开一次写入器、提交一次。
+# 多个进程同时处理队列时，取出的记录在一个短事务中标记为处理中（数据库支持时使用 SELECT ... FOR UPDATE SKIP LOCKED），
+# 其他进程跳过这些记录；写入失败的记录按加倍的等待时间重试，失败次数达到上限后不再处理，不会阻塞后面的记录
+
+import threading
+import time
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from haystack.exceptions import NotHandled
+from haystack.signals import BaseSignalProcessor
+from loguru import logger
+
+from app_doc.models_search import SearchIndexQueue
+from app_doc.search import trigram_index
+
+
+# 取出的记录标记为处理中的秒数，处理进程异常退出时，超过该时间后其他进程重新处理
+CLAIM_TIMEOUT = 300
+
+_worker = None
+_worker_lock = threading.Lock()
+_resumed = False
+
+
+def is_enabled():
+    return getattr(settings, 'SEARCH_INDEX_QUEUE', True)
+
+
+def get_delay():
+    """对象最后一次修改后等待的秒数，期间的连续修改合并为一次写入"""
+    return getattr(settings, 'SEARCH_INDEX_QUEUE_DELAY', 2)
+
+
+def get_max_delay():
+    """对象首次加入队列后最多等待的秒数，即索引延迟的上限"""
+    return getattr(settings, 'SEARCH_INDEX_QUEUE_MAX_DELAY', 30)
+
+
+def get_batch_size():
+    return getattr(settings, 'SEARCH_INDEX_QUEUE_BATCH_SIZE', 200)
+
+
+def get_retry_delay(attempts):
+    """第 attempts 次写入失败后等待重试的秒数，每次失败后加倍"""
+    return getattr(settings, 'SEARCH_INDEX_QUEUE_RETRY_DELAY', 30) * 2 ** (attempts - 1)
+
+
+def get_max_attempts():
+    return getattr(settings, 'SEARCH_INDEX_QUEUE_MAX_ATTEMPTS', 5)
+
+
+def enqueue(model, object_ids):
+    """将对象加入索引更新队列，已在队列中的对象只更新修改时间"""
+    object_ids = {int(i) for i in object_ids}
+    if not object_ids:
+        return
+    label = model._meta.label
+    now = timezone.now()
+    queued = SearchIndexQueue.objects.filter(model_label=label, object_id__in=object_ids)
+    existing = set(queued.values_list('object_id', flat=True))
+    if existing:
+        queued.update(updated_at=now)
+        # 已放弃重试的对象再次修改后重新处理
+        queued.filter(failed=True).update(failed=False, attempts=0, next_attempt_at=None)
+    SearchIndexQueue.objects.bulk_create(
+        [
+            SearchIndexQueue(model_label=label, object_id=i, created_at=now, updated_at=now)
+            for i in object_ids - existing
+        ],
+        ignore_conflicts=True,
+    )
+    ensure_worker()
+
+
+def _claim_items(force=False):
+    """取出一批到期的记录并标记为处理中，其他进程在 CLAIM_TIMEOUT 秒内跳过这些记录"""
+    now = timezone.now()
+    queryset = SearchIndexQueue.objects.filter(
+        Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=now), failed=False
+    ).order_by('created_at')
+    if not force:
+        queryset = queryset.filter(
+            Q(updated_at__lte=now - timedelta(seconds=get_delay())) |
+            Q(created_at__lte=now - timedelta(seconds=get_max_delay()))
+        )
+    claimed_until = now + timedelta(seconds=CLAIM_TIMEOUT)
+    if connection.features.has_select_for_update_skip_locked:
+        # 跳过其他进程正在取出的记录
+        with transaction.atomic():
+            items = list(queryset.select_for_update(skip_locked=True)[:get_batch_size()])
+            SearchIndexQueue.objects.filter(id__in=[item.id for item in items]).update(next_attempt_at=claimed_until)
+        return items
+    # 不支持 SKIP LOCKED 的数据库（如 SQLite）逐条按读取时的状态标记，已被其他进程标记的记录跳过
+    items = []
+    for item in queryset[:get_batch_size()]:
+        if SearchIndexQueue.objects.filter(id=item.id, next_attempt_at=item.next_attempt_at).update(
+            next_attempt_at=claimed_until
+        ):
+            items.append(item)
+    return items
+
+
+def _record_failure(item, error):
+    """记录写入失败，等待重试；失败次数达到上限后放弃重试"""
+    attempts = item.attempts + 1
+    failed = attempts >= get_max_attempts()
+    SearchIndexQueue.objects.filter(id=item.id).update(
+        attempts=attempts,
+        failed=failed,
+        next_attempt_at=None if failed else timezone.now() + timedelta(seconds=get_retry_delay(attempts)),
+        last_error=repr(error)[:2000],
+    )
+    if failed:
+        logger.error(f"全文索引更新失败 {attempts} 次，不再重试：{item} {error!r}")
+
+
+def apply_objects(model, object_ids, using='default'):
+    """将一组对象的最新状态写入索引：存在于索引查询集中的更新，其余的删除"""
+    from haystack import connections
+
+    backend = connections[using].get_backend()
+    index = connections[using].get_unified_index().get_index(model)
+    objects = list(index.index_queryset(using=using).filter(pk__in=object_ids))
+    removed = set(object_ids) - {obj.pk for obj in objects}
+    identifiers = ['{}.{}'.format(model._meta.label_lower, pk) for pk in removed]
+    if hasattr(backend, 'apply_changes'):
+        backend.apply_changes(index, objects, identifiers)
+    else:
+        if objects:
+            backend.update(index, objects)
+        for identifier in identifiers:
+            backend.remove(identifier)
+
+    if model._meta.label == 'app_doc.Doc' and trigram_index.is_enabled():
+        docs = list(model.objects.filter(id__in=object_ids))
+        for doc in docs:
+            trigram_index.index_doc(doc)
+        for doc_id in set(object_ids) - {doc.id for doc in docs}:
+            trigram_index.remove_doc(doc_id)
+
+
+def _apply_group(model, group):
+    """写入一组记录，返回写入成功的记录；整组失败时逐个重试，只有失败的记录等待重试"""
+    try:
+        apply_objects(model, [item.object_id for item in group])
+        return group
+    except NotHandled:
+        return group
+    except Exception as e:
+        if len(group) == 1:
+            logger.exception(f"写入全文索引失败：{group[0]}")
+            _record_failure(group[0], e)
+            return []
+    done = []
+    for item in group:
+        done += _apply_group(model, [item])
+    return done
+
+
+def process_queue(force=False):
+    """
+    处理一批到期的队列记录
+
+    Args:
+        force: 为 True 时忽略合并等待时间，处理全部记录（写入失败后的重试等待时间仍然有效）
+
+    Returns:
+        本批取出的记录数量
+    """
+    items = _claim_items(force)
+    groups = {}
+    for item in items:
+        groups.setdefault(item.model_label, []).append(item)
+
+    for label, group in groups.items():
+        try:
+            model = apps.get_model(label)
+        except LookupError:
+            logger.error(f"索引更新队列中存在未知模型：{label}")
+            done = group
+        else:
+            done = _apply_group(model, group)
+        # 处理期间再次修改的对象 updated_at 已变化，保留在队列中等待下一批
+        for item in done:
+            SearchIndexQueue.objects.filter(id=item.id, updated_at=item.updated_at).delete()
+        SearchIndexQueue.objects.filter(id__in=[item.id for item in done]).update(next_attempt_at=None)
+    return len(items)
+
+
+def retry_failed():
+    """已放弃重试的记录重新加入处理，返回记录数量"""
+    return SearchIndexQueue.objects.filter(failed=True).update(failed=False, attempts=0, next_attempt_at=None)
+
+
+def drain(force=False):
+    """处理所有到期的队列记录，返回处理的记录数量"""
+    total = 0
+    while True:
+        count = process_queue(force)
+        total += count
+        if count < get_batch_size():
+            return total
+
+
+def _worker_loop():
+    interval = max(0.5, min(get_delay(), get_max_delay()) / 2)
+    while True:
+        time.sleep(interval)
+        try:
+            close_old_connections()
+            drain()
+        except Exception:
+            logger.exception("处理全文索引更新队列异常")
+        finally:
+            close_old_connections()
+
+
+def ensure_worker():
+    """按需启动当前进程内的队列处理线程，配置为使用 process_index_queue 命令时不启动"""
+    global _worker
+    if not getattr(settings, 'SEARCH_INDEX_QUEUE_THREAD', True):
+        return
+    if _worker is not None and _worker.is_alive():
+        return
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_worker_loop, name='search-index-queue', daemon=True)
+            _worker.start()
+
+
+def resume_pending(**kwargs):
+    """
+    进程处理第一个请求时，若队列中有上次运行遗留的记录则启动处理线程，
+    不必等到下一次修改文档时才写入索引（request_started 信号处理函数）
+    """
+    global _resumed
+    if _resumed:
+        return
+    _resumed = True
+    if not is_enabled() or not getattr(settings, 'SEARCH_INDEX_QUEUE_THREAD', True):
+        return
+    try:
+        if SearchIndexQueue.objects.filter(failed=False).exists():
+            ensure_worker()
+    except Exception:
+        logger.exception("检查全文索引更新队列异常")
+
+
+class QueuedSignalProcessor(BaseSignalProcessor):
+    """
+    将已注册搜索索引的模型的保存/删除记录到索引更新队列，由队列统一写入索引
+    """
+
+    def setup(self):
+        from django.db.models import signals
+        signals.post_save.connect(self.handle_save)
+        signals.post_delete.connect(self.handle_delete)
+
+    def teardown(self):
+        from django.db.models import signals
+        signals.post_save.disconnect(self.handle_save)
+        signals.post_delete.disconnect(self.handle_delete)
+
+    def _enqueue(self, sender, instance):
+        for using in self.connection_router.for_write(instance=instance):
+            try:
+                self.connections[using].get_unified_index().get_index(sender)
+            except NotHandled:
+                continue
+            try:
+                enqueue(sender, [instance.pk])
+            except Exception:
+                logger.exception("加入全文索引更新队列异常")
+            return
+
+    def handle_save(self, sender, instance, **kwargs):
+        self._enqueue(sender, instance)
+
+    def handle_delete(self, sender, instance, **kwargs):
+        self._enqueue(sender, instance)
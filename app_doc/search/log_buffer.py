@@ -0,0 +1,128 @@
+# coding:utf-8
+# @文件: log_buffer.py
+# 搜索日志缓冲写入
+# 搜索请求只把日志追加到进程内的环形缓冲区，由后台线程定期批量写入 search_log 表，
+# 避免每次搜索都同步写库，与文档保存争用 SQLite 的写锁；进程退出时写入剩余日志
+
+import atexit
+import threading
+from collections import deque
+
+from django.conf import settings
+from django.db import close_old_connections
+from loguru import logger
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+# 保证同一时间只有一个线程在写库，缓冲区内日志的写入顺序与搜索顺序一致
+_flush_lock = threading.Lock()
+_wakeup = threading.Event()
+_worker = None
+_worker_lock = threading.Lock()
+# 缓冲区已满时被丢弃的日志数量
+dropped = 0
+
+
+def is_enabled():
+    return getattr(settings, 'SEARCH_LOG_BUFFER', True)
+
+
+def get_batch_size():
+    return getattr(settings, 'SEARCH_LOG_BATCH_SIZE', 500)
+
+
+def get_flush_interval():
+    return getattr(settings, 'SEARCH_LOG_FLUSH_INTERVAL', 5)
+
+
+def _get_buffer():
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = deque(maxlen=getattr(settings, 'SEARCH_LOG_BUFFER_SIZE', 10000))
+    return _buffer
+
+
+def append(search_log):
+    """
+    将未保存的 SearchLog 实例加入缓冲区，不访问数据库
+
+    缓冲区已满（数据库长时间不可写）时丢弃最早的日志
+    """
+    global dropped
+    buffer = _get_buffer()
+    with _buffer_lock:
+        if len(buffer) == buffer.maxlen:
+            dropped += 1
+        buffer.append(search_log)
+        pending = len(buffer)
+    ensure_worker()
+    if pending >= get_batch_size():
+        _wakeup.set()
+
+
+def flush():
+    """将缓冲区内的日志分批写入数据库，返回写入的数量"""
+    from app_doc.models_search import SearchLog
+
+    if _buffer is None:
+        return 0
+    total = 0
+    with _flush_lock:
+        while True:
+            with _buffer_lock:
+                batch = [_buffer.popleft() for _ in range(min(len(_buffer), get_batch_size()))]
+            if not batch:
+                return total
+            try:
+                SearchLog.objects.bulk_create(batch)
+            except Exception:
+                logger.exception("批量写入搜索日志异常")
+                # 放回缓冲区等待下次写入
+                with _buffer_lock:
+                    _buffer.extendleft(reversed(batch))
+                return total
+            total += len(batch)
+
+
+def _worker_loop():
+    while True:
+        _wakeup.wait(get_flush_interval())
+        _wakeup.clear()
+        try:
+            close_old_connections()
+            flush()
+        except Exception:
+            logger.exception("写入搜索日志异常")
+        finally:
+            close_old_connections()
+
+
+def ensure_worker():
+    """按需启动当前进程内的日志写入线程"""
+    global _worker
+    if _worker is not None and _worker.is_alive():
+        return
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_worker_loop, name='search-log-writer', daemon=True)
+            _worker.start()
+
+
+def get_stats():
+    """当前进程内待写入和被丢弃的日志数量"""
+    with _buffer_lock:
+        pending = len(_buffer) if _buffer is not None else 0
+    return {'pending': pending, 'dropped': dropped}
+
+
+def _flush_at_exit():
+    try:
+        flush()
+    except Exception:
+        logger.exception("进程退出时写入搜索日志异常")
+
+
+atexit.register(_flush_at_exit)
@@ -0,0 +1,179 @@
+# coding:utf-8
+# @文件: parallel_index.py
+# Whoosh 全文索引的多进程并行重建
+# 各工作进程读取分配到的对象、分词并写入各自独立的索引段，
+# 主进程在持有索引写锁的情况下将全部新段一次性登记到索引目录（TOC）中
+# 写入索引段和登记 TOC 使用了 whoosh SegmentWriter 的内部方法，依赖 requirements.txt 中固定的 whoosh 版本
+
+import multiprocessing
+import os
+import queue
+import time
+
+from loguru import logger
+
+
+# 已验证过内部接口的 whoosh 版本
+WHOOSH_VERSION = (2, 7, 4)
+# 等待工作进程消息的超时时间（秒），超时后也会检查工作进程是否异常退出
+POLL_TIMEOUT = 1
+
+
+def _index_shard(worker_no, jobs, using, batch_size, result_queue, settings_module):
+    """
+    工作进程：为分配到的对象建立一个新的索引段
+
+    Args:
+        jobs: [(模型标识, 主键列表), ...]
+        result_queue: 回报 ('progress', 进程序号, 数量) / ('done', 进程序号, 索引段) / ('error', 进程序号, 错误信息)
+    """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    import django
+    django.setup()
+
+    from django.apps import apps
+    from haystack import connections
+    from haystack.exceptions import SkipDocument
+    from whoosh.writing import SegmentWriter
+    from app_doc.search import token_cache
+
+    try:
+        backend = connections[using].get_backend()
+        backend.setup()
+        unified_index = connections[using].get_unified_index()
+        # 写锁由主进程持有
+        writer = SegmentWriter(backend.index, _lk=False)
+        for model_label, pks in jobs:
+            index = unified_index.get_index(apps.get_model(model_label))
+            for i in range(0, len(pks), batch_size):
+                chunk = pks[i:i + batch_size]
+                for obj in index.index_queryset(using=using).filter(pk__in=chunk):
+                    try:
+                        doc = index.full_prepare(obj)
+                    except SkipDocument:
+                        continue
+                    for key in doc:
+                        doc[key] = backend._from_python(doc[key])
+                    doc.pop('boost', None)
+                    writer.add_document(**doc)
+                result_queue.put(('progress', worker_no, len(chunk)))
+        token_cache.flush()
+
+        # 与 whoosh MpWriter 的子进程一致，不调用 _finish()：
+        # 临时目录由各进程共享，由主进程的写入器负责删除
+        if writer._added:
+            segment = writer._finalize_segment()
+        else:
+            writer._close_segment()
+            segment = None
+        result_queue.put(('done', worker_no, segment))
+    except Exception as e:
+        logger.exception("并行重建索引工作进程异常")
+        result_queue.put(('error', worker_no, repr(e)))
+
+
+def _collect_jobs(using, workers):
+    """按模型收集需要索引的主键，轮流分配给各工作进程，使各进程的数据量大致均衡"""
+    from haystack import connections
+
+    unified_index = connections[using].get_unified_index()
+    shards = [[] for _ in range(workers)]
+    total = 0
+    for model in unified_index.get_indexed_models():
+        index = unified_index.get_index(model)
+        pks = list(index.index_queryset(using=using).order_by('pk').values_list('pk', flat=True))
+        total += len(pks)
+        for n in range(workers):
+            if pks[n::workers]:
+                shards[n].append((model._meta.label, pks[n::workers]))
+    return shards, total
+
+
+def rebuild(workers, batch_size=500, using='default', stdout=None, lock_timeout=60):
+    """
+    清空并使用多个进程重建全文索引
+
+    重建期间主进程持有索引写锁：其他进程提交时会清理未登记到 TOC 的索引段文件，
+    不持有写锁会删除工作进程尚未登记的新段。实时更新在等待写锁超时后失败，
+    启用索引更新队列时记录保留在队列中，重建完成后再写入
+
+    Returns:
+        已处理的对象数量
+    """
+    import whoosh
+    from django.core.management.base import CommandError
+    from haystack import connections
+    from whoosh.writing import SegmentWriter, NO_MERGE
+
+    if tuple(whoosh.__version__) != WHOOSH_VERSION:
+        raise CommandError('并行重建索引只支持 whoosh {}，请使用 python manage.py rebuild_index'.format(
+            '.'.join(str(i) for i in WHOOSH_VERSION)
+        ))
+    backend = connections[using].get_backend()
+    if not getattr(backend, 'use_file_storage', False):
+        raise CommandError('并行重建索引只支持使用文件存储的 Whoosh 索引')
+    if not backend.setup_complete:
+        backend.setup()
+    if getattr(backend, 'sharded', False):
+        raise CommandError('按文集分片的全文索引不支持并行重建，请使用 python manage.py rebuild_index')
+    backend.clear()
+
+    shards, total = _collect_jobs(using, workers)
+    # 重建期间持有写锁：实时更新的写入会排队等待，也避免其提交时清理掉尚未登记的新段
+    writer = SegmentWriter(backend.index, timeout=lock_timeout)
+
+    ctx = multiprocessing.get_context('spawn')
+    result_queue = ctx.Queue()
+    settings_module = os.environ.get('DJANGO_SETTINGS_MODULE', 'MrDoc.settings')
+    processes = []
+    for worker_no, jobs in enumerate(shards):
+        if not jobs:
+            continue
+        p = ctx.Process(
+            target=_index_shard,
+            args=(worker_no, jobs, using, batch_size, result_queue, settings_module),
+        )
+        p.start()
+        processes.append(p)
+
+    segments = []
+    done = 0
+    finished = 0
+    start_time = time.time()
+    try:
+        while finished < len(processes):
+            try:
+                kind, worker_no, payload = result_queue.get(timeout=POLL_TIMEOUT)
+            except queue.Empty:
+                kind = None
+            # 每次循环都检查退出码：崩溃的进程不会再发送消息，而其他进程仍在回报进度
+            if any(p.exitcode not in (None, 0) for p in processes):
+                raise CommandError('并行重建索引的工作进程异常退出')
+            if kind is None:
+                continue
+            if kind == 'progress':
+                done += payload
+                if stdout is not None:
+                    stdout.write(f'已索引 {done}/{total}，耗时 {time.time() - start_time:.1f} 秒')
+            elif kind == 'done':
+                finished += 1
+                if payload is not None:
+                    segments.append(payload)
+            else:
+                raise CommandError(f'工作进程 {worker_no} 重建索引失败：{payload}')
+    except BaseException:
+        for p in processes:
+            if p.is_alive():
+                p.terminate()
+        writer.cancel()
+        raise
+    finally:
+        for p in processes:
+            p.join()
+
+    # 保留清空后的空索引段列表，追加各进程写入的新段
+    final_segments = writer._merge_segments(NO_MERGE, False, False) + segments
+    writer._close_segment()
+    writer._commit_toc(final_segments)
+    writer._finish()
+    return done
@@ -0,0 +1,238 @@
+# coding:utf-8
+# @文件: result_cache.py
+# 全文搜索结果缓存
+# 按 规范化搜索词 + 搜索参数 + 可访问文集范围 + 索引代数 缓存命中的对象ID列表和总数，
+# 翻页时对ID列表切片，只为当前页加载对象；索引提交后代数变化，旧缓存不再被读取，随超时自然过期
+
+import hashlib
+import json
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from haystack.models import SearchResult
+from loguru import logger
+
+from app_doc.search import synonyms
+
+
+CACHE_KEY_PREFIX = 'search_result:v2:'
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def is_enabled():
+    return getattr(settings, 'SEARCH_RESULT_CACHE_TIMEOUT', 300) > 0
+
+
+def get_max_hits():
+    """每个缓存项最多保存的结果ID数量，超出部分翻页时直接查询索引"""
+    return getattr(settings, 'SEARCH_RESULT_CACHE_MAX_HITS', 1000)
+
+
+def normalize_query(query):
+    """合并多余的空白字符；不改变大小写，AND / OR 等运算符区分大小写"""
+    return ' '.join((query or '').split())
+
+
+def scope_fingerprint(project_ids):
+    """文集范围的指纹，None 表示不限文集"""
+    if project_ids is None:
+        return 'all'
+    ids = ','.join(str(i) for i in sorted({int(i) for i in project_ids}))
+    return hashlib.sha1(ids.encode('utf-8')).hexdigest()
+
+
+def get_index_generation(using='default'):
+    """当前全文索引的代数，后端不支持时返回 None（此时不使用缓存）"""
+    from haystack import connections
+
+    backend = connections[using].get_backend()
+    if not hasattr(backend, 'index_generation'):
+        return None
+    return backend.index_generation()
+
+
+def _count(namespace, name, n=1):
+    with _stats_lock:
+        stats = _stats.setdefault(namespace, {'hits': 0, 'misses': 0, 'live_pages': 0})
+        stats[name] += n
+
+
+def make_key(namespace, query, scope=None, generation=None, **params):
+    raw = json.dumps(
+        [namespace, generation, normalize_query(query), scope_fingerprint(scope), sorted(params.items())],
+        ensure_ascii=False, default=str,
+    )
+    return CACHE_KEY_PREFIX + hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def get_or_compute(namespace, query, compute, scope=None, cacheable=None, **params):
+    """
+    获取缓存的搜索结果，未命中时调用 compute() 计算并缓存
+
+    Args:
+        namespace: 调用方标识，不同接口的结果互不共享
+        query: 搜索词
+        compute: 无参函数，返回可序列化的结果
+        scope: 可访问的文集ID集合，None 表示不限文集
+        cacheable: 可选，判断 compute() 的结果是否可以缓存的函数
+        params: 其他影响结果的参数，如搜索模式、字段、时间范围
+
+    Returns:
+        compute() 的结果
+    """
+    if not is_enabled():
+        return compute()
+    try:
+        generation = get_index_generation()
+    except Exception:
+        logger.exception("获取全文索引代数异常")
+        generation = None
+    if generation is None:
+        return compute()
+
+    # 同义词修改后搜索结果也会变化
+    if synonyms.is_enabled():
+        params['synonyms'] = synonyms.get_version()
+    key = make_key(namespace, query, scope, generation, **params)
+    value = cache.get(key)
+    if value is not None:
+        _count(namespace, 'hits')
+        return value
+    _count(namespace, 'misses')
+    value = compute()
+    if cacheable is None or cacheable(value):
+        cache.set(key, value, getattr(settings, 'SEARCH_RESULT_CACHE_TIMEOUT', 300))
+    return value
+
+
+def _result_key(result):
+    return (result.app_label, result.model_name, result.pk)
+
+
+def cached_results(namespace, query, sqs, scope=None, load_objects=True, **params):
+    """
+    缓存搜索查询集命中的有序结果ID列表，返回可供 Paginator 分页的 CachedResults
+
+    Args:
+        sqs: 已构建好的 SearchQuerySet，未命中缓存或翻页超出缓存范围时执行
+        load_objects: 切片时是否批量加载模型对象；为 False 时由调用方按需加载所需字段
+    """
+    def compute():
+        max_hits = get_max_hits()
+        hits = [_result_key(r) for r in sqs[:max_hits]]
+        estimated = _estimated_hits(sqs)
+        if estimated is not None:
+            # 超出时间预算，只能对已收集到的结果分页
+            return hits, len(hits), estimated
+        total = len(hits) if len(hits) < max_hits else sqs.count()
+        return hits, total, None
+
+    # 超出时间预算的部分结果不缓存，下次请求重新搜索
+    hits, total, estimated = get_or_compute(
+        namespace, query, compute, scope=scope, cacheable=lambda value: value[2] is None, **params
+    )
+    return CachedResults(hits, total, sqs, namespace, estimated, load_objects)
+
+
+def _estimated_hits(sqs):
+    """查询集超出时间预算时估算的命中总数，结果完整时返回 None"""
+    query = getattr(sqs, 'query', None)
+    if query is None or not hasattr(query, 'is_partial') or not query.is_partial():
+        return None
+    return max(query.estimated_hits() or 0, 0)
+
+
+class CachedResults(object):
+    """
+    按缓存的结果ID列表分页的搜索结果
+
+    切片时只为该页的ID批量加载对象并构造 SearchResult（object 已加载）；
+    切片超出缓存的ID范围时回退到原搜索查询集。
+    搜索超出时间预算时 partial 为 True，只对已收集到的结果分页，estimated_total 为估算的命中总数。
+    load_objects 为 False 时切片只返回带有 pk 的 SearchResult，不访问数据库
+    """
+
+    def __init__(self, hits, total, sqs, namespace=None, estimated_total=None, load_objects=True):
+        self.hits = hits
+        self.total = total
+        self.sqs = sqs
+        self.namespace = namespace
+        self.partial = estimated_total is not None
+        self.estimated_total = total if estimated_total is None else max(estimated_total, total)
+        self.load_objects = load_objects
+        # haystack SearchView.build_page 会先切片一次当前页再交给 Paginator，保留最近一次切片避免重复加载
+        self._last_slice = None
+
+    def __len__(self):
+        return self.total
+
+    def count(self):
+        return self.total
+
+    def __iter__(self):
+        return iter(self[0:self.total])
+
+    def __getitem__(self, k):
+        if not isinstance(k, slice):
+            items = self[k:k + 1]
+            if not items:
+                raise IndexError('搜索结果索引超出范围')
+            return items[0]
+
+        start = k.start or 0
+        stop = self.total if k.stop is None else min(k.stop, self.total)
+        if stop <= start:
+            return []
+        if self._last_slice is not None and self._last_slice[:2] == (start, stop):
+            return list(self._last_slice[2])
+        if stop > len(self.hits):
+            if self.namespace:
+                _count(self.namespace, 'live_pages')
+            items = list(self.sqs[start:stop])
+            if _estimated_hits(self.sqs) is not None:
+                self.partial = True
+        elif self.load_objects:
+            items = self._load(self.hits[start:stop])
+        else:
+            items = [
+                SearchResult(app_label, model_name, pk, None)
+                for app_label, model_name, pk in self.hits[start:stop]
+            ]
+        self._last_slice = (start, stop, items)
+        return list(items)
+
+    def _load(self, keys):
+        from django.apps import apps
+
+        by_model = {}
+        for app_label, model_name, pk in keys:
+            by_model.setdefault((app_label, model_name), []).append(pk)
+        objects = {}
+        for (app_label, model_name), pks in by_model.items():
+            model = apps.get_model(app_label, model_name)
+            for pk, obj in model._default_manager.in_bulk(pks).items():
+                objects[(app_label, model_name, str(pk))] = obj
+
+        results = []
+        for app_label, model_name, pk in keys:
+            obj = objects.get((app_label, model_name, str(pk)))
+            # 缓存期间被删除的对象直接跳过
+            if obj is None:
+                continue
+            result = SearchResult(app_label, model_name, pk, None)
+            result._object = obj
+            results.append(result)
+        return results
+
+
+def get_stats():
+    """当前进程内各接口的结果缓存命中计数"""
+    with _stats_lock:
+        stats = {namespace: dict(counts) for namespace, counts in _stats.items()}
+    for counts in stats.values():
+        total = counts['hits'] + counts['misses']
+        counts['hit_rate'] = round(counts['hits'] / total, 4) if total else 0
+    return stats
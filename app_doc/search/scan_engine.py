@@ -0,0 +1,215 @@
+# coding:utf-8
+# @文件: scan_engine.py
+# 内容搜索扫描引擎
+# 全局内容搜索时将候选文档ID分块，交给进程池中的工作进程各自读取文档内容并逐行匹配，
+# 主进程按文档ID顺序合并结果，保证分页结果与串行扫描一致
+
+import atexit
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from loguru import logger
+
+
+# 每个工作进程单次处理的文档数量范围
+MIN_CHUNK_SIZE = 200
+MAX_CHUNK_SIZE = 2000
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_worker_count():
+    return getattr(settings, 'SEARCH_SCAN_WORKERS', 0)
+
+
+def should_parallelize(doc_count):
+    """文档数量达到阈值且配置了多个工作进程时才使用并行扫描"""
+    return get_worker_count() > 1 and doc_count >= getattr(settings, 'SEARCH_SCAN_PARALLEL_MIN_DOCS', 2000)
+
+
+def extract_line_context(lines, line_idx, before, after):
+    """提取匹配行前后的上下文行"""
+    before_context = []
+    if before > 0:
+        start = max(0, line_idx - before)
+        before_context = [
+            {'line_num': i + 1, 'line': lines[i]}
+            for i in range(start, line_idx)
+        ]
+
+    after_context = []
+    if after > 0:
+        end = min(len(lines), line_idx + after + 1)
+        after_context = [
+            {'line_num': i + 1, 'line': lines[i]}
+            for i in range(line_idx + 1, end)
+        ]
+    return before_context, after_context
+
+
+def match_content_lines(content, compiled_pattern, before_lines, after_lines, max_matches):
+    """
+    逐行匹配文档内容
+
+    Returns:
+        匹配行列表，最多 max_matches 条
+    """
+    lines = content.split('\n')
+    matches = []
+    for line_idx, line in enumerate(lines):
+        # 检查是否已达到最大匹配数
+        if len(matches) >= max_matches:
+            break
+
+        if compiled_pattern.search(line):
+            # 计算匹配位置
+            match_positions = [[m.start(), m.end()] for m in compiled_pattern.finditer(line)]
+
+            # 提取上下文（使用独立的 before_lines 和 after_lines）
+            before_context, after_context = extract_line_context(
+                lines, line_idx, before_lines, after_lines
+            )
+
+            matches.append({
+                'line_num': line_idx + 1,
+                'line': line,
+                'match_positions': match_positions,
+                'before_context': before_context,
+                'after_context': after_context,
+            })
+    return matches
+
+
+def iter_serial_matches(docs, compiled_pattern, before_lines, after_lines, max_results):
+    """
+    串行扫描文档，生成 (文档ID, 文档名称, 文集ID, 匹配行列表)
+    匹配文档数或匹配行总数达到 max_results 后停止
+    """
+    total_matches = 0
+    docs_found = 0
+    for doc in docs:
+        if docs_found >= max_results or total_matches >= max_results:
+            break
+
+        # 获取文档内容
+        content = doc.content if doc.content else doc.pre_content
+        if not content:
+            continue
+
+        matches = match_content_lines(
+            content, compiled_pattern, before_lines, after_lines, max_results - total_matches
+        )
+        if matches:
+            total_matches += len(matches)
+            docs_found += 1
+            yield doc.id, doc.name, doc.top_doc, matches
+
+
+def _init_worker(settings_module):
+    # 工作进程以 spawn 方式启动，需要独立初始化 Django
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    import django
+    django.setup()
+
+
+def scan_chunk(doc_ids, pattern, flags, before_lines, after_lines, max_results):
+    """
+    工作进程：读取一批文档的内容并逐行匹配
+
+    Returns:
+        [(文档ID, 文档名称, 文集ID, 匹配行列表), ...]，按文档ID升序，
+        匹配文档数与匹配行数均不超过 max_results
+    """
+    from app_doc.models import Doc
+
+    compiled_pattern = re.compile(pattern, flags)
+    docs = Doc.objects.filter(id__in=doc_ids, status=1).order_by('id').only(
+        'id', 'name', 'top_doc', 'content', 'pre_content'
+    )
+    return list(iter_serial_matches(
+        docs.iterator(), compiled_pattern, before_lines, after_lines, max_results
+    ))
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=get_worker_count(),
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(os.environ.get('DJANGO_SETTINGS_MODULE', 'MrDoc.settings'),),
+            )
+        return _executor
+
+
+def _reset_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+atexit.register(_reset_executor)
+
+
+def _chunks(doc_ids):
+    size = len(doc_ids) // (get_worker_count() * 4) + 1
+    size = min(max(size, MIN_CHUNK_SIZE), MAX_CHUNK_SIZE)
+    for i in range(0, len(doc_ids), size):
+        yield doc_ids[i:i + size]
+
+
+def iter_parallel_matches(doc_ids, compiled_pattern, before_lines, after_lines, max_results):
+    """
+    并行扫描候选文档，按文档ID顺序生成 (文档ID, 文档名称, 文集ID, 匹配行列表)
+
+    各分块的结果按提交顺序取回后，再按串行扫描相同的规则截断：
+    匹配行总数达到 max_results 后停止，匹配文档数达到 max_results 后停止。
+    生成器提前关闭时取消尚未开始的分块。
+    进程池异常（工作进程崩溃）时，尚未取回结果的分块改为在当前进程中串行扫描，搜索不会因此失败。
+    """
+    doc_ids = sorted(doc_ids)
+    chunks = list(_chunks(doc_ids))
+    args = (compiled_pattern.pattern, compiled_pattern.flags, before_lines, after_lines, max_results)
+    futures = []
+    broken = False
+    try:
+        executor = _get_executor()
+        futures = [executor.submit(scan_chunk, chunk, *args) for chunk in chunks]
+    except BrokenProcessPool:
+        logger.exception("内容搜索进程池不可用，改为串行扫描")
+        _reset_executor()
+        broken = True
+    total_matches = 0
+    docs_found = 0
+    try:
+        for i, chunk in enumerate(chunks):
+            chunk_results = None
+            if not broken:
+                try:
+                    chunk_results = futures[i].result()
+                except BrokenProcessPool:
+                    logger.exception("内容搜索工作进程异常退出，剩余文档改为串行扫描")
+                    _reset_executor()
+                    broken = True
+            if broken:
+                chunk_results = scan_chunk(chunk, *args)
+            for doc_id, doc_name, top_doc, matches in chunk_results:
+                if docs_found >= max_results or total_matches >= max_results:
+                    return
+                matches = matches[:max_results - total_matches]
+                total_matches += len(matches)
+                docs_found += 1
+                yield doc_id, doc_name, top_doc, matches
+    finally:
+        for future in futures:
+            future.cancel()
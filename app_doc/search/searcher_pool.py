@@ -0,0 +1,170 @@
+# coding:utf-8
+# @文件: searcher_pool.py
+# Whoosh 搜索器（Searcher）复用池
+# 每个进程按索引目录保留已打开的搜索器，索引代数（generation）不变时直接复用，
+# 索引提交产生新代数后通过 Searcher.refresh() 重新打开，只重新读取发生变化的索引段；
+# 同时按代数缓存过滤查询（如文集权限范围）匹配的文档编号集合；
+# 按文集分片时每个分片各有一个池，池的数量超出上限时关闭最久未使用的池
+
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.conf import settings
+
+
+_pools = OrderedDict()
+_pools_lock = threading.Lock()
+
+
+class SearcherPool(object):
+    """
+    单个索引的搜索器池
+
+    搜索器不在线程间共享：每次请求取出一个空闲搜索器，用完后归还；
+    池中只保留当前代数的搜索器，旧代数的搜索器在归还时关闭
+    """
+
+    def __init__(self, max_idle, max_filters=256):
+        self.max_idle = max_idle
+        self.max_filters = max_filters
+        self._lock = threading.Lock()
+        self._idle = []
+        self._generation = None
+        # 过滤查询 → 文档编号集合，文档编号只在同一代数内有效
+        self._filters = OrderedDict()
+        self._filters_generation = None
+        # 复用空闲搜索器的次数
+        self.hits = 0
+        # 新打开搜索器的次数
+        self.misses = 0
+        # 索引代数变化后重新打开搜索器的次数
+        self.reopens = 0
+        # 过滤查询缓存命中 / 未命中次数
+        self.filter_hits = 0
+        self.filter_misses = 0
+
+    def acquire(self, ix, weighting):
+        generation = ix.latest_generation()
+        stale = []
+        with self._lock:
+            if generation == self._generation and self._idle:
+                self.hits += 1
+                return self._idle.pop()
+            if generation != self._generation:
+                stale, self._idle = self._idle, []
+                self._generation = generation
+            if stale:
+                self.reopens += 1
+            else:
+                self.misses += 1
+
+        if stale:
+            # 复用一个旧搜索器中未变化的索引段，其余旧搜索器直接关闭
+            searcher = stale.pop().refresh()
+            for s in stale:
+                s.close()
+        else:
+            kwargs = {'weighting': weighting} if weighting is not None else {}
+            searcher = ix.refresh().searcher(**kwargs)
+        searcher._pool_generation = searcher.reader().generation()
+        return searcher
+
+    def release(self, searcher):
+        with self._lock:
+            if (not searcher.is_closed and len(self._idle) < self.max_idle
+                    and searcher._pool_generation == self._generation):
+                self._idle.append(searcher)
+                return
+        searcher.close()
+
+    def get_filter(self, generation, query):
+        """获取过滤查询在指定代数下匹配的文档编号集合，调用方不得修改返回的集合"""
+        with self._lock:
+            if generation == self._filters_generation and query in self._filters:
+                self._filters.move_to_end(query)
+                self.filter_hits += 1
+                return self._filters[query]
+            self.filter_misses += 1
+            return None
+
+    def set_filter(self, generation, query, docnums):
+        with self._lock:
+            if generation != self._filters_generation:
+                self._filters.clear()
+                self._filters_generation = generation
+            self._filters[query] = docnums
+            while len(self._filters) > self.max_filters:
+                self._filters.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self._generation = None
+            self._filters.clear()
+            self._filters_generation = None
+        for s in idle:
+            s.close()
+
+    def retire(self):
+        """不再保留空闲搜索器：关闭现有的空闲搜索器，之后归还的搜索器直接关闭"""
+        with self._lock:
+            self.max_idle = 0
+        self.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'generation': self._generation,
+                'idle': len(self._idle),
+                'hits': self.hits,
+                'misses': self.misses,
+                'reopens': self.reopens,
+                'filters': len(self._filters),
+                'filter_hits': self.filter_hits,
+                'filter_misses': self.filter_misses,
+            }
+
+
+def get_pool(key):
+    retired = None
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = SearcherPool(
+                getattr(settings, 'SEARCH_SEARCHER_POOL_SIZE', 8),
+                getattr(settings, 'SEARCH_FILTER_CACHE_SIZE', 256),
+            )
+            if len(_pools) > getattr(settings, 'SEARCH_SEARCHER_POOL_MAX_INDEXES', 64):
+                retired = _pools.popitem(last=False)[1]
+        else:
+            _pools.move_to_end(key)
+    if retired is not None:
+        retired.retire()
+    return pool
+
+
+@contextmanager
+def pooled_searcher(key, ix, weighting=None):
+    """从搜索器池中取出搜索器，退出时归还"""
+    pool = get_pool(key)
+    searcher = pool.acquire(ix, weighting)
+    try:
+        yield searcher
+    finally:
+        pool.release(searcher)
+
+
+def clear(key=None):
+    """关闭池中的空闲搜索器，索引被删除重建时调用"""
+    with _pools_lock:
+        pools = [_pools[key]] if key in _pools else ([] if key else list(_pools.values()))
+    for pool in pools:
+        pool.clear()
+
+
+def get_stats():
+    """当前进程内各索引搜索器池的计数"""
+    with _pools_lock:
+        pools = dict(_pools)
+    return {str(key): pool.stats() for key, pool in pools.items()}
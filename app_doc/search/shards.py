@@ -0,0 +1,213 @@
+# coding:utf-8
+# @文件: shards.py
+# 按文集分片的全文索引
+# 开启分片后每个文集的文档写入独立的 Whoosh 索引目录（project_<文集ID>），其他模型写入 common 分片；
+# 限定在单个文集内的搜索只打开该文集的分片，全局搜索将全部分片的索引段合并为一个读取器，
+# 按统一的评分统计跨分片排序；写入只锁定涉及的分片，不同文集的写入互不等待
+
+import os
+import re
+import shutil
+import threading
+import uuid
+from bisect import bisect_right
+
+from django.conf import settings
+from whoosh.filedb.filestore import FileStorage
+from whoosh.reading import MultiReader
+from whoosh.searching import Searcher
+from whoosh.writing import AsyncWriter
+
+
+COMMON_SHARD = 'common'
+PROJECT_SHARD_PREFIX = 'project_'
+# 分片目录中记录全部分片最新提交的文件，内容在任一分片提交后更新
+GENERATION_FILE = 'GENERATION'
+
+_SHARD_NAME_RE = re.compile(r'^(common|project_\d+)$')
+# narrow_to_projects 生成的单个文集过滤查询
+_SINGLE_PROJECT_NARROW_RE = re.compile(r'^top_doc:\((\d+)\)$')
+
+
+def is_enabled():
+    return getattr(settings, 'SEARCH_SHARDS', False)
+
+
+def get_root(index_path):
+    """分片目录：与 whoosh_index 目录同级，与未分片的索引互不影响"""
+    return os.path.normpath(index_path) + '_shards'
+
+
+def project_shard(project_id):
+    return '{}{}'.format(PROJECT_SHARD_PREFIX, int(project_id))
+
+
+def shard_for_document(doc):
+    """文档所属的分片：带有文集ID（top_doc）的文档写入文集分片，其余写入 common 分片"""
+    top_doc = doc.get('top_doc')
+    if top_doc in (None, ''):
+        return COMMON_SHARD
+    try:
+        return project_shard(top_doc)
+    except (TypeError, ValueError):
+        return COMMON_SHARD
+
+
+def shard_for_narrow_queries(narrow_queries):
+    """
+    由过滤查询判断搜索是否限定在单个文集内
+
+    Returns:
+        文集分片名称；不限于单个文集时返回 None
+    """
+    for narrow_query in narrow_queries or ():
+        match = _SINGLE_PROJECT_NARROW_RE.match(str(narrow_query).strip())
+        if match:
+            return project_shard(match.group(1))
+    return None
+
+
+class ShardReader(MultiReader):
+    """由多个分片的全部索引段组成的读取器，记录每个索引段所属的分片"""
+
+    def __init__(self, readers, schema, generation, leaf_shards):
+        MultiReader.__init__(self, readers, generation=generation)
+        self.schema = schema
+        self.leaf_shards = leaf_shards
+
+    def shard_leaves(self, name):
+        return [r for r, shard in zip(self.readers, self.leaf_shards) if shard == name]
+
+    def shard_of(self, docnum):
+        """全局文档编号所在的分片"""
+        return self.leaf_shards[bisect_right(self.doc_offsets, docnum) - 1]
+
+
+class ShardWriter(AsyncWriter):
+    """分片写入器：提交完成后（包括等待写锁后在线程中提交）调用 on_commit"""
+
+    def __init__(self, index, on_commit, **kwargs):
+        AsyncWriter.__init__(self, index, **kwargs)
+        self.on_commit = on_commit
+
+    def run(self):
+        AsyncWriter.run(self)
+        self.on_commit()
+
+    def commit(self, *args, **kwargs):
+        AsyncWriter.commit(self, *args, **kwargs)
+        if self.writer:
+            self.on_commit()
+
+
+class ShardedIndex(object):
+    """
+    全部分片的集合
+
+    提供搜索器池需要的 latest_generation / refresh / searcher / reader 接口，
+    搜索器基于 ShardReader，Searcher.refresh() 时只重新打开发生变化的索引段
+    """
+
+    def __init__(self, root, schema):
+        self.root = root
+        self.schema = schema
+        self._indexes = {}
+        self._lock = threading.Lock()
+        if not os.path.exists(root):
+            os.makedirs(root, exist_ok=True)
+
+    def shard_path(self, name):
+        return os.path.join(self.root, name)
+
+    def shard_names(self):
+        """已存在的分片名称"""
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(
+            name for name in os.listdir(self.root)
+            if _SHARD_NAME_RE.match(name) and os.path.isdir(self.shard_path(name))
+        )
+
+    def shard_index(self, name, create=False):
+        """打开分片索引，分片不存在且 create 为 False 时返回 None"""
+        with self._lock:
+            ix = self._indexes.get(name)
+            if ix is not None:
+                return ix
+            path = self.shard_path(name)
+            storage = None
+            if os.path.isdir(path):
+                storage = FileStorage(path)
+                if storage.index_exists():
+                    ix = storage.open_index(schema=self.schema)
+            if ix is None:
+                if not create:
+                    return None
+                os.makedirs(path, exist_ok=True)
+                ix = (storage or FileStorage(path)).create_index(self.schema)
+            self._indexes[name] = ix
+            return ix
+
+    def latest_generation(self):
+        """全部分片的提交标识，任一分片提交后变化"""
+        try:
+            with open(os.path.join(self.root, GENERATION_FILE)) as f:
+                return f.read().strip() or '0'
+        except FileNotFoundError:
+            return '0'
+
+    def bump_generation(self):
+        path = os.path.join(self.root, GENERATION_FILE)
+        tmp_path = '{}.{}'.format(path, uuid.uuid4().hex)
+        with open(tmp_path, 'w') as f:
+            f.write(uuid.uuid4().hex)
+        os.replace(tmp_path, path)
+
+    def refresh(self):
+        return self
+
+    def reader(self, reuse=None):
+        # 先读取提交标识再打开分片，期间有新的提交时下次取搜索器会再次刷新
+        generation = self.latest_generation()
+        readers = []
+        leaf_shards = []
+        reused = set()
+        for name in self.shard_names():
+            ix = self.shard_index(name)
+            if ix is None:
+                continue
+            old = reuse.shard_leaves(name) if isinstance(reuse, ShardReader) else []
+            # 只把本分片的旧索引段交给 whoosh 复用，未复用的旧段由 whoosh 关闭
+            reader = ix.reader(reuse=MultiReader(old) if old else None)
+            reused.add(name)
+            for leaf, _offset in reader.leaf_readers():
+                readers.append(leaf)
+                leaf_shards.append(name)
+        if isinstance(reuse, ShardReader):
+            # 已删除的分片
+            for leaf, name in zip(reuse.readers, reuse.leaf_shards):
+                if name not in reused:
+                    leaf.close()
+        return ShardReader(readers, self.schema, generation, leaf_shards)
+
+    def searcher(self, **kwargs):
+        return Searcher(self.reader(), fromindex=self, **kwargs)
+
+    def writer(self, name, **kwargs):
+        """分片写入器，提交后更新全部分片的提交标识"""
+        return ShardWriter(self.shard_index(name, create=True), self.bump_generation, **kwargs)
+
+    def optimize(self):
+        for name in self.shard_names():
+            ix = self.shard_index(name)
+            if ix is not None:
+                ix.optimize()
+        self.bump_generation()
+
+    def destroy(self):
+        """删除全部分片"""
+        with self._lock:
+            self._indexes.clear()
+        if os.path.exists(self.root):
+            shutil.rmtree(self.root)
+        os.makedirs(self.root, exist_ok=True)
@@ -0,0 +1,895 @@
+# coding:utf-8
+# @文件: sql_fts_backend.py
+# 基于数据库全文索引的 Haystack 搜索后端
+# 文档经与 Whoosh 后端相同的 jieba 分析器分词后，以空格分隔的词序列写入 search_document 表，
+# SQLite 由 FTS5 虚拟表、PostgreSQL 由 tsvector 列建立倒排索引，索引随数据库共享，多个应用节点可同时读写；
+# 搜索语句沿用 Whoosh 的查询语法，由同一个 QueryParser 解析为查询树后编译为 SQL，
+# AND/OR 模式、字段限定（title/content）、过滤查询（top_doc/modify_time 等）与 Whoosh 后端一致
+
+import json
+import re
+import time
+import warnings
+from collections import Counter
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DatabaseError, OperationalError, connections as db_connections, transaction
+from django.db.models import F
+from django.utils.encoding import force_str
+
+from haystack.backends import BaseEngine, BaseSearchBackend, log_query
+from haystack.constants import DJANGO_CT, DJANGO_ID, ID
+from haystack.models import SearchResult
+from haystack.utils import get_identifier, get_model_ct
+from haystack.utils import log as logging
+from whoosh import query as whoosh_query
+from whoosh.fields import DATETIME, NUMERIC
+from whoosh.util.times import long_to_datetime
+
+from app_doc.models_search import SearchDocument, SearchIndexState
+from app_doc.search import synonyms, token_cache
+from app_doc.search.whoosh_cn_backend import (
+    WhooshSearchBackend,
+    WhooshSearchQuery,
+    search_time_budget,
+)
+
+
+# 建立全文索引的字段及其分词列
+TEXT_COLUMNS = {
+    'title': 'title_tokens',
+    'content': 'content_tokens',
+    'text': 'text_tokens',
+}
+# 可用于过滤和排序的字段及其列
+FILTER_COLUMNS = {
+    ID: 'identifier',
+    DJANGO_CT: 'django_ct',
+    DJANGO_ID: 'django_id',
+    'top_doc': 'top_doc',
+    'modify_time': 'modify_time',
+    'create_user': 'create_user',
+}
+DOCUMENT_TABLE = SearchDocument._meta.db_table
+# SearchIndexState 中记录索引代数的名称
+STATE_NAME = 'sql_fts'
+# 每批写入的文档数量
+WRITE_BATCH_SIZE = 200
+# 相似文档搜索使用的词数量
+MORE_LIKE_THIS_TERMS = 10
+
+# 只由标点符号组成的词不建立索引（数据库分词器会将其丢弃）
+_WORD_RE = re.compile(r'\w')
+
+
+class Clause(object):
+    """
+    编译后的查询条件：全文条件 text、不能匹配的全文条件 negs 与 SQL 条件 conds 的合取
+
+    none 为 True 时不匹配任何文档；三者皆空时匹配全部文档。
+    eq 记录只包含单个等值条件时的 (列, 值)，多个同列等值条件的 OR 合并为 IN
+    """
+
+    def __init__(self, text=None, negs=(), conds=(), none=False, eq=None):
+        self.text = text
+        self.negs = list(negs)
+        self.conds = list(conds)
+        self.none = none
+        self.eq = eq
+
+    @property
+    def is_all(self):
+        return not self.none and self.text is None and not self.negs and not self.conds
+
+    @property
+    def is_text(self):
+        """只包含肯定的全文条件"""
+        return not self.none and self.text is not None and not self.negs and not self.conds
+
+
+NONE = Clause(none=True)
+
+
+class SqliteDialect(object):
+    """
+    SQLite FTS5：search_document_fts 为以 search_document 表为外部内容表的 FTS5 虚拟表，由触发器同步；
+    虚拟表和触发器由迁移建立
+    """
+
+    vendor = 'sqlite'
+    fts_table = 'search_document_fts'
+
+    def has_schema(self, cursor):
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name = %s", [self.fts_table]
+        )
+        return cursor.fetchone() is not None
+
+    @staticmethod
+    def _quote(text):
+        return '"%s"' % text.replace('"', '""')
+
+    def term(self, field, text, prefix=False):
+        return '%s : %s%s' % (TEXT_COLUMNS[field], self._quote(text), '*' if prefix else '')
+
+    def phrase(self, field, words, slop):
+        # 查询与索引中的词序列都包含 jieba 搜索模式切分出的重叠词，位置与原文不完全对应，使用 NEAR 近似短语
+        return '%s : NEAR(%s, %d)' % (
+            TEXT_COLUMNS[field], ' '.join(self._quote(w) for w in words), max(slop, 1) + len(words)
+        )
+
+    def and_(self, texts):
+        return texts[0] if len(texts) == 1 else ' AND '.join('(%s)' % t for t in texts)
+
+    def or_(self, texts):
+        return texts[0] if len(texts) == 1 else ' OR '.join('(%s)' % t for t in texts)
+
+    def combine(self, text, negs):
+        """肯定条件与否定条件合并为一个全文条件；FTS5 的 NOT 只能作为二元运算符，没有肯定条件时返回 None"""
+        if not negs:
+            return text
+        if text is None:
+            return None
+        return '(%s) NOT (%s)' % (text, self.or_(negs))
+
+    def match_sql(self, text):
+        return 'd.id IN (SELECT rowid FROM {fts} WHERE {fts} MATCH %s)'.format(fts=self.fts_table), [text]
+
+    def select(self, text, rank_text, where, params, order_by, limit, offset):
+        """
+        组装分页查询：有全文条件时由 FTS5 驱动并按 bm25 排序（bm25 越小越相关），
+        只有否定或与 SQL 条件混合的全文条件时，另用其中的肯定词计算相关度
+        """
+        columns = 'd.identifier, d.django_ct, d.django_id, d.stored_fields'
+        # bm25() 不能与窗口函数用在同一层查询中，先在子查询中计算相关度；
+        # CROSS JOIN 固定由全文索引驱动连接，否则查询优化器可能先按 django_ct 等列的索引逐行匹配全文条件
+        if text is not None:
+            sql = (
+                'SELECT {columns}, r.score, COUNT(*) OVER () FROM ('
+                'SELECT rowid, -bm25({fts}) AS score FROM {fts} WHERE {fts} MATCH %s'
+                ') r CROSS JOIN {table} d ON d.id = r.rowid WHERE 1 = 1'
+            )
+            params = [text] + params
+        elif rank_text is not None:
+            sql = (
+                'SELECT {columns}, COALESCE(r.score, 0) AS score, COUNT(*) OVER () FROM {table} d LEFT JOIN ('
+                'SELECT rowid, -bm25({fts}) AS score FROM {fts} WHERE {fts} MATCH %s'
+                ') r ON r.rowid = d.id WHERE 1 = 1'
+            )
+            params = [rank_text] + params
+        else:
+            sql = 'SELECT {columns}, 0 AS score, COUNT(*) OVER () FROM {table} d WHERE 1 = 1'
+        sql = sql.format(columns=columns, fts=self.fts_table, table=DOCUMENT_TABLE)
+        if where:
+            sql += ' AND ' + where
+        sql += ' ORDER BY %s LIMIT %%s OFFSET %%s' % order_by
+        return sql, params + [limit, offset]
+
+    def count(self, text, where, params):
+        if text is not None:
+            sql = (
+                'SELECT COUNT(*) FROM {fts} CROSS JOIN {table} d ON d.id = {fts}.rowid '
+                'WHERE {fts} MATCH %s'.format(fts=self.fts_table, table=DOCUMENT_TABLE)
+            )
+            params = [text] + params
+        else:
+            sql = 'SELECT COUNT(*) FROM {table} d WHERE 1 = 1'.format(table=DOCUMENT_TABLE)
+        if where:
+            sql += ' AND ' + where
+        return sql, params
+
+    def run_with_budget(self, connection, budget, func):
+        """通过 SQLite 的进度回调在超出时间预算时中断查询"""
+        connection.ensure_connection()
+        raw = connection.connection
+        deadline = time.monotonic() + budget
+        raw.set_progress_handler(lambda: int(time.monotonic() > deadline), 10000)
+        try:
+            return func()
+        finally:
+            raw.set_progress_handler(None, 0)
+
+    def is_timeout(self, error):
+        return 'interrupted' in str(error)
+
+    def optimize(self, cursor):
+        cursor.execute("INSERT INTO {fts}({fts}) VALUES ('optimize')".format(fts=self.fts_table))
+
+
+class PostgresDialect(object):
+    """
+    PostgreSQL：search_document.search_vector 为由分词列生成的 tsvector 列（GIN 索引，由迁移建立），
+    标题、内容、全文的词分别标记权重 A、B、C，字段限定的查询只匹配对应权重的词
+    """
+
+    vendor = 'postgresql'
+    weights = {'title': 'A', 'content': 'B', 'text': 'C'}
+
+    def has_schema(self, cursor):
+        cursor.execute(
+            "SELECT 1 FROM information_schema.columns WHERE table_name = %s AND column_name = 'search_vector'",
+            [DOCUMENT_TABLE],
+        )
+        return cursor.fetchone() is not None
+
+    @staticmethod
+    def _quote(text):
+        return "'%s'" % text.replace('\\', '\\\\').replace("'", "''")
+
+    def term(self, field, text, prefix=False):
+        return '%s:%s%s' % (self._quote(text), '*' if prefix else '', self.weights[field])
+
+    def phrase(self, field, words, slop):
+        # 词序列中包含重叠切分的词，位置距离不固定，短语按全部词同时出现匹配
+        return self.and_([self.term(field, w) for w in words])
+
+    def and_(self, texts):
+        return texts[0] if len(texts) == 1 else ' & '.join('(%s)' % t for t in texts)
+
+    def or_(self, texts):
+        return texts[0] if len(texts) == 1 else ' | '.join('(%s)' % t for t in texts)
+
+    def combine(self, text, negs):
+        parts = ([text] if text is not None else []) + ['!(%s)' % n for n in negs]
+        return self.and_(parts) if parts else None
+
+    def match_sql(self, text):
+        return "d.search_vector @@ to_tsquery('simple', %s)", [text]
+
+    def select(self, text, rank_text, where, params, order_by, limit, offset):
+        """组装分页查询：按查询中肯定词的 ts_rank 排序"""
+        columns = 'd.identifier, d.django_ct, d.django_id, d.stored_fields'
+        query_params = []
+        if rank_text is not None:
+            score = "ts_rank(d.search_vector, to_tsquery('simple', %s))"
+            query_params.append(rank_text)
+        else:
+            score = '0'
+        sql, count_params = self.count(text, where, params)
+        sql = sql.replace('SELECT COUNT(*)', 'SELECT {columns}, {score} AS score, COUNT(*) OVER ()'.format(
+            columns=columns, score=score), 1)
+        sql += ' ORDER BY %s LIMIT %%s OFFSET %%s' % order_by
+        return sql, query_params + count_params + [limit, offset]
+
+    def count(self, text, where, params):
+        sql = 'SELECT COUNT(*) FROM {table} d WHERE 1 = 1'.format(table=DOCUMENT_TABLE)
+        query_params = []
+        if text is not None:
+            match, match_params = self.match_sql(text)
+            sql += ' AND ' + match
+            query_params += match_params
+        if where:
+            sql += ' AND ' + where
+        return sql, query_params + list(params)
+
+    def run_with_budget(self, connection, budget, func):
+        """在事务内设置 statement_timeout，超出时间预算的查询由数据库取消"""
+        with transaction.atomic(using=connection.alias):
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL statement_timeout = %s', [max(1, int(budget * 1000))])
+            return func()
+
+    def is_timeout(self, error):
+        # 57014: query_canceled
+        return getattr(error.__cause__, 'pgcode', None) == '57014'
+
+    def optimize(self, cursor):
+        cursor.execute('ANALYZE {table}'.format(table=DOCUMENT_TABLE))
+
+
+DIALECTS = {
+    'sqlite': SqliteDialect,
+    'postgresql': PostgresDialect,
+}
+
+
+class QueryCompiler(object):
+    """
+    将 Whoosh 查询树编译为 Clause
+
+    全文字段（title/content/text）上的词、短语、前缀编译为数据库的全文查询表达式，
+    其他字段（top_doc/modify_time/django_ct 等）编译为 SQL 条件；
+    不在否定之下的词另外记录在 rank_terms 中，用于计算相关度
+    """
+
+    def __init__(self, dialect, schema):
+        self.dialect = dialect
+        self.schema = schema
+        self.rank_terms = []
+
+    def compile(self, q, negated=False):
+        if isinstance(q, whoosh_query.Every):
+            return Clause()
+        if isinstance(q, type(whoosh_query.NullQuery)):
+            return NONE
+        if isinstance(q, whoosh_query.WrappingQuery):
+            return self.compile(q.child, negated)
+        if isinstance(q, whoosh_query.Not):
+            return self._not(self.compile(q.query, not negated))
+        if isinstance(q, whoosh_query.AndNot):
+            return self._and([self.compile(q.a, negated), self._not(self.compile(q.b, not negated))])
+        if isinstance(q, whoosh_query.AndMaybe):
+            return self.compile(q.a, negated)
+        if isinstance(q, whoosh_query.Require):
+            return self._and([self.compile(q.a, negated), self.compile(q.b, negated)])
+        if isinstance(q, (whoosh_query.Or, whoosh_query.DisjunctionMax)):
+            return self._or([self.compile(child, negated) for child in q.subqueries])
+        if isinstance(q, whoosh_query.And):
+            return self._and([self.compile(child, negated) for child in q.subqueries])
+        if isinstance(q, whoosh_query.Phrase):
+            return self._phrase(q, negated)
+        if isinstance(q, whoosh_query.NumericRange):
+            return self._range(q.fieldname, q.start, q.end, q.startexcl, q.endexcl)
+        if isinstance(q, whoosh_query.TermRange):
+            return self._range(q.fieldname, q.start, q.end, q.startexcl, q.endexcl)
+        if isinstance(q, whoosh_query.Wildcard):
+            return self._wildcard(q, negated)
+        if isinstance(q, whoosh_query.Prefix):
+            return self._term(q.fieldname, q.text, negated, prefix=True)
+        if isinstance(q, whoosh_query.Term):
+            # 包括 FuzzyTerm、Variations：数据库全文索引不支持模糊匹配和词形变化，按原词匹配
+            return self._term(q.fieldname, q.text, negated)
+        logging.getLogger('haystack').warning('数据库全文搜索不支持的查询类型：%r', q)
+        return NONE
+
+    def _and(self, clauses):
+        if any(c.none for c in clauses):
+            return NONE
+        texts = [c.text for c in clauses if c.text is not None]
+        return Clause(
+            text=self.dialect.and_(texts) if texts else None,
+            negs=[n for c in clauses for n in c.negs],
+            conds=[cond for c in clauses for cond in c.conds],
+        )
+
+    def _or(self, clauses):
+        clauses = [c for c in clauses if not c.none]
+        if not clauses:
+            return NONE
+        if any(c.is_all for c in clauses):
+            return Clause()
+        if all(c.is_text for c in clauses):
+            return Clause(text=self.dialect.or_([c.text for c in clauses]))
+        columns = {c.eq[0] if c.eq else None for c in clauses}
+        if len(columns) == 1 and None not in columns:
+            column = columns.pop()
+            values = [c.eq[1] for c in clauses]
+            return Clause(conds=[(
+                'd.%s IN (%s)' % (column, ', '.join(['%s'] * len(values))), values
+            )])
+        parts = [self.to_sql(c) for c in clauses]
+        return Clause(conds=[(
+            '(%s)' % ' OR '.join('(%s)' % sql for sql, _ in parts),
+            [p for _, params in parts for p in params],
+        )])
+
+    def _not(self, clause):
+        if clause.none:
+            return Clause()
+        if clause.is_all:
+            return NONE
+        if clause.is_text:
+            return Clause(negs=[clause.text])
+        sql, params = self.to_sql(clause)
+        return Clause(conds=[('NOT (%s)' % sql, params)])
+
+    def to_sql(self, clause):
+        """将 Clause 转换为 SQL 条件，全文条件转换为对全文索引的子查询"""
+        if clause.none:
+            return '1 = 0', []
+        parts = []
+        params = []
+        text = self.dialect.combine(clause.text, clause.negs)
+        if text is not None:
+            sql, text_params = self.dialect.match_sql(text)
+            parts.append(sql)
+            params += text_params
+        else:
+            if clause.text is not None:
+                sql, text_params = self.dialect.match_sql(clause.text)
+                parts.append(sql)
+                params += text_params
+            for neg in clause.negs:
+                sql, text_params = self.dialect.match_sql(neg)
+                parts.append('NOT (%s)' % sql)
+                params += text_params
+        for sql, cond_params in clause.conds:
+            parts.append(sql)
+            params += cond_params
+        return ' AND '.join(parts) or '1 = 1', params
+
+    def _text(self, expression, negated):
+        if not negated:
+            self.rank_terms.append(expression)
+        return Clause(text=expression)
+
+    def _term(self, fieldname, text, negated, prefix=False):
+        if fieldname in TEXT_COLUMNS:
+            text = force_str(text)
+            if not _WORD_RE.search(text):
+                return NONE
+            return self._text(self.dialect.term(fieldname, text, prefix), negated)
+        column = FILTER_COLUMNS.get(fieldname)
+        if column is None:
+            return NONE
+        if prefix:
+            return Clause(conds=[("d.%s LIKE %%s ESCAPE '\\'" % column, [_like_escape(force_str(text)) + '%'])])
+        try:
+            value = self._field_value(fieldname, text)
+        except (TypeError, ValueError):
+            return NONE
+        return Clause(conds=[('d.%s = %%s' % column, [value])], eq=(column, value))
+
+    def _phrase(self, q, negated):
+        if q.fieldname not in TEXT_COLUMNS:
+            return NONE
+        words = [force_str(w) for w in q.words if _WORD_RE.search(force_str(w))]
+        if not words:
+            return NONE
+        if len(words) == 1:
+            return self._text(self.dialect.term(q.fieldname, words[0]), negated)
+        return self._text(self.dialect.phrase(q.fieldname, words, q.slop), negated)
+
+    def _wildcard(self, q, negated):
+        pattern = force_str(q.text)
+        if q.fieldname in TEXT_COLUMNS:
+            # 全文索引只支持前缀匹配：通配符之间的文本分词后，每个词按前缀匹配且必须同时出现
+            analyzer = self.schema[q.fieldname].analyzer
+            words = [
+                token.text
+                for piece in re.split(r'[*?]+', pattern) if piece
+                for token in analyzer(piece, mode='query')
+                if _WORD_RE.search(token.text)
+            ]
+            if not words:
+                return Clause() if pattern.strip('*?') == '' else NONE
+            return self._and([self._text(self.dialect.term(q.fieldname, w, prefix=True), negated) for w in words])
+        column = FILTER_COLUMNS.get(q.fieldname)
+        if column is None:
+            return NONE
+        like = _like_escape(pattern).replace('*', '%').replace('?', '_')
+        return Clause(conds=[("d.%s LIKE %%s ESCAPE '\\'" % column, [like])])
+
+    def _range(self, fieldname, start, end, startexcl, endexcl):
+        column = FILTER_COLUMNS.get(fieldname)
+        if column is None:
+            return NONE
+        conds = []
+        if start is not None:
+            conds.append(('d.%s %s %%s' % (column, '>' if startexcl else '>='), [self._field_value(fieldname, start)]))
+        if end is not None:
+            conds.append(('d.%s %s %%s' % (column, '<' if endexcl else '<='), [self._field_value(fieldname, end)]))
+        return Clause(conds=conds)
+
+    def _field_value(self, fieldname, value):
+        """将查询树中的值（数值字段为编码后的字节串，日期字段为整数）转换为数据库中的值"""
+        field = self.schema[fieldname] if fieldname in self.schema else None
+        if isinstance(field, NUMERIC):
+            if isinstance(value, bytes):
+                value = field.from_bytes(value)
+            elif isinstance(value, str):
+                value = field.from_bytes(field.to_bytes(value))
+            if isinstance(field, DATETIME):
+                return long_to_datetime(value)
+            return value
+        return force_str(value)
+
+
+def _like_escape(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+class SqlSearchBackend(WhooshSearchBackend):
+    """
+    数据库全文搜索后端
+
+    继承 Whoosh 后端的 schema、查询解析器和字段值转换，索引的读写改为对 search_document 表的 SQL 操作；
+    连接配置中的 DATABASE 指定使用的数据库（默认为 default）
+    """
+
+    def __init__(self, connection_alias, **connection_options):
+        BaseSearchBackend.__init__(self, connection_alias, **connection_options)
+        self.setup_complete = False
+        # 不使用 Whoosh 索引目录，并行重建等只适用于 Whoosh 索引文件的功能不可用
+        self.use_file_storage = False
+        self.sharded = False
+        self.path = connection_options.get('PATH')
+        self.database = connection_options.get('DATABASE', 'default')
+        self.log = logging.getLogger('haystack')
+
+    def setup(self):
+        connection = db_connections[self.database]
+        dialect_class = DIALECTS.get(connection.vendor)
+        if dialect_class is None:
+            raise ImproperlyConfigured(
+                '数据库全文搜索只支持 SQLite 和 PostgreSQL，当前数据库为 {}'.format(connection.vendor)
+            )
+        self._setup_schema()
+        unsupported = [
+            name for name, field in self.schema.items()
+            if name not in TEXT_COLUMNS and name not in FILTER_COLUMNS and field.indexed and field.scorable
+        ]
+        if unsupported:
+            raise ImproperlyConfigured('数据库全文搜索不支持的全文字段：{}'.format(', '.join(unsupported)))
+
+        self.dialect = dialect_class()
+        # 全文索引由迁移 0052_searchdocument_fts 建立，这里只检查是否存在
+        try:
+            with connection.cursor() as cursor:
+                has_schema = self.dialect.has_schema(cursor)
+        except DatabaseError as e:
+            raise ImproperlyConfigured('检查数据库全文索引失败：{}'.format(e))
+        if not has_schema:
+            raise ImproperlyConfigured(
+                '数据库全文索引不存在，请先执行 python manage.py migrate（SQLite 需要支持 FTS5）'
+            )
+        self.setup_complete = True
+
+    def index_generation(self):
+        """当前索引代数，每次写入索引后递增，用于使搜索结果缓存失效"""
+        return SearchIndexState.objects.using(self.database).filter(
+            name=STATE_NAME
+        ).values_list('generation', flat=True).first() or 0
+
+    def _bump_generation(self):
+        updated = SearchIndexState.objects.using(self.database).filter(
+            name=STATE_NAME
+        ).update(generation=F('generation') + 1)
+        if not updated:
+            SearchIndexState.objects.using(self.database).get_or_create(
+                name=STATE_NAME, defaults={'generation': 1}
+            )
+
+    def stored_documents(self, identifiers):
+        """
+        按索引文档ID批量读取索引中存储的字段，不访问被索引的模型
+
+        Returns:
+            {文档ID: 存储字段字典}，索引中不存在的文档不包含在内
+        """
+        documents = {}
+        rows = SearchDocument.objects.using(self.database).filter(
+            identifier__in=list(identifiers)
+        ).values_list('identifier', 'stored_fields')
+        for identifier, stored_fields in rows:
+            documents[identifier] = json.loads(stored_fields)
+        return documents
+
+    def _tokens(self, fieldname, value):
+        """使用字段的分析器分词，返回以空格分隔的词序列"""
+        if not value:
+            return ''
+        analyzer = self.schema[fieldname].analyzer
+        return ' '.join(
+            token.text for token in analyzer(force_str(value), mode='index') if _WORD_RE.search(token.text)
+        )
+
+    def _build_row(self, doc):
+        stored = {}
+        for key, value in doc.items():
+            stored[key] = value.isoformat() if hasattr(value, 'isoformat') else value
+        row = SearchDocument(
+            identifier=doc[ID],
+            django_ct=doc[DJANGO_CT],
+            django_id=force_str(doc[DJANGO_ID]),
+            stored_fields=json.dumps(stored, ensure_ascii=False),
+        )
+        for fieldname in ('top_doc', 'modify_time', 'create_user'):
+            setattr(row, fieldname, doc.get(fieldname))
+        for fieldname, column in TEXT_COLUMNS.items():
+            setattr(row, column, self._tokens(fieldname, doc.get(fieldname)))
+        return row
+
+    def update(self, index, iterable, commit=True):
+        self.apply_changes(index, iterable, ())
+
+    def apply_changes(self, index, iterable, remove_identifiers):
+        """
+        在同一个事务中更新和删除文档：先删除旧行再批量插入，索引代数只递增一次
+
+        :param iterable: 需要新增或更新的对象
+        :param remove_identifiers: 需要删除的文档标识，如 app_doc.doc.1
+        """
+        if not self.setup_complete:
+            self.setup()
+
+        if not iterable and not remove_identifiers:
+            return
+
+        rows = []
+        for obj, doc in self._prepare_documents(index, iterable or ()):
+            try:
+                rows.append(self._build_row(doc))
+            except Exception as e:
+                if not self.silently_fail:
+                    raise
+                self.log.error(
+                    "%s while preparing object for update" % e.__class__.__name__,
+                    exc_info=True,
+                    extra={"data": {"index": index, "object": get_identifier(obj)}},
+                )
+        # 写入本批文档新产生的分词缓存
+        token_cache.flush()
+
+        identifiers = [row.identifier for row in rows] + list(remove_identifiers)
+        documents = SearchDocument.objects.using(self.database)
+        try:
+            with transaction.atomic(using=self.database):
+                for i in range(0, len(identifiers), WRITE_BATCH_SIZE):
+                    documents.filter(identifier__in=identifiers[i:i + WRITE_BATCH_SIZE]).delete()
+                documents.bulk_create(rows, batch_size=WRITE_BATCH_SIZE)
+                self._bump_generation()
+        except DatabaseError as e:
+            if not self.silently_fail:
+                raise
+            self.log.error("Failed to update database search index: %s", e, exc_info=True)
+
+    def remove(self, obj_or_string, commit=True):
+        self.apply_changes(None, (), [get_identifier(obj_or_string)])
+
+    def clear(self, models=None, commit=True):
+        if not self.setup_complete:
+            self.setup()
+
+        if models is not None:
+            assert isinstance(models, (list, tuple))
+
+        documents = SearchDocument.objects.using(self.database)
+        if models is not None:
+            documents = documents.filter(django_ct__in=[get_model_ct(model) for model in models])
+        try:
+            with transaction.atomic(using=self.database):
+                documents.delete()
+                self._bump_generation()
+        except DatabaseError as e:
+            if not self.silently_fail:
+                raise
+            self.log.error("Failed to clear database search index: %s", e, exc_info=True)
+
+    def delete_index(self):
+        self.clear()
+
+    def optimize(self):
+        if not self.setup_complete:
+            self.setup()
+
+        with db_connections[self.database].cursor() as cursor:
+            self.dialect.optimize(cursor)
+
+    def create_spelling_suggestion(self, query_string):
+        return None
+
+    def _model_choices(self, models, limit_to_registered_models):
+        if limit_to_registered_models is None:
+            limit_to_registered_models = getattr(
+                settings, "HAYSTACK_LIMIT_TO_REGISTERED_MODELS", True
+            )
+
+        if models and len(models):
+            return sorted(get_model_ct(model) for model in models)
+        elif limit_to_registered_models:
+            # Using narrow queries, limit the results to only models handled
+            # with the current routers.
+            return self.build_models_list()
+        return []
+
+    def _order_by(self, sort_by):
+        """排序字段转换为 SQL；默认按相关度，相关度相同时按写入顺序"""
+        if not sort_by:
+            return 'score DESC, d.id'
+        order = []
+        for order_by in sort_by:
+            descending = order_by.startswith('-')
+            fieldname = order_by.lstrip('-')
+            column = FILTER_COLUMNS.get(fieldname)
+            if column is None:
+                warnings.warn(
+                    "数据库全文搜索不支持按 '%s' 排序" % fieldname, Warning, stacklevel=2
+                )
+                continue
+            order.append('d.%s%s' % (column, ' DESC' if descending else ''))
+        return ', '.join(order + ['d.id'])
+
+    @log_query
+    def search(
+        self,
+        query_string,
+        sort_by=None,
+        start_offset=0,
+        end_offset=None,
+        fields="",
+        highlight=False,
+        facets=None,
+        date_facets=None,
+        query_facets=None,
+        narrow_queries=None,
+        spelling_query=None,
+        within=None,
+        dwithin=None,
+        distance_point=None,
+        models=None,
+        limit_to_registered_models=None,
+        result_class=None,
+        **kwargs
+    ):
+        if not self.setup_complete:
+            self.setup()
+
+        # A zero length query should return no results.
+        if len(query_string) == 0:
+            return {"results": [], "hits": 0}
+
+        query_string = force_str(query_string)
+
+        # A one-character query (non-wildcard) gets nabbed by a stopwords
+        # filter and should yield zero results.
+        if len(query_string) <= 1 and query_string != "*":
+            return {"results": [], "hits": 0}
+
+        if facets is not None or date_facets is not None or query_facets is not None:
+            warnings.warn("数据库全文搜索不支持分面统计", Warning, stacklevel=2)
+
+        parsed_query = self.parser.parse(query_string)
+
+        # In the event of an invalid/stopworded query, recover gracefully.
+        if parsed_query is None:
+            return {"results": [], "hits": 0}
+
+        # 在解析后的查询树上扩展同义词
+        if synonyms.is_enabled():
+            parsed_query = synonyms.expand_query_tree(parsed_query)
+
+        narrow_queries = set(narrow_queries or ())
+        model_choices = self._model_choices(models, limit_to_registered_models)
+        if len(model_choices) > 0:
+            narrow_queries.add(
+                " OR ".join(["%s:%s" % (DJANGO_CT, rm) for rm in model_choices])
+            )
+        narrow_trees = [self.parser.parse(force_str(nq)) for nq in narrow_queries]
+
+        return self._execute(
+            parsed_query, narrow_trees, sort_by, start_offset, end_offset,
+            highlight=highlight, query_string=query_string, result_class=result_class,
+        )
+
+    def _execute(self, parsed_query, narrow_trees, sort_by, start_offset, end_offset,
+                 highlight=False, query_string="", result_class=None):
+        """编译查询树和过滤查询并执行，返回与 Whoosh 后端相同结构的结果"""
+        compiler = QueryCompiler(self.dialect, self.schema)
+        clause = compiler.compile(parsed_query)
+        # 过滤查询中的词不参与相关度计算
+        rank_terms = list(compiler.rank_terms)
+        clause = compiler._and([clause] + [compiler.compile(tree) for tree in narrow_trees])
+        if clause.none:
+            return {"results": [], "hits": 0, "spelling_suggestion": None}
+
+        text = self.dialect.combine(clause.text, clause.negs)
+        if text is None:
+            # 只有否定条件时改为 SQL 条件
+            where, params = compiler.to_sql(Clause(text=clause.text, negs=clause.negs))
+            where_parts = [where] if clause.text is not None or clause.negs else []
+        else:
+            where_parts, params = [], []
+        for sql, cond_params in clause.conds:
+            where_parts.append(sql)
+            params += cond_params
+        where = ' AND '.join(where_parts)
+        rank_text = self.dialect.or_(rank_terms) if rank_terms else None
+
+        start_offset = start_offset or 0
+        limit = 1000000 if end_offset is None else max(end_offset - start_offset, 1)
+        order_by = self._order_by(sort_by)
+        connection = db_connections[self.database]
+
+        def run():
+            with connection.cursor() as cursor:
+                sql, sql_params = self.dialect.select(text, rank_text, where, params, order_by, limit, start_offset)
+                cursor.execute(sql, sql_params)
+                rows = cursor.fetchall()
+                if rows:
+                    return rows, rows[0][-1]
+                if not start_offset:
+                    return rows, 0
+                sql, sql_params = self.dialect.count(text, where, params)
+                cursor.execute(sql, sql_params)
+                return rows, cursor.fetchone()[0]
+
+        time_budget = search_time_budget()
+        try:
+            if time_budget > 0:
+                rows, hits = self.dialect.run_with_budget(connection, time_budget, run)
+            else:
+                rows, hits = run()
+        except OperationalError as e:
+            if time_budget <= 0 or not self.dialect.is_timeout(e):
+                raise
+            # 数据库按相关度排序前需要得到全部匹配的文档，超出时间预算时没有可返回的部分结果
+            self.log.warning(
+                "Database search exceeded time budget of %ss, returning no results: %s (%s)",
+                time_budget, query_string, e,
+            )
+            return {"results": [], "hits": 0, "spelling_suggestion": None, "partial": True}
+
+        return self._process_rows(rows, hits, highlight, query_string, result_class)
+
+    def _process_rows(self, rows, hits, highlight, query_string, result_class):
+        from haystack import connections
+
+        if result_class is None:
+            result_class = SearchResult
+
+        unified_index = connections[self.connection_alias].get_unified_index()
+        indexed_models = unified_index.get_indexed_models()
+        results = []
+        for identifier, django_ct, django_id, stored_fields, score, _total in rows:
+            raw_result = json.loads(stored_fields)
+            raw_result[DJANGO_CT] = django_ct
+            raw_result[DJANGO_ID] = django_id
+            result = self._convert_result(
+                raw_result, float(score or 0), result_class, unified_index, indexed_models,
+                highlight=highlight, query_string=query_string,
+            )
+            if result is not None:
+                results.append(result)
+            else:
+                hits -= 1
+
+        return {
+            "results": results,
+            "hits": hits,
+            "facets": {},
+            "spelling_suggestion": None,
+        }
+
+    def more_like_this(
+        self,
+        model_instance,
+        additional_query_string=None,
+        start_offset=0,
+        end_offset=None,
+        models=None,
+        limit_to_registered_models=None,
+        result_class=None,
+        **kwargs
+    ):
+        """以文档全文中出现次数最多的词搜索相似文档"""
+        if not self.setup_complete:
+            self.setup()
+
+        identifier = get_identifier(model_instance)
+        tokens = SearchDocument.objects.using(self.database).filter(
+            identifier=identifier
+        ).values_list('text_tokens', flat=True).first()
+        if not tokens:
+            return {"results": [], "hits": 0}
+
+        field_name = self.content_field_name
+        top_terms = [word for word, _ in Counter(tokens.split()).most_common(MORE_LIKE_THIS_TERMS)]
+        parsed_query = whoosh_query.AndNot(
+            whoosh_query.Or([whoosh_query.Term(field_name, word) for word in top_terms]),
+            whoosh_query.Term(ID, identifier),
+        )
+
+        narrow_queries = set()
+        model_choices = self._model_choices(models, limit_to_registered_models)
+        if len(model_choices) > 0:
+            narrow_queries.add(
+                " OR ".join(["%s:%s" % (DJANGO_CT, rm) for rm in model_choices])
+            )
+        if additional_query_string and additional_query_string != "*":
+            narrow_queries.add(additional_query_string)
+        narrow_trees = [self.parser.parse(force_str(nq)) for nq in narrow_queries]
+
+        return self._execute(
+            parsed_query, narrow_trees, None, start_offset, end_offset, result_class=result_class,
+        )
+
+
+class SqlSearchQuery(WhooshSearchQuery):
+    """查询语句与 Whoosh 后端相同，由后端解析后编译为 SQL"""
+
+
+class SqlEngine(BaseEngine):
+    backend = SqlSearchBackend
+    query = SqlSearchQuery
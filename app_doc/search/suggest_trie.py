@@ -0,0 +1,206 @@
+# coding:utf-8
+# @文件: suggest_trie.py
+# 搜索建议（自动补全）前缀树
+# 由热门搜索词、公开文集名称和公开文集中的文档标题构建压缩前缀树（radix trie），
+# 每个节点保存其子树中得分最高的前 K 个词，查询时沿前缀走到节点即可直接返回，不访问数据库；
+# 前缀树由后台线程定期重建，重建完成后整体替换
+
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+from loguru import logger
+
+
+# 词条来源的优先级，同一前缀下优先返回热门搜索词，其次文集名称、文档标题
+PRIORITY_HOT_KEYWORD = 2
+PRIORITY_PROJECT = 1
+PRIORITY_DOC = 0
+
+# 单个词条的最大长度
+MAX_TERM_LENGTH = 100
+
+_trie = None
+_build_lock = threading.Lock()
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def get_top_k():
+    """每个节点保存的建议数量，也是单次查询最多返回的数量"""
+    return getattr(settings, 'SEARCH_SUGGEST_TOP_K', 10)
+
+
+def get_refresh_interval():
+    return getattr(settings, 'SEARCH_SUGGEST_REFRESH_INTERVAL', 300)
+
+
+class _Node(object):
+    __slots__ = ('children', 'top')
+
+    def __init__(self, top=()):
+        # 首字符 → (边上的字符串, 子节点)
+        self.children = None
+        # 子树中得分最高的词条编号，按得分降序
+        self.top = tuple(top)
+
+
+class SuggestTrie(object):
+    """
+    带前 K 名的压缩前缀树
+
+    词条按得分降序插入，每个节点的前 K 名就是最先经过它的 K 个词条，
+    构建时间与词条总长度成正比，查询时间只与前缀长度有关
+    """
+
+    def __init__(self, top_k=10):
+        self.top_k = top_k
+        self.root = _Node()
+        self.terms = []
+
+    def __len__(self):
+        return len(self.terms)
+
+    def _add_top(self, node, term_id):
+        if len(node.top) < self.top_k:
+            node.top = node.top + (term_id,)
+
+    def insert(self, key, term):
+        """插入词条，调用方需保证按得分降序依次插入"""
+        term_id = len(self.terms)
+        self.terms.append(term)
+        node = self.root
+        self._add_top(node, term_id)
+        i = 0
+        while i < len(key):
+            if node.children is None:
+                node.children = {}
+            edge = node.children.get(key[i])
+            if edge is None:
+                leaf = _Node((term_id,))
+                node.children[key[i]] = (key[i:], leaf)
+                return
+            label, child = edge
+            # 公共前缀长度
+            n = 0
+            limit = min(len(label), len(key) - i)
+            while n < limit and label[n] == key[i + n]:
+                n += 1
+            if n < len(label):
+                # 在边的中间分裂出新节点，新节点子树目前只有原子节点，前 K 名与其相同
+                middle = _Node(child.top)
+                middle.children = {label[n]: (label[n:], child)}
+                node.children[key[i]] = (label[:n], middle)
+                child = middle
+            node = child
+            self._add_top(node, term_id)
+            i += n
+
+    def lookup(self, prefix, limit=None):
+        """返回以 prefix 开头（不区分大小写）的得分最高的词条"""
+        key = prefix.lower()
+        node = self.root
+        i = 0
+        while i < len(key):
+            edge = node.children.get(key[i]) if node.children else None
+            if edge is None:
+                return []
+            label, child = edge
+            rest = key[i:]
+            if rest.startswith(label):
+                i += len(label)
+                node = child
+            elif label.startswith(rest):
+                # 前缀在边的中间结束
+                node = child
+                break
+            else:
+                return []
+        top = node.top if limit is None else node.top[:limit]
+        return [self.terms[t] for t in top]
+
+
+def _collect_terms():
+    """从数据库收集词条，返回 [(优先级, 得分, 词条)]"""
+    from app_doc.models import Doc, Project
+    from app_doc.models_search import SearchHotKeyword
+
+    max_terms = getattr(settings, 'SEARCH_SUGGEST_MAX_TERMS', 50000)
+    terms = [
+        (PRIORITY_HOT_KEYWORD, hot_score + search_count, keyword)
+        for keyword, hot_score, search_count
+        in SearchHotKeyword.objects.values_list('keyword', 'hot_score', 'search_count')
+    ]
+    # 只收录公开文集的名称和文档标题，搜索建议接口不区分用户，不能泄露私密文集的内容
+    public_projects = Project.objects.filter(role=0)
+    terms.extend(
+        (PRIORITY_PROJECT, 0, name)
+        for name in public_projects.order_by('-modify_time').values_list('name', flat=True)[:max_terms]
+    )
+    remaining = max(max_terms - len(terms), 0)
+    docs = Doc.objects.filter(status=1, top_doc__in=public_projects.values('id')).order_by('-modify_time')
+    # 较新的文档得分略高
+    terms.extend(
+        (PRIORITY_DOC, -n, name)
+        for n, name in enumerate(docs.values_list('name', flat=True)[:remaining])
+    )
+    return terms
+
+
+def build():
+    """从数据库重建前缀树并替换当前使用的前缀树，返回词条数量"""
+    global _trie
+    with _build_lock:
+        terms = _collect_terms()
+        terms.sort(key=lambda item: (item[0], item[1]), reverse=True)
+        trie = SuggestTrie(get_top_k())
+        seen = set()
+        for _, _, term in terms:
+            term = ' '.join((term or '').split())[:MAX_TERM_LENGTH]
+            key = term.lower()
+            if not key or key in seen:
+                continue
+            seen.add(key)
+            trie.insert(key, term)
+        _trie = trie
+        return len(trie)
+
+
+def suggest(prefix, limit=None):
+    """
+    获取搜索建议
+
+    进程内首次调用时同步构建前缀树，之后只读内存中的前缀树；
+    空前缀返回全局得分最高的词条
+    """
+    trie = _trie
+    if trie is None:
+        build()
+        trie = _trie
+    ensure_worker()
+    limit = get_top_k() if limit is None else min(limit, get_top_k())
+    return trie.lookup(' '.join((prefix or '').split()), limit)
+
+
+def _worker_loop():
+    while True:
+        time.sleep(get_refresh_interval())
+        try:
+            close_old_connections()
+            build()
+        except Exception:
+            logger.exception("重建搜索建议前缀树异常")
+        finally:
+            close_old_connections()
+
+
+def ensure_worker():
+    """按需启动当前进程内定期重建前缀树的线程"""
+    global _worker
+    if _worker is not None and _worker.is_alive():
+        return
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_worker_loop, name='search-suggest-trie', daemon=True)
+            _worker.start()
@@ -0,0 +1,133 @@
+# coding:utf-8
+# @文件: synonyms.py
+# 搜索同义词
+# 启用的同义词一次性加载到进程内的字典中，按版本号判断是否需要重新加载；
+# 同义词在后台修改后通过信号增加保存在数据库中的版本号（AccessScopeVersion），各进程下次扩展查询时重新加载。
+# 查询扩展直接作用于 Whoosh 解析后的查询树：命中同义词的 Term 替换为 Or([原词, 同义词...])
+
+import threading
+
+from django.conf import settings
+from whoosh import query as whoosh_query
+
+from app_doc import access_scope
+
+
+VERSION_KEY = 'search_synonym'
+
+_synonyms = None
+_synonyms_version = None
+_load_lock = threading.Lock()
+
+
+def is_enabled():
+    return getattr(settings, 'SEARCH_SYNONYMS', True)
+
+
+def get_version():
+    """当前同义词版本号，与文集范围版本号保存在同一张表中，不会过期"""
+    version, = access_scope.get_versions(VERSION_KEY)
+    return version
+
+
+def bump_version():
+    """同义词修改后调用，使所有进程重新加载同义词"""
+    access_scope.bump_versions([VERSION_KEY])
+
+
+def _analyze(text):
+    from app_doc.search.highlight import get_analyzer
+    return [token.text for token in get_analyzer()(text) if token.text.strip()]
+
+
+def _load():
+    """
+    读取全部启用的同义词
+
+    Returns:
+        {词: (同义词, ...)}，键为小写原词及其分词结果（只有一个词时），
+        同义词为分词后的词元元组，供构建 Term / And 查询使用
+    """
+    from app_doc.models_search import SearchSynonym
+
+    synonyms = {}
+    for word, synonym_text in SearchSynonym.objects.filter(is_active=True).values_list('word', 'synonyms'):
+        word = word.strip().lower()
+        if not word:
+            continue
+        keys = {word}
+        tokens = _analyze(word)
+        if len(tokens) == 1:
+            keys.add(tokens[0])
+        for synonym in synonym_text.split(','):
+            synonym = synonym.strip().lower()
+            if not synonym or synonym == word:
+                continue
+            tokens = _analyze(synonym)
+            # 同义词本身就是一个完整词元时直接使用，否则要求其各个词元同时出现
+            tokens = (synonym,) if synonym in tokens else tuple(tokens)
+            if not tokens:
+                continue
+            for key in keys:
+                alternatives = synonyms.setdefault(key, [])
+                if tokens not in alternatives:
+                    alternatives.append(tokens)
+    return {key: tuple(alternatives) for key, alternatives in synonyms.items()}
+
+
+def get_synonyms():
+    """当前进程内的同义词字典，版本号变化时重新加载"""
+    global _synonyms, _synonyms_version
+    version = get_version()
+    if _synonyms is None or version != _synonyms_version:
+        with _load_lock:
+            if _synonyms is None or version != _synonyms_version:
+                _synonyms = _load()
+                _synonyms_version = version
+    return _synonyms
+
+
+def _alternative(fieldname, tokens, boost):
+    if len(tokens) == 1:
+        return whoosh_query.Term(fieldname, tokens[0], boost=boost)
+    return whoosh_query.And([whoosh_query.Term(fieldname, t) for t in tokens], boost=boost)
+
+
+def expand_query_tree(q, synonyms=None):
+    """
+    扩展 Whoosh 查询树：一次遍历，把命中同义词的 Term 替换为 Or([原词, 同义词...])
+
+    Args:
+        q: Whoosh 查询对象
+        synonyms: 同义词字典，默认使用 get_synonyms()
+
+    Returns:
+        扩展后的查询对象，没有同义词时原样返回
+    """
+    if synonyms is None:
+        synonyms = get_synonyms()
+    if not synonyms or q is None:
+        return q
+
+    def expand(node):
+        if isinstance(node, whoosh_query.Term):
+            alternatives = synonyms.get(node.text) if isinstance(node.text, str) else None
+            if not alternatives:
+                return node
+            return whoosh_query.Or(
+                [node] + [_alternative(node.fieldname, tokens, node.boost) for tokens in alternatives]
+            )
+        return node.apply(expand)
+
+    return expand(q)
+
+
+def expand_query(query_text, fieldname='text'):
+    """
+    将搜索词分词后扩展为 Whoosh 查询树
+
+    Returns:
+        Or([...])，每个词为一个 Term，有同义词的词为 Or([原词, 同义词...])
+    """
+    terms = [whoosh_query.Term(fieldname, token) for token in _analyze(query_text)]
+    return expand_query_tree(whoosh_query.Or(terms))
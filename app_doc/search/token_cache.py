@@ -0,0 +1,213 @@
+# coding:utf-8
+# @文件: token_cache.py
+# jieba 分词结果缓存
+# 进程内按行缓存分词结果，同一文档的 text / content / title 字段共享同一次分词；
+# 较长的字段值按内容哈希持久化到 whoosh_index 旁的 sqlite 文件，重建索引时未修改的文档不再重新分词
+
+import atexit
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+import jieba
+from loguru import logger
+
+
+# 缓存格式版本，分词结果的存储结构变化时递增
+CACHE_FORMAT = 1
+# 字段值达到该长度才写入持久化缓存，较短的文本直接分词比查询 sqlite 更快
+PERSIST_MIN_CHARS = 256
+# 累计多少条新结果后写入一次 sqlite
+FLUSH_BATCH_SIZE = 200
+# 进程内按行缓存的最大行数
+LINE_CACHE_SIZE = 20000
+
+_lock = threading.RLock()
+_line_cache = OrderedDict()
+_pending = {}
+_local = threading.local()
+_db_checked = set()
+_dict_version = None
+
+
+def _setting(name, default):
+    try:
+        from django.conf import settings
+        return getattr(settings, name, default)
+    except Exception:
+        return default
+
+
+def is_enabled():
+    return _setting('SEARCH_TOKEN_CACHE', True)
+
+
+def get_cache_path():
+    """持久化缓存文件路径：与 whoosh 索引目录同级，重建索引删除索引目录时不受影响"""
+    path = _setting('SEARCH_TOKEN_CACHE_PATH', None)
+    if path:
+        return path
+    connections = _setting('HAYSTACK_CONNECTIONS', {})
+    index_path = connections.get('default', {}).get('PATH')
+    if not index_path:
+        return None
+    return os.path.normpath(index_path) + '_tokens.sqlite3'
+
+
+def get_dict_version():
+    """分词词典版本：jieba 版本或自定义词典变化后，已缓存的分词结果全部失效"""
+    global _dict_version
+    if _dict_version is None:
+        from app_doc.search.chinese_analyzer import CUSTOM_DICT_PATH
+        h = hashlib.sha1()
+        h.update('{}:{}'.format(CACHE_FORMAT, getattr(jieba, '__version__', '')).encode('utf-8'))
+        if os.path.exists(CUSTOM_DICT_PATH):
+            with open(CUSTOM_DICT_PATH, 'rb') as f:
+                h.update(f.read())
+        _dict_version = h.hexdigest()
+    return _dict_version
+
+
+def _segment_line(line):
+    """对单行文本分词，返回 (词, 行内起始位置) 元组，已过滤空白"""
+    with _lock:
+        tokens = _line_cache.get(line)
+        if tokens is not None:
+            _line_cache.move_to_end(line)
+            return tokens
+    tokens = tuple(
+        (w, start) for w, start, _end in jieba.tokenize(line, mode='search') if w.strip()
+    )
+    with _lock:
+        _line_cache[line] = tokens
+        if len(_line_cache) > LINE_CACHE_SIZE:
+            _line_cache.popitem(last=False)
+    return tokens
+
+
+def _segment(value):
+    # jieba 以换行等非词字符作为切分边界，逐行分词与整段分词结果一致
+    words = []
+    starts = []
+    offset = 0
+    for line in value.split('\n'):
+        for w, start in _segment_line(line):
+            words.append(w)
+            starts.append(offset + start)
+        offset += len(line) + 1
+    return words, starts
+
+
+def _get_connection():
+    path = get_cache_path()
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and _local.path == path:
+        return conn
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    with _lock:
+        if path not in _db_checked:
+            _prepare_db(conn)
+            _db_checked.add(path)
+    _local.conn = conn
+    _local.path = path
+    return conn
+
+
+def _prepare_db(conn):
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS token_cache ('
+        'hash TEXT PRIMARY KEY, tokens BLOB NOT NULL, created_at INTEGER NOT NULL)'
+    )
+    conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+    row = conn.execute("SELECT value FROM meta WHERE key = 'dict_version'").fetchone()
+    version = get_dict_version()
+    if row is None or row[0] != version:
+        conn.execute('DELETE FROM token_cache')
+        conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('dict_version', ?)", (version,)
+        )
+    conn.commit()
+
+
+def _load(key):
+    with _lock:
+        entry = _pending.get(key)
+    if entry is not None:
+        return entry
+    row = _get_connection().execute(
+        'SELECT tokens FROM token_cache WHERE hash = ?', (key,)
+    ).fetchone()
+    if row is None:
+        return None
+    return json.loads(zlib.decompress(row[0]))
+
+
+def _store(key, words, starts):
+    with _lock:
+        _pending[key] = (words, starts)
+        need_flush = len(_pending) >= FLUSH_BATCH_SIZE
+    if need_flush:
+        flush()
+
+
+def flush():
+    """将尚未写入的分词结果写入持久化缓存，并按最大条数清理最早的缓存"""
+    with _lock:
+        if not _pending:
+            return
+        items = list(_pending.items())
+        _pending.clear()
+    try:
+        conn = _get_connection()
+        now = int(time.time())
+        conn.executemany(
+            'INSERT OR REPLACE INTO token_cache (hash, tokens, created_at) VALUES (?, ?, ?)',
+            [
+                (key, zlib.compress(json.dumps(tokens, ensure_ascii=False).encode('utf-8')), now)
+                for key, tokens in items
+            ]
+        )
+        max_entries = _setting('SEARCH_TOKEN_CACHE_MAX_ENTRIES', 200000)
+        overflow = conn.execute('SELECT COUNT(*) FROM token_cache').fetchone()[0] - max_entries
+        if overflow > 0:
+            conn.execute(
+                'DELETE FROM token_cache WHERE rowid IN '
+                '(SELECT rowid FROM token_cache ORDER BY created_at, rowid LIMIT ?)', (overflow,)
+            )
+        conn.commit()
+    except Exception:
+        logger.exception("写入分词缓存异常")
+
+
+atexit.register(flush)
+
+
+def segment(value):
+    """
+    对文本进行 search 模式分词
+
+    Returns:
+        [(词, 起始位置, 结束位置), ...]，位置为字符偏移，已过滤空白
+    """
+    if len(value) < PERSIST_MIN_CHARS or not is_enabled() or not get_cache_path():
+        words, starts = _segment(value)
+    else:
+        key = hashlib.sha1(value.encode('utf-8', 'surrogatepass')).hexdigest()
+        cached = None
+        try:
+            cached = _load(key)
+        except Exception:
+            logger.exception("读取分词缓存异常")
+        if cached is not None:
+            words, starts = cached
+        else:
+            words, starts = _segment(value)
+            _store(key, words, starts)
+    return [(w, start, start + len(w)) for w, start in zip(words, starts)]
@@ -0,0 +1,238 @@
+# coding:utf-8
+# @文件: trigram_index.py
+# 文档内容三元组（trigram）倒排索引
+# 正则 / 精确内容搜索先将模式化简为必须出现的三元组，只加载候选文档再逐行匹配
+
+from django.conf import settings
+from django.db.models import Count, Exists, OuterRef
+
+from app_doc.models import Doc
+from app_doc.models_search import DocTrigram, DocTrigramState
+
+try:
+    from re import _parser as sre_parse
+    from re import _constants as sre_constants
+except ImportError:  # Python < 3.11
+    import sre_parse
+    import sre_constants
+
+try:
+    from re._casefix import _EXTRA_CASES
+    _CASE_GROUPS = [(lo,) + extra for lo, extra in _EXTRA_CASES.items()]
+except ImportError:  # Python < 3.11
+    import sre_compile
+    _CASE_GROUPS = list(sre_compile._equivalences)
+
+
+# 单个合取式最多使用的三元组数量，超出部分丢弃（只会让候选集变大，不影响正确性）
+MAX_TRIGRAMS_PER_CLAUSE = 32
+# 析取式最多保留的分支数量，超出则放弃索引筛选
+MAX_CLAUSES = 16
+# 按 ID 分批加载候选文档的批大小
+CANDIDATE_CHUNK_SIZE = 500
+
+# 大小写归一化：与 re.IGNORECASE 的等价关系保持一致
+# 'İ'.lower() 会得到两个字符，而正则引擎按单字符小写处理为 'i'
+_PRE_FOLD = str.maketrans({'İ': 'i'})
+_POST_FOLD = {}
+for _group in _CASE_GROUPS:
+    _canonical = chr(min(_group))
+    for _code in _group:
+        _POST_FOLD[_code] = _canonical
+_POST_FOLD = str.maketrans(_POST_FOLD)
+
+_LITERAL = sre_constants.LITERAL
+_SUBPATTERN = sre_constants.SUBPATTERN
+_BRANCH = sre_constants.BRANCH
+_REPEATS = {sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT}
+if hasattr(sre_constants, 'POSSESSIVE_REPEAT'):
+    _REPEATS.add(sre_constants.POSSESSIVE_REPEAT)
+_ATOMIC_GROUP = getattr(sre_constants, 'ATOMIC_GROUP', None)
+
+
+def is_enabled():
+    return getattr(settings, 'SEARCH_TRIGRAM_INDEX', True)
+
+
+def fold_text(text):
+    """大小写归一化，正则忽略大小写时相互匹配的字符归一化后相同"""
+    return text.translate(_PRE_FOLD).lower().translate(_POST_FOLD)
+
+
+def doc_search_text(doc):
+    """内容搜索使用的文档文本：优先使用 content，为空时使用 pre_content"""
+    return (doc.content if doc.content else doc.pre_content) or ''
+
+
+def extract_trigrams(text):
+    """提取文本中的全部三元组，按行切分（内容搜索逐行匹配，不会跨行）"""
+    trigrams = set()
+    for line in fold_text(text).split('\n'):
+        for i in range(len(line) - 2):
+            trigrams.add(line[i:i + 3])
+    return trigrams
+
+
+def index_doc(doc):
+    """为单篇文档建立或更新三元组索引，只写入增删的差异部分"""
+    new_trigrams = extract_trigrams(doc_search_text(doc))
+    old_trigrams = set(
+        DocTrigram.objects.filter(doc_id=doc.id).values_list('trigram', flat=True)
+    )
+    removed = old_trigrams - new_trigrams
+    added = new_trigrams - old_trigrams
+    if removed:
+        DocTrigram.objects.filter(doc_id=doc.id, trigram__in=removed).delete()
+    if added:
+        DocTrigram.objects.bulk_create(
+            [DocTrigram(doc_id=doc.id, trigram=t) for t in added],
+            batch_size=1000,
+        )
+    DocTrigramState.objects.update_or_create(
+        doc_id=doc.id, defaults={'modify_time': doc.modify_time}
+    )
+
+
+def remove_doc(doc_id):
+    """删除文档的三元组索引"""
+    DocTrigram.objects.filter(doc_id=doc_id).delete()
+    DocTrigramState.objects.filter(doc_id=doc_id).delete()
+
+
+def rebuild(queryset=None, stdout=None):
+    """重建三元组索引，未指定查询集时全量重建并清理已不存在文档的索引，返回处理的文档数量"""
+    if queryset is None:
+        queryset = Doc.objects.all()
+        DocTrigram.objects.exclude(doc_id__in=queryset.values('id')).delete()
+        DocTrigramState.objects.exclude(doc_id__in=queryset.values('id')).delete()
+    count = 0
+    for doc in queryset.order_by('id').iterator(chunk_size=CANDIDATE_CHUNK_SIZE):
+        index_doc(doc)
+        count += 1
+        if stdout is not None and count % 500 == 0:
+            stdout.write(f'已索引 {count} 篇文档')
+    return count
+
+
+# 模式分析结果使用析取范式表示：[{三元组...}, {三元组...}] 表示各分支满足其一，
+# 每个分支内的三元组必须全部出现；None 表示无法约束（任何文档都可能匹配）
+def _and(left, right):
+    if left is None:
+        return right
+    if right is None:
+        return left
+    clauses = [a | b for a in left for b in right]
+    if len(clauses) > MAX_CLAUSES:
+        return left if len(left) <= len(right) else right
+    return clauses
+
+
+def _or(alternatives):
+    clauses = []
+    for alt in alternatives:
+        if alt is None:
+            return None
+        clauses.extend(alt)
+    if len(clauses) > MAX_CLAUSES:
+        return None
+    return clauses
+
+
+def _literal_clause(run):
+    if len(run) < 3:
+        return None
+    run = fold_text(run)
+    return [frozenset(run[i:i + 3] for i in range(len(run) - 2))]
+
+
+def _analyze(subpattern):
+    result = None
+    run = ''
+    for op, av in subpattern:
+        if op is _LITERAL:
+            run += chr(av)
+            continue
+        # 连续字面量被打断，将其三元组加入约束
+        result = _and(result, _literal_clause(run))
+        run = ''
+        if op is _SUBPATTERN:
+            result = _and(result, _analyze(av[-1]))
+        elif op is _ATOMIC_GROUP:
+            result = _and(result, _analyze(av))
+        elif op in _REPEATS:
+            min_count, _max_count, item = av
+            if min_count >= 1:
+                result = _and(result, _analyze(item))
+        elif op is _BRANCH:
+            result = _and(result, _or([_analyze(b) for b in av[1]]))
+        # 其余节点（字符集、任意字符、断言、反向引用等）不产生约束
+    return _and(result, _literal_clause(run))
+
+
+def pattern_trigram_query(pattern):
+    """
+    将正则表达式化简为必须出现的三元组
+
+    Returns:
+        None 表示无法使用索引筛选；否则为合取式列表，文档满足其一即为候选
+    """
+    try:
+        parsed = sre_parse.parse(pattern)
+    except Exception:
+        return None
+    clauses = _analyze(parsed)
+    if clauses is None or any(len(c) == 0 for c in clauses):
+        return None
+    return [sorted(c)[:MAX_TRIGRAMS_PER_CLAUSE] for c in clauses]
+
+
+def candidate_doc_ids(pattern, docs_query):
+    """
+    获取可能匹配模式的文档ID集合
+
+    Args:
+        pattern: 正则表达式字符串
+        docs_query: 限定范围的文档查询集（状态、文集等）
+
+    Returns:
+        None 表示需要逐篇扫描 docs_query；否则为候选文档ID集合，
+        包含索引命中的文档以及索引过期（修改后尚未重建索引）的文档
+    """
+    if not is_enabled():
+        return None
+    clauses = pattern_trigram_query(pattern)
+    if clauses is None:
+        return None
+
+    scope_ids = docs_query.values('id')
+    candidates = set()
+    for trigrams in clauses:
+        candidates.update(
+            DocTrigram.objects.filter(
+                trigram__in=trigrams, doc_id__in=scope_ids
+            ).values('doc_id').annotate(
+                n=Count('id')
+            ).filter(n=len(trigrams)).values_list('doc_id', flat=True)
+        )
+
+    fresh_state = DocTrigramState.objects.filter(
+        doc_id=OuterRef('id'), modify_time=OuterRef('modify_time')
+    )
+    candidates.update(
+        docs_query.exclude(Exists(fresh_state)).values_list('id', flat=True)
+    )
+    return candidates
+
+
+def iter_docs(docs_query, candidate_ids=None):
+    """
+    按文档ID顺序遍历文档，给定候选集合时只分批加载候选文档
+    """
+    docs_query = docs_query.order_by('id')
+    if candidate_ids is None:
+        yield from docs_query.iterator(chunk_size=CANDIDATE_CHUNK_SIZE)
+        return
+    ordered_ids = sorted(candidate_ids)
+    for i in range(0, len(ordered_ids), CANDIDATE_CHUNK_SIZE):
+        chunk = ordered_ids[i:i + CANDIDATE_CHUNK_SIZE]
+        yield from docs_query.filter(id__in=chunk)
@@ -24,6 +24,7 @@ from haystack.backends import (
     log_query,
 )
 from haystack.constants import (
+    DEFAULT_ALIAS,
     DJANGO_CT,
     DJANGO_ID,
     FUZZY_WHOOSH_MAX_EDITS,
@@ -52,6 +53,7 @@ if not hasattr(whoosh, "__version__") or whoosh.__version__ < (2, 5, 0):
 from whoosh import index
 # from whoosh.analysis import StemmingAnalyzer
 from app_doc.search.chinese_analyzer import ChineseAnalyzer as StemmingAnalyzer
+from app_doc.search import token_cache
 from whoosh.fields import ID as WHOOSH_ID
 from whoosh.fields import (
     BOOLEAN,
@@ -64,6 +66,7 @@ from whoosh.fields import (
     Schema,
     TEXT,
 )
+from whoosh.collectors import FilterCollector, TimeLimit, TimeLimitCollector
 from whoosh.filedb.filestore import FileStorage, RamStorage
 from whoosh.highlight import highlight as whoosh_highlight
 from whoosh.highlight import ContextFragmenter, HtmlFormatter
@@ -72,6 +75,7 @@ from whoosh.searching import ResultsPage
 from whoosh.writing import AsyncWriter
 # 导入 BM25F 评分模型
 from whoosh.scoring import BM25F
+from app_doc.search import searcher_pool, shards, synonyms
 
 
 DATETIME_REGEX = re.compile(
@@ -81,6 +85,74 @@ LOCALS = threading.local()
 LOCALS.RAM_STORE = None
 
 
+def search_weighting():
+    # 使用 BM25F 评分模型提升搜索相关性
+    # field_B 参数控制不同字段的长度归一化，值越小，字段长度影响越小
+    # 标题字段通常较短，设置较小的 B 值
+    return BM25F(
+        B=0.75,  # 默认值，控制文档长度归一化
+        K1=1.2,  # 默认值，控制词频饱和度
+        field_B={'text': 0.75}  # 可以根据不同字段设置不同的 B 值
+    )
+
+
+def search_time_budget():
+    """单次全文搜索的时间预算（秒），0 表示不限制"""
+    return getattr(settings, 'SEARCH_TIME_BUDGET', 2.0)
+
+
+class BudgetCollector(TimeLimitCollector):
+    """
+    带时间预算的收集器
+
+    TimeLimitCollector 只在自身的 collect_matches 中检查超时，被 FilterCollector 包装时会被绕过，
+    因此改为在 matches() 中逐个文档检查；不使用 SIGALRM 信号（只能在主线程注册，Web 服务的工作线程中不可用）。
+    同时记录已扫描到的文档编号和已收集的数量，超时后据此估算命中总数
+    """
+
+    def __init__(self, child, timelimit):
+        TimeLimitCollector.__init__(self, child, timelimit, use_alarm=False)
+        self.collected = 0
+        self.last_docnum = -1
+
+    def prepare(self, top_searcher, q, context):
+        TimeLimitCollector.prepare(self, top_searcher, q, context)
+        self.collected = 0
+        self.last_docnum = -1
+
+    def matches(self):
+        offset = self.child.offset
+        for sub_docnum in self.child.matches():
+            if self.timedout:
+                raise TimeLimit
+            self.last_docnum = offset + sub_docnum
+            yield sub_docnum
+
+    def collect_matches(self):
+        for sub_docnum in self.matches():
+            self.collect(sub_docnum)
+
+    def computes_count(self):
+        return self.child.computes_count()
+
+    def collect(self, sub_docnum):
+        self.collected += 1
+        return self.child.collect(sub_docnum)
+
+    def estimated_total(self):
+        """按已扫描的文档编号比例推算命中总数，不超过查询本身估计的匹配数量上限"""
+        searcher = self.child.top_searcher
+        doc_count = searcher.doc_count_all()
+        if self.last_docnum < 0 or not doc_count:
+            return self.collected
+        estimate = int(self.collected * doc_count / (self.last_docnum + 1))
+        try:
+            estimate = min(estimate, self.child.q.estimate_size(searcher.reader()))
+        except Exception:
+            pass
+        return max(estimate, self.collected)
+
+
 class WhooshHtmlFormatter(HtmlFormatter):
     """
     This is a HtmlFormatter simpler than the whoosh.HtmlFormatter.
@@ -125,6 +197,8 @@ class WhooshSearchBackend(BaseSearchBackend):
         )
         self.setup_complete = False
         self.use_file_storage = True
+        # 是否按文集分片，见 app_doc.search.shards
+        self.sharded = False
         self.post_limit = getattr(connection_options, "POST_LIMIT", 128 * 1024 * 1024)
         self.path = connection_options.get("PATH")
 
@@ -139,12 +213,66 @@ class WhooshSearchBackend(BaseSearchBackend):
 
         self.log = logging.getLogger("haystack")
 
+    def _searcher_key(self, shard=None):
+        if self.sharded:
+            return self.index.shard_path(shard) if shard else self.index.root
+        return self.path if self.use_file_storage else id(self.storage)
+
+    def _searcher(self, shard=None):
+        """
+        从当前进程的搜索器池中取出搜索器（with 语句结束时归还）
+
+        分片模式下 shard 为 None 时搜索全部分片，否则只搜索指定的分片
+        """
+        ix = self.index if shard is None else self.index.shard_index(shard)
+        return searcher_pool.pooled_searcher(
+            self._searcher_key(shard),
+            ix,
+            weighting=search_weighting(),
+        )
+
+    def index_generation(self):
+        """当前索引代数，索引每次提交后递增，用于使搜索结果缓存失效"""
+        if not self.setup_complete:
+            self.setup()
+        return self.index.latest_generation()
+
+    def stored_documents(self, identifiers):
+        """
+        按索引文档ID（app_label.model_name.pk）批量读取索引中存储的字段，不访问数据库
+
+        Returns:
+            {文档ID: 存储字段字典}，索引中不存在的文档不包含在内
+        """
+        if not self.setup_complete:
+            self.setup()
+
+        self.index = self.index.refresh()
+        documents = {}
+        with self._searcher() as searcher:
+            for identifier in identifiers:
+                fields = searcher.document(**{ID: identifier})
+                if fields is not None:
+                    documents[identifier] = fields
+        return documents
+
+    def _narrow_docnums(self, searcher, narrow_query, shard=None):
+        """
+        过滤查询匹配的文档编号集合（set），同一索引代数内相同的过滤查询直接复用
+        返回的集合可能被其他请求共享，不能原地修改
+        """
+        pool = searcher_pool.get_pool(self._searcher_key(shard))
+        generation = searcher._pool_generation
+        docnums = pool.get_filter(generation, narrow_query)
+        if docnums is None:
+            docnums = set(searcher.docs_for_query(self.parser.parse(narrow_query)))
+            pool.set_filter(generation, narrow_query, docnums)
+        return docnums
+
     def setup(self):
         """
         Defers loading until needed.
         """
-        from haystack import connections
-
         new_index = False
 
         # Make sure the index is there.
@@ -168,15 +296,14 @@ class WhooshSearchBackend(BaseSearchBackend):
 
             self.storage = LOCALS.RAM_STORE
 
-        self.content_field_name, self.schema = self.build_schema(
-            connections[self.connection_alias].get_unified_index().all_searchfields()
-        )
-        self.parser = QueryParser(
-            self.content_field_name,
-            schema=self.schema,
-            group=OrGroup
-        )
-        self.parser.add_plugins([FuzzyTermPlugin])
+        self._setup_schema()
+
+        # 分片模式：文档按文集写入 whoosh_index_shards 下的各个分片，不使用 PATH 下的索引
+        self.sharded = self.use_file_storage and shards.is_enabled()
+        if self.sharded:
+            self.index = shards.ShardedIndex(shards.get_root(self.path), self.schema)
+            self.setup_complete = True
+            return
 
         if new_index is True:
             self.index = self.storage.create_index(self.schema)
@@ -190,6 +317,20 @@ class WhooshSearchBackend(BaseSearchBackend):
 
         self.setup_complete = True
 
+    def _setup_schema(self):
+        """根据已注册的搜索索引建立 schema 和查询解析器"""
+        from haystack import connections
+
+        self.content_field_name, self.schema = self.build_schema(
+            connections[self.connection_alias].get_unified_index().all_searchfields()
+        )
+        self.parser = QueryParser(
+            self.content_field_name,
+            schema=self.schema,
+            group=OrGroup
+        )
+        self.parser.add_plugins([FuzzyTermPlugin])
+
     def build_schema(self, fields):
         schema_fields = {
             ID: WHOOSH_ID(stored=True, unique=True),
@@ -275,9 +416,50 @@ class WhooshSearchBackend(BaseSearchBackend):
         if not self.setup_complete:
             self.setup()
 
+        if self.sharded:
+            self._apply_sharded(index, iterable, ())
+            token_cache.flush()
+            return
+
         self.index = self.index.refresh()
         writer = AsyncWriter(self.index)
+        self._write_documents(writer, index, iterable)
+
+        if len(iterable) > 0:
+            # For now, commit no matter what, as we run into locking issues otherwise.
+            writer.commit()
+
+        # 写入本批文档新产生的分词缓存
+        token_cache.flush()
+
+    def apply_changes(self, index, iterable, remove_identifiers):
+        """
+        在同一个写入器中更新和删除文档，只提交一次索引
+
+        :param iterable: 需要新增或更新的对象
+        :param remove_identifiers: 需要删除的文档标识，如 app_doc.doc.1
+        """
+        if not self.setup_complete:
+            self.setup()
 
+        if not iterable and not remove_identifiers:
+            return
+
+        if self.sharded:
+            self._apply_sharded(index, iterable, remove_identifiers)
+            token_cache.flush()
+            return
+
+        self.index = self.index.refresh()
+        writer = AsyncWriter(self.index)
+        for identifier in remove_identifiers:
+            writer.delete_by_term(ID, identifier)
+        self._write_documents(writer, index, iterable)
+        writer.commit()
+        token_cache.flush()
+
+    def _prepare_documents(self, index, iterable):
+        """依次生成 (对象, 转换为 Whoosh 字段值的文档)"""
         for obj in iterable:
             try:
                 doc = index.full_prepare(obj)
@@ -293,31 +475,76 @@ class WhooshSearchBackend(BaseSearchBackend):
                 if "boost" in doc:
                     del doc["boost"]
 
-                try:
-                    writer.update_document(**doc)
-                except Exception as e:
-                    if not self.silently_fail:
-                        raise
+                yield obj, doc
 
-                    # We'll log the object identifier but won't include the actual object
-                    # to avoid the possibility of that generating encoding errors while
-                    # processing the log message:
-                    self.log.error(
-                        "%s while preparing object for update" % e.__class__.__name__,
-                        exc_info=True,
-                        extra={"data": {"index": index, "object": get_identifier(obj)}},
-                    )
+    def _write_document(self, writer, index, obj, doc):
+        try:
+            writer.update_document(**doc)
+        except Exception as e:
+            if not self.silently_fail:
+                raise
 
-        if len(iterable) > 0:
-            # For now, commit no matter what, as we run into locking issues otherwise.
+            # We'll log the object identifier but won't include the actual object
+            # to avoid the possibility of that generating encoding errors while
+            # processing the log message:
+            self.log.error(
+                "%s while preparing object for update" % e.__class__.__name__,
+                exc_info=True,
+                extra={"data": {"index": index, "object": get_identifier(obj)}},
+            )
+
+    def _write_documents(self, writer, index, iterable):
+        for obj, doc in self._prepare_documents(index, iterable):
+            self._write_document(writer, index, obj, doc)
+
+    def _locate_shards(self, identifiers):
+        """查找文档当前所在的分片，返回 {文档ID: {分片名称}}，只包含已在索引中的文档"""
+        located = {}
+        if not identifiers:
+            return located
+        with self._searcher() as searcher:
+            reader = searcher.reader()
+            for identifier in identifiers:
+                for docnum in searcher.document_numbers(**{ID: identifier}):
+                    located.setdefault(identifier, set()).add(reader.shard_of(docnum))
+        return located
+
+    def _apply_sharded(self, index, iterable, remove_identifiers):
+        """
+        分片模式下更新和删除文档：文档写入所属文集的分片，并从原来所在的其他分片中删除
+        （文档被移动到其他文集时），每个涉及的分片各自提交一次
+        """
+        updates = {}
+        prepared = list(self._prepare_documents(index, iterable)) if iterable else []
+        for obj, doc in prepared:
+            updates.setdefault(shards.shard_for_document(doc), []).append((obj, doc))
+
+        deletes = {}
+        targets = {doc[ID]: shard for shard, items in updates.items() for _, doc in items}
+        removals = set(remove_identifiers)
+        for identifier, located in self._locate_shards(list(targets) + list(removals)).items():
+            for shard in located:
+                if identifier in removals or shard != targets.get(identifier):
+                    deletes.setdefault(shard, set()).add(identifier)
+
+        for shard in sorted(set(updates) | set(deletes)):
+            writer = self.index.writer(shard)
+            for identifier in deletes.get(shard, ()):
+                writer.delete_by_term(ID, identifier)
+            for obj, doc in updates.get(shard, ()):
+                self._write_document(writer, index, obj, doc)
             writer.commit()
 
     def remove(self, obj_or_string, commit=True):
         if not self.setup_complete:
             self.setup()
 
-        self.index = self.index.refresh()
         whoosh_id = get_identifier(obj_or_string)
+        if self.sharded:
+            self._apply_sharded(None, (), [whoosh_id])
+            return
+
+        self.index = self.index.refresh()
 
         try:
             self.index.delete_by_query(q=self.parser.parse('%s:"%s"' % (ID, whoosh_id)))
@@ -350,9 +577,13 @@ class WhooshSearchBackend(BaseSearchBackend):
                 for model in models:
                     models_to_delete.append("%s:%s" % (DJANGO_CT, get_model_ct(model)))
 
-                self.index.delete_by_query(
-                    q=self.parser.parse(" OR ".join(models_to_delete))
-                )
+                q = self.parser.parse(" OR ".join(models_to_delete))
+                if self.sharded:
+                    for shard in self.index.shard_names():
+                        self.index.shard_index(shard).delete_by_query(q=q)
+                    self.index.bump_generation()
+                else:
+                    self.index.delete_by_query(q=q)
         except Exception as e:
             if not self.silently_fail:
                 raise
@@ -370,6 +601,14 @@ class WhooshSearchBackend(BaseSearchBackend):
     def delete_index(self):
         # Per the Whoosh mailing list, if wiping out everything from the index,
         # it's much more efficient to simply delete the index files.
+        if self.sharded:
+            searcher_pool.clear()
+            self.index.destroy()
+            self.index.bump_generation()
+            return
+
+        if self.use_file_storage:
+            searcher_pool.clear(self.path)
         if self.use_file_storage and os.path.exists(self.path):
             shutil.rmtree(self.path)
         elif not self.use_file_storage:
@@ -516,97 +755,129 @@ class WhooshSearchBackend(BaseSearchBackend):
                 " OR ".join(["%s:%s" % (DJANGO_CT, rm) for rm in model_choices])
             )
 
-        narrow_searcher = None
+        # 分片模式下限定在单个文集内的搜索只打开该文集的分片
+        shard = None
+        if self.sharded:
+            shard = shards.shard_for_narrow_queries(narrow_queries)
+            if shard is not None and self.index.shard_index(shard) is None:
+                return {"results": [], "hits": 0}
 
-        if narrow_queries is not None:
-            # Potentially expensive? I don't see another way to do it in Whoosh...
-            narrow_searcher = self.index.searcher()
+        # 过滤查询与主查询共用搜索器池中的同一个搜索器，索引未变化时不重新打开索引段
+        with self._searcher(shard) as searcher:
+            if narrow_queries is not None:
+                # 过滤查询（模型范围、文集权限范围等）的匹配结果按索引代数缓存
+                for nq in narrow_queries:
+                    docnums = self._narrow_docnums(searcher, force_str(nq), shard)
 
-            for nq in narrow_queries:
-                recent_narrowed_results = narrow_searcher.search(
-                    self.parser.parse(force_str(nq)), limit=None
-                )
+                    if not docnums:
+                        return {"results": [], "hits": 0}
 
-                if len(recent_narrowed_results) <= 0:
-                    return {"results": [], "hits": 0}
+                    if narrowed_results is not None:
+                        narrowed_results = narrowed_results & docnums
+                    else:
+                        narrowed_results = docnums
 
-                if narrowed_results:
-                    narrowed_results.filter(recent_narrowed_results)
-                else:
-                    narrowed_results = recent_narrowed_results
+            if searcher.doc_count():
+                parsed_query = self.parser.parse(query_string)
 
-        self.index = self.index.refresh()
+                # In the event of an invalid/stopworded query, recover gracefully.
+                if parsed_query is None:
+                    return {"results": [], "hits": 0}
 
-        if self.index.doc_count():
-            # 使用 BM25F 评分模型提升搜索相关性
-            # field_B 参数控制不同字段的长度归一化，值越小，字段长度影响越小
-            # 标题字段通常较短，设置较小的 B 值
-            weighting = BM25F(
-                B=0.75,  # 默认值，控制文档长度归一化
-                K1=1.2,  # 默认值，控制词频饱和度
-                field_B={'text': 0.75}  # 可以根据不同字段设置不同的 B 值
-            )
-            searcher = self.index.searcher(weighting=weighting)
-            parsed_query = self.parser.parse(query_string)
+                # 在解析后的查询树上扩展同义词
+                if synonyms.is_enabled():
+                    parsed_query = synonyms.expand_query_tree(parsed_query)
 
-            # In the event of an invalid/stopworded query, recover gracefully.
-            if parsed_query is None:
-                return {"results": [], "hits": 0}
+                page_num, page_length = self.calculate_page(start_offset, end_offset)
 
-            page_num, page_length = self.calculate_page(start_offset, end_offset)
+                search_kwargs = {
+                    "pagelen": page_length,
+                    "sortedby": sort_by,
+                    "reverse": reverse,
+                }
 
-            search_kwargs = {
-                "pagelen": page_length,
-                "sortedby": sort_by,
-                "reverse": reverse,
-            }
+                # Handle the case where the results have been narrowed.
+                if narrowed_results is not None:
+                    search_kwargs["filter"] = narrowed_results
 
-            # Handle the case where the results have been narrowed.
-            if narrowed_results is not None:
-                search_kwargs["filter"] = narrowed_results
+                partial = False
+                try:
+                    time_budget = search_time_budget()
+                    if time_budget > 0:
+                        raw_page, partial = self._search_page_with_budget(
+                            searcher, parsed_query, page_num, time_budget, **search_kwargs
+                        )
+                    else:
+                        raw_page = searcher.search_page(parsed_query, page_num, **search_kwargs)
+                except ValueError:
+                    if not self.silently_fail:
+                        raise
 
-            try:
-                raw_page = searcher.search_page(parsed_query, page_num, **search_kwargs)
-            except ValueError:
-                if not self.silently_fail:
-                    raise
+                    return {"results": [], "hits": 0, "spelling_suggestion": None}
 
-                return {"results": [], "hits": 0, "spelling_suggestion": None}
+                # Because as of Whoosh 2.5.1, it will return the wrong page of
+                # results if you request something too high. :(
+                if raw_page.pagenum < page_num:
+                    return {"results": [], "hits": 0, "spelling_suggestion": None, "partial": partial}
 
-            # Because as of Whoosh 2.5.1, it will return the wrong page of
-            # results if you request something too high. :(
-            if raw_page.pagenum < page_num:
-                return {"results": [], "hits": 0, "spelling_suggestion": None}
+                results = self._process_results(
+                    raw_page,
+                    highlight=highlight,
+                    query_string=query_string,
+                    spelling_query=spelling_query,
+                    result_class=result_class,
+                )
+                # 超出时间预算时返回已收集到的结果，hits 为估算的命中总数
+                results["partial"] = partial
+                return results
 
-            results = self._process_results(
-                raw_page,
-                highlight=highlight,
-                query_string=query_string,
-                spelling_query=spelling_query,
-                result_class=result_class,
-            )
-            searcher.close()
+        if self.include_spelling:
+            if spelling_query:
+                spelling_suggestion = self.create_spelling_suggestion(
+                    spelling_query
+                )
+            else:
+                spelling_suggestion = self.create_spelling_suggestion(query_string)
+        else:
+            spelling_suggestion = None
 
-            if hasattr(narrow_searcher, "close"):
-                narrow_searcher.close()
+        return {
+            "results": [],
+            "hits": 0,
+            "spelling_suggestion": spelling_suggestion,
+        }
 
-            return results
-        else:
-            if self.include_spelling:
-                if spelling_query:
-                    spelling_suggestion = self.create_spelling_suggestion(
-                        spelling_query
-                    )
-                else:
-                    spelling_suggestion = self.create_spelling_suggestion(query_string)
-            else:
-                spelling_suggestion = None
+    def _search_page_with_budget(self, searcher, parsed_query, page_num, time_budget,
+                                 pagelen=10, sortedby=None, reverse=False, filter=None):
+        """
+        与 searcher.search_page 相同，但收集命中文档的时间不超过 time_budget 秒
 
-            return {
-                "results": [],
-                "hits": 0,
-                "spelling_suggestion": spelling_suggestion,
-            }
+        Returns:
+            (ResultsPage, 是否只有部分结果)
+        """
+        if page_num < 1:
+            raise ValueError("pagenum must be >= 1")
+
+        # 时间限制包在过滤之内，FilterCollector 过滤后的文档才计入已收集数量
+        collector = BudgetCollector(
+            searcher.collector(limit=page_num * pagelen, sortedby=sortedby, reverse=reverse),
+            time_budget,
+        )
+        outer = FilterCollector(collector, filter) if filter else collector
+        partial = False
+        try:
+            searcher.search_with_collector(parsed_query, outer)
+        except TimeLimit:
+            partial = True
+            self.log.warning(
+                "Whoosh search exceeded time budget of %ss, returning partial results: %s",
+                time_budget, parsed_query,
+            )
+        results = outer.results()
+        if partial:
+            # 不能调用 len(results)，TopCollector 统计总数时会不限时地重新执行查询
+            results._total = collector.estimated_total()
+        return ResultsPage(results, page_num, pagelen), partial
 
     def more_like_this(
         self,
@@ -652,66 +923,49 @@ class WhooshSearchBackend(BaseSearchBackend):
         if additional_query_string and additional_query_string != "*":
             narrow_queries.add(additional_query_string)
 
-        narrow_searcher = None
-
-        if narrow_queries is not None:
-            # Potentially expensive? I don't see another way to do it in Whoosh...
-            narrow_searcher = self.index.searcher()
-
-            for nq in narrow_queries:
-                recent_narrowed_results = narrow_searcher.search(
-                    self.parser.parse(force_str(nq)), limit=None
-                )
-
-                if len(recent_narrowed_results) <= 0:
-                    return {"results": [], "hits": 0}
-
-                if narrowed_results:
-                    narrowed_results.filter(recent_narrowed_results)
-                else:
-                    narrowed_results = recent_narrowed_results
-
         page_num, page_length = self.calculate_page(start_offset, end_offset)
 
-        self.index = self.index.refresh()
-        raw_results = EmptyResults()
+        with self._searcher() as searcher:
+            if narrow_queries is not None:
+                # 过滤查询（模型范围、文集权限范围等）的匹配结果按索引代数缓存
+                for nq in narrow_queries:
+                    docnums = self._narrow_docnums(searcher, force_str(nq))
 
-        searcher = None
-        if self.index.doc_count():
-            query = "%s:%s" % (ID, get_identifier(model_instance))
-            searcher = self.index.searcher()
-            parsed_query = self.parser.parse(query)
-            results = searcher.search(parsed_query)
+                    if not docnums:
+                        return {"results": [], "hits": 0}
 
-            if len(results):
-                raw_results = results[0].more_like_this(field_name, top=end_offset)
+                    if narrowed_results is not None:
+                        narrowed_results = narrowed_results & docnums
+                    else:
+                        narrowed_results = docnums
 
-            # Handle the case where the results have been narrowed.
-            if narrowed_results is not None and hasattr(raw_results, "filter"):
-                raw_results.filter(narrowed_results)
+            raw_results = EmptyResults()
 
-        try:
-            raw_page = ResultsPage(raw_results, page_num, page_length)
-        except ValueError:
-            if not self.silently_fail:
-                raise
-
-            return {"results": [], "hits": 0, "spelling_suggestion": None}
+            if searcher.doc_count():
+                query = "%s:%s" % (ID, get_identifier(model_instance))
+                parsed_query = self.parser.parse(query)
+                results = searcher.search(parsed_query)
 
-        # Because as of Whoosh 2.5.1, it will return the wrong page of
-        # results if you request something too high. :(
-        if raw_page.pagenum < page_num:
-            return {"results": [], "hits": 0, "spelling_suggestion": None}
+                # Handle the case where the results have been narrowed.
+                if len(results):
+                    raw_results = results[0].more_like_this(
+                        field_name, top=end_offset, filter=narrowed_results
+                    )
 
-        results = self._process_results(raw_page, result_class=result_class)
+            try:
+                raw_page = ResultsPage(raw_results, page_num, page_length)
+            except ValueError:
+                if not self.silently_fail:
+                    raise
 
-        if searcher:
-            searcher.close()
+                return {"results": [], "hits": 0, "spelling_suggestion": None}
 
-        if hasattr(narrow_searcher, "close"):
-            narrow_searcher.close()
+            # Because as of Whoosh 2.5.1, it will return the wrong page of
+            # results if you request something too high. :(
+            if raw_page.pagenum < page_num:
+                return {"results": [], "hits": 0, "spelling_suggestion": None}
 
-        return results
+            return self._process_results(raw_page, result_class=result_class)
 
     def _process_results(
         self,
@@ -739,57 +993,11 @@ class WhooshSearchBackend(BaseSearchBackend):
 
         for doc_offset, raw_result in enumerate(raw_page):
             score = raw_page.score(doc_offset) or 0
-            app_label, model_name = raw_result[DJANGO_CT].split(".")
-            additional_fields = {}
-            model = haystack_get_model(app_label, model_name)
-
-            if model and model in indexed_models:
-                for key, value in raw_result.items():
-                    index = unified_index.get_index(model)
-                    string_key = str(key)
-
-                    if string_key in index.fields and hasattr(
-                        index.fields[string_key], "convert"
-                    ):
-                        # Special-cased due to the nature of KEYWORD fields.
-                        if index.fields[string_key].is_multivalued:
-                            if value is None or len(value) == 0:
-                                additional_fields[string_key] = []
-                            else:
-                                additional_fields[string_key] = value.split(",")
-                        else:
-                            additional_fields[string_key] = index.fields[
-                                string_key
-                            ].convert(value)
-                    else:
-                        additional_fields[string_key] = self._to_python(value)
-
-                del (additional_fields[DJANGO_CT])
-                del (additional_fields[DJANGO_ID])
-
-                if highlight:
-                    sa = StemmingAnalyzer()
-                    formatter = WhooshHtmlFormatter("em")
-                    terms = [token.text for token in sa(query_string)]
-
-                    whoosh_result = whoosh_highlight(
-                        additional_fields.get(self.content_field_name),
-                        terms,
-                        sa,
-                        ContextFragmenter(),
-                        formatter,
-                    )
-                    additional_fields["highlighted"] = {
-                        self.content_field_name: [whoosh_result]
-                    }
-
-                result = result_class(
-                    app_label,
-                    model_name,
-                    raw_result[DJANGO_ID],
-                    score,
-                    **additional_fields
-                )
+            result = self._convert_result(
+                raw_result, score, result_class, unified_index, indexed_models,
+                highlight=highlight, query_string=query_string,
+            )
+            if result is not None:
                 results.append(result)
             else:
                 hits -= 1
@@ -807,6 +1015,63 @@ class WhooshSearchBackend(BaseSearchBackend):
             "spelling_suggestion": spelling_suggestion,
         }
 
+    def _convert_result(self, raw_result, score, result_class, unified_index, indexed_models,
+                        highlight=False, query_string=""):
+        """将索引中存储的字段转换为 result_class 实例，模型未注册搜索索引时返回 None"""
+        app_label, model_name = raw_result[DJANGO_CT].split(".")
+        additional_fields = {}
+        model = haystack_get_model(app_label, model_name)
+
+        if not model or model not in indexed_models:
+            return None
+
+        for key, value in raw_result.items():
+            index = unified_index.get_index(model)
+            string_key = str(key)
+
+            if string_key in index.fields and hasattr(
+                index.fields[string_key], "convert"
+            ):
+                # Special-cased due to the nature of KEYWORD fields.
+                if index.fields[string_key].is_multivalued:
+                    if value is None or len(value) == 0:
+                        additional_fields[string_key] = []
+                    else:
+                        additional_fields[string_key] = value.split(",")
+                else:
+                    additional_fields[string_key] = index.fields[
+                        string_key
+                    ].convert(value)
+            else:
+                additional_fields[string_key] = self._to_python(value)
+
+        del (additional_fields[DJANGO_CT])
+        del (additional_fields[DJANGO_ID])
+
+        if highlight:
+            sa = StemmingAnalyzer()
+            formatter = WhooshHtmlFormatter("em")
+            terms = [token.text for token in sa(query_string)]
+
+            whoosh_result = whoosh_highlight(
+                additional_fields.get(self.content_field_name),
+                terms,
+                sa,
+                ContextFragmenter(),
+                formatter,
+            )
+            additional_fields["highlighted"] = {
+                self.content_field_name: [whoosh_result]
+            }
+
+        return result_class(
+            app_label,
+            model_name,
+            raw_result[DJANGO_ID],
+            score,
+            **additional_fields
+        )
+
     def create_spelling_suggestion(self, query_string):
         spelling_suggestion = None
         reader = self.index.reader()
@@ -907,6 +1172,46 @@ class WhooshSearchBackend(BaseSearchBackend):
 
 
 class WhooshSearchQuery(BaseSearchQuery):
+    def __init__(self, using=DEFAULT_ALIAS):
+        super().__init__(using=using)
+        self._partial = False
+        self._estimated_hits = None
+
+    def run(self, spelling_query=None, **kwargs):
+        """
+        执行查询，并记录结果是否因超出时间预算而不完整
+
+        SearchQuerySet 在结果不足时会按偏移继续请求后续结果，
+        查询已超出时间预算后不再重复搜索，只返回空结果，避免同一请求内多次耗尽时间预算
+        """
+        if self._partial:
+            self._results = []
+            self._hit_count = self._estimated_hits
+            return
+
+        final_query = self.build_query()
+        search_kwargs = self.build_params(spelling_query=spelling_query)
+
+        if kwargs:
+            search_kwargs.update(kwargs)
+
+        results = self.backend.search(final_query, **search_kwargs)
+        self._results = results.get("results", [])
+        self._hit_count = results.get("hits", 0)
+        self._facet_counts = self.post_process_facets(results)
+        self._spelling_suggestion = results.get("spelling_suggestion", None)
+        if results.get("partial"):
+            self._partial = True
+            self._estimated_hits = self._hit_count
+
+    def is_partial(self):
+        """查询是否超出时间预算，只得到了部分结果"""
+        return self._partial
+
+    def estimated_hits(self):
+        """超出时间预算时估算的命中总数，结果完整时为 None"""
+        return self._estimated_hits
+
     def _convert_datetime(self, date):
         if hasattr(date, "hour"):
             return force_str(date.strftime("%Y%m%d%H%M%S"))
@@ -5,9 +5,34 @@
 # 搜索工具函数
 
 import time
-from datetime import datetime, timedelta
-from django.db.models import Count, Q
-from app_doc.models_search import SearchLog, SearchHotKeyword, SearchSynonym
+from datetime import date, datetime, timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Count, F, FloatField, Max, Q, Sum, Value, When
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from app_doc.models_search import (
+    SearchLog, SearchHotKeyword, SearchKeywordDaily, SearchRollupState
+)
+from app_doc.search import log_buffer, suggest_trie, synonyms
+from whoosh import query as whoosh_query
+
+
+# 热门搜索词使用的汇总进度名称
+HOT_KEYWORD_ROLLUP = 'hot_keywords'
+
+
+def narrow_to_projects(sqs, project_ids):
+    """
+    将全文搜索限定在指定文集内
+
+    文集ID去重排序后生成过滤查询（narrow），相同权限范围的请求得到相同的过滤语句，
+    搜索后端按索引代数缓存其匹配的文档集合，不再每次解析并执行庞大的 top_doc OR 查询
+    """
+    project_ids = sorted({int(i) for i in project_ids})
+    if not project_ids:
+        return sqs.filter(top_doc__in=None)
+    return sqs.narrow('top_doc:({})'.format(' OR '.join(str(i) for i in project_ids)))
 
 
 def log_search(query_text, user=None, ip_address=None, results_count=0,
@@ -15,6 +40,9 @@ def log_search(query_text, user=None, ip_address=None, results_count=0,
     """
     记录搜索日志
 
+    日志先加入缓冲区，由后台线程批量写入数据库，搜索请求不等待写库；
+    关闭缓冲（SEARCH_LOG_BUFFER = False）时同步写入
+
     Args:
         query_text: 搜索词
         user: 搜索用户（可选）
@@ -25,10 +53,10 @@ def log_search(query_text, user=None, ip_address=None, results_count=0,
         elapsed_time: 搜索耗时（毫秒）
 
     Returns:
-        SearchLog 实例
+        SearchLog 实例（使用缓冲时尚未保存）
     """
     try:
-        search_log = SearchLog.objects.create(
+        search_log = SearchLog(
             query_text=query_text[:500],  # 限制长度
             user=user if user and user.is_authenticated else None,
             ip_address=ip_address,
@@ -37,16 +65,92 @@ def log_search(query_text, user=None, ip_address=None, results_count=0,
             search_field=search_field,
             elapsed_time=elapsed_time,
         )
+        if log_buffer.is_enabled():
+            log_buffer.append(search_log)
+        else:
+            search_log.save()
         return search_log
     except Exception as e:
         print(f"记录搜索日志失败: {e}")
         return None
 
 
+def rollup_search_logs(batch_size=5000):
+    """
+    将上次汇总之后新增的搜索日志累加到每日计数表
+
+    按搜索日志ID记录汇总进度，每次只读取新增的日志，由数据库按 搜索词+日期 分组计数。
+    ID在插入时分配、提交可能较晚：多个进程各自批量写入日志时，较小ID的日志可能在较大ID的日志之后提交，
+    因此汇总进度只推进到早于 SEARCH_LOG_ROLLUP_DELAY 秒的日志，之前分配ID的日志此时都已提交
+
+    Args:
+        batch_size: 每批处理的日志ID范围
+
+    Returns:
+        本次汇总的日志数量
+    """
+    state, _ = SearchRollupState.objects.get_or_create(name=HOT_KEYWORD_ROLLUP)
+    last_id = state.last_log_id
+    cutoff = timezone.now() - timedelta(seconds=getattr(settings, 'SEARCH_LOG_ROLLUP_DELAY', 300))
+    max_id = SearchLog.objects.filter(id__gt=last_id, created_at__lte=cutoff).aggregate(
+        max_id=Max('id')
+    )['max_id'] or 0
+    total = 0
+
+    while last_id < max_id:
+        upper = min(last_id + batch_size, max_id)
+        logs = SearchLog.objects.filter(id__gt=last_id, id__lte=upper)
+        rows = logs.exclude(query_text='').annotate(
+            day=TruncDate('created_at')
+        ).values('query_text', 'day').annotate(
+            count=Count('id'),
+            last=Max('created_at'),
+        )
+        rows = {(row['query_text'], row['day']): row for row in rows}
+        batch_count = sum(row['count'] for row in rows.values())
+
+        with transaction.atomic():
+            # 先推进汇总进度：同时运行的另一个汇总已处理过这批日志时放弃，避免重复计数
+            advanced = SearchRollupState.objects.filter(
+                id=state.id, last_log_id=last_id
+            ).update(last_log_id=upper)
+            if not advanced:
+                return total
+            existing = SearchKeywordDaily.objects.filter(
+                query_text__in={key[0] for key in rows},
+                day__in={key[1] for key in rows},
+            )
+            to_update = []
+            for daily in existing:
+                row = rows.pop((daily.query_text, daily.day), None)
+                if row is None:
+                    continue
+                daily.search_count += row['count']
+                daily.last_searched_at = max(daily.last_searched_at, row['last'])
+                to_update.append(daily)
+            SearchKeywordDaily.objects.bulk_update(to_update, ['search_count', 'last_searched_at'])
+            SearchKeywordDaily.objects.bulk_create([
+                SearchKeywordDaily(
+                    query_text=query_text, day=day,
+                    search_count=row['count'], last_searched_at=row['last'],
+                )
+                for (query_text, day), row in rows.items()
+            ])
+        total += batch_count
+        last_id = upper
+
+    return total
+
+
 def update_hot_keywords(days=7, min_count=2):
     """
     更新热门搜索词
 
+    先增量汇总新增的搜索日志，再基于每日计数表计算最近N天的热门搜索词，
+    耗时只与新增日志数量和计数表大小有关，与统计时间范围内的日志总量无关
+
+    热度分数为各天搜索次数按时间线性衰减后的和：当天权重为 1，N-1 天前为 1/N
+
     Args:
         days: 统计最近N天的数据
         min_count: 最小搜索次数
@@ -55,50 +159,55 @@ def update_hot_keywords(days=7, min_count=2):
         更新的关键词数量
     """
     try:
+        rollup_search_logs()
+
         # 计算时间范围
-        start_date = datetime.now() - timedelta(days=days)
-
-        # 聚合搜索日志
-        keyword_stats = SearchLog.objects.filter(
-            created_at__gte=start_date,
-            query_text__isnull=False
-        ).exclude(
-            query_text=''
+        start_day = date.today() - timedelta(days=days - 1)
+        weight = Case(
+            *[When(day=start_day + timedelta(days=i), then=Value((i + 1) / days)) for i in range(days)],
+            default=Value(0.0),
+            output_field=FloatField(),
+        )
+
+        # 聚合每日计数，只保留前100个
+        keyword_stats = SearchKeywordDaily.objects.filter(
+            day__gte=start_day,
         ).values('query_text').annotate(
-            count=Count('id')
+            count=Sum('search_count'),
+            last=Max('last_searched_at'),
+            score=Sum(F('search_count') * weight, output_field=FloatField()),
         ).filter(
             count__gte=min_count
-        ).order_by('-count')[:100]  # 只保留前100个
-
-        updated_count = 0
-        for stat in keyword_stats:
-            keyword = stat['query_text']
-            count = stat['count']
-
-            # 计算热度分数（基于搜索次数和时间衰减）
-            # 简单算法：count * (1 - 衰减系数)
-            # 衰减系数 = (当前时间 - 最后搜索时间) / 总时间范围
-            last_log = SearchLog.objects.filter(
-                query_text=keyword
-            ).order_by('-created_at').first()
-
-            if last_log:
-                time_diff = (datetime.now() - last_log.created_at.replace(tzinfo=None)).total_seconds()
-                decay_factor = max(0, 1 - (time_diff / (days * 86400)))  # 86400秒 = 1天
-                hot_score = count * decay_factor
-
-                # 更新或创建热门关键词
-                hot_keyword, created = SearchHotKeyword.objects.update_or_create(
+        ).order_by('-count')[:100]
+
+        # 关键词字段长度有限，过长的搜索词不计入热门
+        max_length = SearchHotKeyword._meta.get_field('keyword').max_length
+        keyword_stats = {stat['query_text']: stat for stat in keyword_stats if len(stat['query_text']) <= max_length}
+
+        # 批量更新已有关键词、创建新关键词
+        now = datetime.now()
+        hot_keywords = list(SearchHotKeyword.objects.filter(keyword__in=keyword_stats))
+        for hot_keyword in hot_keywords:
+            stat = keyword_stats.pop(hot_keyword.keyword)
+            hot_keyword.search_count = stat['count']
+            hot_keyword.hot_score = stat['score']
+            hot_keyword.last_searched_at = stat['last']
+            hot_keyword.updated_at = now
+        with transaction.atomic():
+            SearchHotKeyword.objects.bulk_update(
+                hot_keywords, ['search_count', 'hot_score', 'last_searched_at', 'updated_at']
+            )
+            SearchHotKeyword.objects.bulk_create([
+                SearchHotKeyword(
                     keyword=keyword,
-                    defaults={
-                        'search_count': count,
-                        'hot_score': hot_score,
-                        'last_searched_at': last_log.created_at,
-                    }
+                    search_count=stat['count'],
+                    hot_score=stat['score'],
+                    last_searched_at=stat['last'],
                 )
-                updated_count += 1
+                for keyword, stat in keyword_stats.items()
+            ])
 
-        return updated_count
+        return len(hot_keywords) + len(keyword_stats)
     except Exception as e:
         print(f"更新热门搜索词失败: {e}")
         return 0
@@ -132,7 +241,7 @@ def get_hot_keywords(limit=10):
 def get_search_suggestions(query, limit=5):
     """
     获取搜索建议
-    基于历史搜索和热门关键词
+    基于热门搜索词、公开文集名称和文档标题的前缀匹配，查询进程内的前缀树，不访问数据库
 
     Args:
         query: 用户输入的查询词
@@ -141,69 +250,30 @@ def get_search_suggestions(query, limit=5):
     Returns:
         建议列表
     """
-    if not query or len(query.strip()) == 0:
-        # 返回热门搜索词
-        return [kw['keyword'] for kw in get_hot_keywords(limit)]
-
     try:
-        # 前缀匹配热门关键词
-        suggestions = SearchHotKeyword.objects.filter(
-            keyword__istartswith=query
-        ).order_by('-hot_score')[:limit]
-
-        result = [kw.keyword for kw in suggestions]
-
-        # 如果结果不足，从搜索日志中补充
-        if len(result) < limit:
-            additional = SearchLog.objects.filter(
-                query_text__icontains=query
-            ).values('query_text').annotate(
-                count=Count('id')
-            ).order_by('-count')[:limit - len(result)]
-
-            result.extend([item['query_text'] for item in additional])
-
-        return result[:limit]
+        return suggest_trie.suggest(query, limit)
     except Exception as e:
         print(f"获取搜索建议失败: {e}")
         return []
 
 
-def expand_query_with_synonyms(query):
+def expand_query_with_synonyms(query, fieldname='text'):
     """
     使用同义词扩展查询
+    同义词从进程内缓存的同义词字典中查找，不再逐词查询数据库
 
     Args:
         query: 原始查询词
+        fieldname: 查询的字段
 
     Returns:
-        扩展后的查询字符串
+        扩展后的 Whoosh 查询树，有同义词的词扩展为 Or([原词, 同义词...])
     """
     try:
-        # 分词
-        import jieba
-        terms = list(jieba.cut(query))
-
-        # 查找同义词
-        expanded_terms = []
-        for term in terms:
-            expanded_terms.append(term)
-
-            # 查找该词的同义词
-            synonyms = SearchSynonym.objects.filter(
-                word=term,
-                is_active=True
-            ).first()
-
-            if synonyms:
-                expanded_terms.extend(synonyms.get_synonym_list())
-
-        # 去重并返回
-        unique_terms = list(set(expanded_terms))
-        return ' OR '.join(unique_terms)
+        return synonyms.expand_query(query, fieldname)
     except Exception as e:
         print(f"扩展查询失败: {e}")
-        return query
+        return whoosh_query.Term(fieldname, query)
 
 
 def get_client_ip(request):
@@ -0,0 +1,142 @@
+# coding:utf-8
+# @文件: signals.py
+# 文档模型信号处理
+
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from loguru import logger
+
+from app_doc import access_scope, doc_path, project_toc
+from app_doc.models import Doc, Project, ProjectCollaborator
+from app_doc.models_search import SearchSynonym
+from app_doc.search import index_queue, trigram_index, synonyms
+
+
+# 文档保存后更新内容三元组索引（启用索引更新队列时由队列统一更新）
+@receiver(post_save, sender=Doc)
+def doc_saved(sender, instance, **kwargs):
+    if not trigram_index.is_enabled() or index_queue.is_enabled():
+        return
+    try:
+        trigram_index.index_doc(instance)
+    except Exception:
+        logger.exception("更新文档三元组索引异常")
+
+
+# 文档删除后移除内容三元组索引（启用索引更新队列时由队列统一更新）
+@receiver(post_delete, sender=Doc)
+def doc_deleted(sender, instance, **kwargs):
+    if not trigram_index.is_enabled() or index_queue.is_enabled():
+        return
+    try:
+        trigram_index.remove_doc(instance.id)
+    except Exception:
+        logger.exception("删除文档三元组索引异常")
+
+
+# 文档保存前记录原有的目录字段，用于判断文集目录和上级文档是否变化；
+# 文档从数据库读取时已记录原有字段值（Doc.from_db），只有字段未读取时才查询
+@receiver(pre_save, sender=Doc)
+def doc_pre_save(sender, instance, update_fields=None, **kwargs):
+    instance._toc_old = None
+    if update_fields is not None and not set(update_fields) & set(project_toc.TOC_FIELDS):
+        return
+    if instance.pk:
+        loaded = getattr(instance, '_loaded_values', {})
+        if all(field in loaded for field in project_toc.TOC_FIELDS):
+            instance._toc_old = {field: loaded[field] for field in project_toc.TOC_FIELDS}
+        else:
+            instance._toc_old = Doc.objects.filter(pk=instance.pk).values(*project_toc.TOC_FIELDS).first()
+
+
+# 新建、发布、改名、排序、移动已发布的文档后失效文集目录，只修改内容或草稿时不失效
+@receiver(post_save, sender=Doc)
+def doc_toc_saved(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and not set(update_fields) & set(project_toc.TOC_FIELDS):
+        return
+    old = getattr(instance, '_toc_old', None)
+    published = str(instance.status) == '1'
+    if created or old is None:
+        if published:
+            project_toc.invalidate(instance.top_doc, doc_ids=[instance.id])
+        return
+    if old['status'] != 1 and not published:
+        return
+    if any(str(old[field]) != str(getattr(instance, field)) for field in project_toc.TOC_FIELDS):
+        project_toc.invalidate(old['top_doc'], instance.top_doc, doc_ids=[instance.id])
+
+
+# 新建文档后生成层级路径，修改上级文档后更新文档及其下级文档的路径
+@receiver(post_save, sender=Doc)
+def doc_path_saved(sender, instance, created, update_fields=None, **kwargs):
+    if created:
+        try:
+            path = doc_path.make_path(doc_path.get_path(instance.parent_doc) if instance.parent_doc else '', instance.id)
+        except ValueError:
+            logger.warning("文档{}的层级过深，未生成层级路径".format(instance.id))
+            return
+        Doc.objects.filter(pk=instance.pk).update(path=path)
+        instance.path = path
+        return
+    old = getattr(instance, '_toc_old', None)
+    # 保存后的字段值作为下一次保存时的原有值
+    if hasattr(instance, '_loaded_values'):
+        fields = project_toc.TOC_FIELDS if update_fields is None else set(project_toc.TOC_FIELDS) & set(update_fields)
+        instance._loaded_values.update({field: getattr(instance, field) for field in fields})
+    if old is not None and str(old['parent_doc']) != str(instance.parent_doc):
+        doc_path.refresh_doc(instance.id)
+        instance.path = doc_path.get_path(instance.id)
+
+
+@receiver(post_delete, sender=Doc)
+def doc_toc_deleted(sender, instance, **kwargs):
+    if str(instance.status) == '1':
+        project_toc.invalidate(instance.top_doc, doc_ids=[instance.id])
+
+
+# 文集保存前记录原有的权限和创建者，用于判断可访问范围是否变化
+@receiver(pre_save, sender=Project)
+def project_pre_save(sender, instance, **kwargs):
+    instance._access_scope_old = None
+    if instance.pk:
+        instance._access_scope_old = Project.objects.filter(pk=instance.pk).values_list(
+            'role', 'create_user_id'
+        ).first()
+
+
+# 文集新建、权限或创建者变化后失效可访问文集缓存
+@receiver(post_save, sender=Project)
+def project_saved(sender, instance, created, **kwargs):
+    old = getattr(instance, '_access_scope_old', None)
+    if created or old is None:
+        access_scope.invalidate_public()
+        access_scope.invalidate_user(instance.create_user_id)
+        return
+    old_role, old_user_id = old
+    if old_role != instance.role:
+        access_scope.invalidate_public()
+    if old_user_id != instance.create_user_id:
+        access_scope.invalidate_user(old_user_id, instance.create_user_id)
+
+
+@receiver(post_delete, sender=Project)
+def project_deleted(sender, instance, **kwargs):
+    access_scope.invalidate_public()
+    access_scope.invalidate_user(instance.create_user_id)
+
+
+# 协作成员增删改后失效该成员的可访问文集缓存
+@receiver(post_save, sender=ProjectCollaborator)
+@receiver(post_delete, sender=ProjectCollaborator)
+def project_collaborator_changed(sender, instance, **kwargs):
+    access_scope.invalidate_user(instance.user_id)
+
+
+# 同义词修改后更新版本号，各进程重新加载同义词
+@receiver(post_save, sender=SearchSynonym)
+@receiver(post_delete, sender=SearchSynonym)
+def search_synonym_changed(sender, instance, **kwargs):
+    try:
+        synonyms.bump_version()
+    except Exception:
+        logger.exception("更新同义词版本异常")
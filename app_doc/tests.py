@@ -1,3 +1,1410 @@
-from django.test import TestCase
+import datetime
+import os
+import queue
+import random
+import re
+import shutil
+import tempfile
+from contextlib import contextmanager
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import CommandError
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.html import strip_tags
+from django.utils.module_loading import import_string
+from haystack import connections as haystack_connections
+from haystack.query import SearchQuerySet
+import jieba
+
+from app_doc import doc_path, doc_tree, project_toc, search_utils
+from app_doc.models import AccessScopeVersion, Doc, Project, ProjectToc
+from app_doc.models_search import (
+    SearchHotKeyword, SearchIndexQueue, SearchKeywordDaily, SearchLog, SearchRollupState, SearchSynonym
+)
+from app_doc.search import (
+    index_queue, log_buffer, parallel_index, result_cache, searcher_pool, shards, synonyms, token_cache,
+    trigram_index,
+)
+from app_doc.search.chinese_analyzer import ChineseTokenizer
+from app_doc.search.highlight import MyHighLighter, get_analyzer, get_query_words
+from app_doc.search.whoosh_cn_backend import BudgetCollector
+
+
+class DocTestMixin:
+    """创建测试用户、文集和文档"""
+
+    def setUp(self):
+        super().setUp()
+        # 缓存不随测试事务回滚，清空上一个测试留下的缓存
+        cache.clear()
+        # 索引更新队列只写入队列表，不启动后台线程
+        queue_settings = override_settings(SEARCH_INDEX_QUEUE_THREAD=False)
+        queue_settings.enable()
+        self.addCleanup(queue_settings.disable)
+        self.user = User.objects.create_user('tester', password='password')
+        self.project = self.create_project()
+
+    def create_project(self, **kwargs):
+        kwargs.setdefault('name', '测试文集')
+        kwargs.setdefault('intro', '')
+        return Project.objects.create(create_user=self.user, **kwargs)
+
+    def create_doc(self, name, parent=None, project=None, **kwargs):
+        kwargs.setdefault('status', 1)
+        kwargs.setdefault('pre_content', name)
+        kwargs.setdefault('content', name)
+        return Doc.objects.create(
+            name=name,
+            parent_doc=parent.id if parent else 0,
+            top_doc=(project or self.project).id,
+            create_user=self.user,
+            **kwargs
+        )
+
+    def create_chain(self, depth, project=None):
+        """创建 depth 层的文档链，每层附带一个同级文档"""
+        chain = []
+        for level in range(depth):
+            parent = chain[-1] if chain else None
+            chain.append(self.create_doc('L{}'.format(level), parent, project))
+            self.create_doc('S{}'.format(level), parent, project)
+        return chain
+
+
+class DocPathTest(DocTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def assertPathsConsistent(self):
+        for pro_id in set(Doc.objects.values_list('top_doc', flat=True)):
+            rows = list(Doc.objects.filter(top_doc=pro_id).values_list('id', 'parent_doc', 'path'))
+            expected = doc_path.build_paths([(doc_id, parent_id) for doc_id, parent_id, path in rows])
+            self.assertEqual({doc_id: path for doc_id, parent_id, path in rows}, expected)
+
+    def test_create_sets_path(self):
+        chain = self.create_chain(5)
+        chain[-1].refresh_from_db()
+        self.assertEqual(chain[-1].path, '/' + ''.join('{}/'.format(d.id) for d in chain))
+        self.assertPathsConsistent()
+
+    def test_move_subtree_moves_all_levels_and_refreshes_index_once(self):
+        chain = self.create_chain(6)
+        target = self.create_project(name='目标文集')
+        subtree_ids = set(Doc.objects.filter(path__startswith=Doc.objects.get(id=chain[1].id).path).values_list('id', flat=True))
+        with mock.patch('app_doc.views.refresh_doc_index') as refresh:
+            resp = self.client.post('/move_doc/', {
+                'doc_id': chain[1].id, 'pro_id': target.id, 'parent_id': '0', 'move_type': '2'
+            })
+        self.assertTrue(resp.json()['status'])
+        self.assertEqual(set(Doc.objects.filter(top_doc=target.id).values_list('id', flat=True)), subtree_ids)
+        self.assertEqual(Doc.objects.get(id=chain[1].id).parent_doc, 0)
+        refresh.assert_called_once()
+        self.assertEqual(set(refresh.call_args[0][0]), subtree_ids)
+        self.assertPathsConsistent()
+
+    def test_move_into_own_subtree_is_rejected(self):
+        chain = self.create_chain(4)
+        resp = self.client.post('/move_doc/', {
+            'doc_id': chain[1].id, 'pro_id': self.project.id, 'parent_id': chain[3].id, 'move_type': '2'
+        })
+        self.assertFalse(resp.json()['status'])
+        self.assertEqual(Doc.objects.get(id=chain[1].id).parent_doc, chain[0].id)
+        self.assertPathsConsistent()
+
+    def test_move_only_doc_lifts_children(self):
+        chain = self.create_chain(4)
+        resp = self.client.post('/move_doc/', {
+            'doc_id': chain[1].id, 'pro_id': self.project.id, 'parent_id': '0', 'move_type': '1'
+        })
+        self.assertTrue(resp.json()['status'])
+        self.assertEqual(Doc.objects.get(id=chain[2].id).parent_doc, 0)
+        self.assertFalse(Doc.objects.filter(parent_doc=chain[1].id).exists())
+        self.assertPathsConsistent()
+
+    def test_copy_subtree_skips_recycle_bin(self):
+        chain = self.create_chain(4)
+        trash = self.create_doc('回收站', chain[1], status=3)
+        self.create_doc('回收站下级', trash)
+        draft = self.create_doc('草稿', chain[2], status=0)
+        source_count = Doc.objects.filter(
+            path__startswith=Doc.objects.get(id=chain[1].id).path, status__in=[0, 1]
+        ).exclude(parent_doc=trash.id).count()
+        with mock.patch('app_doc.views.refresh_doc_index') as refresh:
+            resp = self.client.post('/move_doc/', {
+                'doc_id': chain[1].id, 'pro_id': self.project.id, 'parent_id': chain[0].id, 'move_type': '3'
+            })
+        data = resp.json()
+        self.assertTrue(data['status'])
+        copy = Doc.objects.get(id=data['data']['doc_id'])
+        copies = Doc.objects.filter(path__startswith=copy.path)
+        self.assertEqual(copy.parent_doc, chain[0].id)
+        self.assertEqual(copies.count(), source_count)
+        self.assertEqual(copies.filter(status=0, name=draft.name).count(), 1)
+        self.assertFalse(copies.filter(name__startswith='回收站').exists())
+        self.assertEqual(set(refresh.call_args[0][0]), set(copies.values_list('id', flat=True)))
+        self.assertPathsConsistent()
+
+    def test_delete_subtree_refreshes_index(self):
+        chain = self.create_chain(5)
+        subtree_ids = set(Doc.objects.filter(path__startswith=Doc.objects.get(id=chain[1].id).path).values_list('id', flat=True))
+        with mock.patch('app_doc.views.refresh_doc_index') as refresh:
+            resp = self.client.post('/del_doc/', {'doc_id': chain[1].id})
+        self.assertTrue(resp.json()['status'])
+        self.assertEqual(set(Doc.objects.filter(status=3).values_list('id', flat=True)), subtree_ids)
+        refresh.assert_called_once()
+        self.assertEqual(set(refresh.call_args[0][0]), subtree_ids)
+
+    def test_save_with_new_parent_updates_subtree(self):
+        chain = self.create_chain(4)
+        doc = Doc.objects.get(id=chain[2].id)
+        doc.parent_doc = 0
+        doc.save()
+        self.assertEqual(Doc.objects.get(id=chain[3].id).path, '/{}/{}/'.format(chain[2].id, chain[3].id))
+        self.assertPathsConsistent()
+
+    def test_save_with_update_fields_does_not_overwrite_path(self):
+        chain = self.create_chain(3)
+        doc = Doc.objects.get(id=chain[2].id)
+        # 读取后上级文档被移动，视图只保存修改的字段，不写回旧路径
+        doc_path.move_subtree(Doc.objects.get(id=chain[1].id), 0, self.project.id)
+        doc.pre_content = '修改内容'
+        with CaptureQueriesContext(connection) as queries:
+            doc.save(update_fields=['pre_content', 'modify_time'])
+        self.assertFalse([q for q in queries.captured_queries if q['sql'].startswith('SELECT') and 'app_doc_doc' in q['sql']])
+        self.assertPathsConsistent()
+
+    def test_modify_doc_view_moves_doc(self):
+        chain = self.create_chain(3)
+        other = self.create_doc('新的上级文档')
+        resp = self.client.post('/modify_doc/{}/'.format(chain[1].id), {
+            'doc_id': chain[1].id, 'project': self.project.id, 'parent_doc': other.id,
+            'doc_name': '修改后的标题', 'pre_content': '内容', 'content': '内容', 'sort': 1,
+            'editor_mode': 1, 'status': 1,
+        })
+        self.assertTrue(resp.json()['status'])
+        doc = Doc.objects.get(id=chain[2].id)
+        self.assertEqual(doc.path, '/{}/{}/{}/'.format(other.id, chain[1].id, chain[2].id))
+        self.assertPathsConsistent()
+
+    def test_too_deep_path_is_not_truncated(self):
+        rows = [(1000000 + i, 1000000 + i - 1 if i else 0) for i in range(100)]
+        paths = doc_path.build_paths(rows)
+        self.assertTrue(all(len(path) <= doc_path.PATH_MAX_LENGTH for path in paths.values()))
+        self.assertEqual(paths[rows[-1][0]], '')
+        self.assertEqual(paths[rows[0][0]], '/1000000/')
+        with self.assertRaises(ValueError):
+            doc_path.make_path('/' + '1234567/' * 70, 1)
+
+
+class AccessScopeTest(DocTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.other = User.objects.create_user('other', password='password')
+
+    def test_project_role_change_invalidates_public_scope(self):
+        from django.contrib.auth.models import AnonymousUser
+        from app_doc import access_scope
+        self.assertIn(self.project.id, access_scope.get_visible_project_ids(AnonymousUser()))
+        self.project.role = 1
+        self.project.save()
+        self.assertNotIn(self.project.id, access_scope.get_visible_project_ids(AnonymousUser()))
+        self.assertIn(self.project.id, access_scope.get_visible_project_ids(self.user))
+
+    def test_version_in_database_invalidates_other_process_cache(self):
+        from django.db.models import F
+        from app_doc import access_scope
+        from app_doc.models import AccessScopeVersion
+        self.assertIn(self.project.id, access_scope.get_public_project_ids())
+        # 模拟其他进程修改文集权限并增加版本号，本进程的缓存没有被删除
+        Project.objects.filter(id=self.project.id).update(role=1)
+        AccessScopeVersion.objects.filter(key=access_scope.PUBLIC_VERSION_KEY).update(version=F('version') + 1)
+        self.assertNotIn(self.project.id, access_scope.get_public_project_ids())
+
+    def test_collaborator_removed(self):
+        from app_doc import access_scope
+        from app_doc.models import ProjectCollaborator
+        private = self.create_project(name='私密文集', role=1)
+        colla = ProjectCollaborator.objects.create(project=private, user=self.other, role=1)
+        self.assertIn(private.id, access_scope.get_visible_project_ids(self.other))
+        self.assertIn(private.id, access_scope.get_editable_project_ids(self.other))
+        colla.delete()
+        self.assertNotIn(private.id, access_scope.get_visible_project_ids(self.other))
+
+    def test_deleted_project(self):
+        from django.contrib.auth.models import AnonymousUser
+        from app_doc import access_scope
+        self.assertIn(self.project.id, access_scope.get_visible_project_ids(AnonymousUser()))
+        project_id = self.project.id
+        self.project.delete()
+        self.assertNotIn(project_id, access_scope.get_visible_project_ids(AnonymousUser()))
+        self.assertNotIn(project_id, access_scope.get_own_project_ids(self.user))
+
+
+class ScanEngineTest(DocTestMixin, TestCase):
+
+    def test_broken_pool_falls_back_to_serial_scan(self):
+        from concurrent.futures import Future
+        from concurrent.futures.process import BrokenProcessPool
+        from app_doc.search import scan_engine
+
+        docs = [self.create_doc('文档{}'.format(i), pre_content='第一行\n匹配 foo{}\n'.format(i), content='') for i in range(5)]
+        pattern = re.compile('foo')
+        expected = list(scan_engine.iter_serial_matches(
+            Doc.objects.filter(id__in=[d.id for d in docs]).order_by('id'), pattern, 0, 0, 100
+        ))
+
+        class BrokenExecutor:
+            """第一个分块正常返回，之后工作进程崩溃"""
+            submitted = 0
+
+            def submit(self, fn, *args):
+                future = Future()
+                if self.submitted:
+                    future.set_exception(BrokenProcessPool('worker died'))
+                else:
+                    future.set_result(fn(*args))
+                self.submitted += 1
+                return future
+
+        with self.settings(SEARCH_SCAN_WORKERS=2), \
+                mock.patch.object(scan_engine, '_get_executor', return_value=BrokenExecutor()), \
+                mock.patch.object(scan_engine, 'MIN_CHUNK_SIZE', 2):
+            results = list(scan_engine.iter_parallel_matches([d.id for d in docs], pattern, 0, 0, 100))
+        self.assertEqual(results, expected)
+        self.assertEqual(len(results), 5)
+
+
+@override_settings(SEARCH_INDEX_QUEUE=True)
+class IndexQueueTest(DocTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.doc = self.create_doc('队列文档')
+        SearchIndexQueue.objects.all().delete()
+
+    def test_enqueue_coalesces_repeated_changes(self):
+        index_queue.enqueue(Doc, [self.doc.id])
+        first = SearchIndexQueue.objects.get()
+        index_queue.enqueue(Doc, [self.doc.id, str(self.doc.id)])
+        item = SearchIndexQueue.objects.get()
+        self.assertEqual(item.created_at, first.created_at)
+        self.assertGreater(item.updated_at, first.updated_at)
+
+    def test_process_keeps_items_changed_during_apply(self):
+        other = self.create_doc('另一篇文档')
+        SearchIndexQueue.objects.all().delete()
+        index_queue.enqueue(Doc, [self.doc.id, other.id])
+
+        def apply_objects(model, object_ids, using='default'):
+            # 写入索引期间文档再次被修改
+            index_queue.enqueue(Doc, [self.doc.id])
+
+        with mock.patch.object(index_queue, 'apply_objects', side_effect=apply_objects) as apply:
+            self.assertEqual(index_queue.process_queue(force=True), 2)
+        self.assertEqual(set(apply.call_args[0][1]), {self.doc.id, other.id})
+        self.assertEqual(list(SearchIndexQueue.objects.values_list('object_id', flat=True)), [self.doc.id])
+
+    def test_claimed_items_are_skipped_by_other_processes(self):
+        index_queue.enqueue(Doc, [self.doc.id])
+        claimed = index_queue._claim_items(force=True)
+        self.assertEqual([item.object_id for item in claimed], [self.doc.id])
+        # 另一个进程在记录处理完成前不会再次取出
+        self.assertEqual(index_queue._claim_items(force=True), [])
+        with mock.patch.object(index_queue, 'apply_objects'):
+            self.assertEqual(index_queue.process_queue(force=True), 0)
+        self.assertTrue(SearchIndexQueue.objects.exists())
+
+    def test_failing_object_backs_off_and_is_dead_lettered(self):
+        other = self.create_doc('另一篇文档')
+        SearchIndexQueue.objects.all().delete()
+        index_queue.enqueue(Doc, [self.doc.id, other.id])
+
+        def apply_objects(model, object_ids, using='default'):
+            if self.doc.id in object_ids:
+                raise ValueError('索引写入失败')
+
+        with override_settings(SEARCH_INDEX_QUEUE_MAX_ATTEMPTS=2, SEARCH_INDEX_QUEUE_RETRY_DELAY=60), \
+                mock.patch.object(index_queue, 'apply_objects', side_effect=apply_objects):
+            self.assertEqual(index_queue.process_queue(force=True), 2)
+            # 同一批中的其他对象正常写入，失败的对象等待重试
+            item = SearchIndexQueue.objects.get()
+            self.assertEqual((item.object_id, item.attempts, item.failed), (self.doc.id, 1, False))
+            self.assertIn('索引写入失败', item.last_error)
+            self.assertGreater(item.next_attempt_at, datetime.datetime.now() + datetime.timedelta(seconds=50))
+            self.assertEqual(index_queue.process_queue(force=True), 0)
+
+            SearchIndexQueue.objects.update(next_attempt_at=None)
+            self.assertEqual(index_queue.process_queue(force=True), 1)
+            item = SearchIndexQueue.objects.get()
+            self.assertEqual((item.attempts, item.failed), (2, True))
+            # 放弃重试的记录不再处理，也不阻塞新的记录
+            index_queue.enqueue(Doc, [other.id])
+            self.assertEqual(index_queue.process_queue(force=True), 1)
+            self.assertEqual(list(SearchIndexQueue.objects.values_list('object_id', flat=True)), [self.doc.id])
+
+        # 对象再次修改后重新处理
+        index_queue.enqueue(Doc, [self.doc.id])
+        item = SearchIndexQueue.objects.get()
+        self.assertEqual((item.attempts, item.failed, item.next_attempt_at), (0, False, None))
+        with mock.patch.object(index_queue, 'apply_objects'):
+            self.assertEqual(index_queue.process_queue(force=True), 1)
+        self.assertFalse(SearchIndexQueue.objects.exists())
+
+    def test_pending_items_resume_worker_on_first_request(self):
+        index_queue.enqueue(Doc, [self.doc.id])
+        with override_settings(SEARCH_INDEX_QUEUE_THREAD=True), \
+                mock.patch.object(index_queue, '_resumed', False), \
+                mock.patch.object(index_queue, 'ensure_worker') as ensure_worker:
+            self.client.get('/')
+            self.client.get('/')
+        ensure_worker.assert_called_once()
+
+    def test_empty_queue_does_not_start_worker(self):
+        with override_settings(SEARCH_INDEX_QUEUE_THREAD=True), \
+                mock.patch.object(index_queue, '_resumed', False), \
+                mock.patch.object(index_queue, 'ensure_worker') as ensure_worker:
+            index_queue.resume_pending()
+        ensure_worker.assert_not_called()
+
+
+class ProjectTocTest(DocTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        # 进程内目录缓存按 (目录记录ID, 版本号) 判断，测试回滚后记录ID会重复
+        project_toc._cache.clear()
+        self.addCleanup(project_toc._cache.clear)
+
+    def assertTocCurrent(self, pro_id=None, incremental=True):
+        pro_id = pro_id or self.project.id
+        with mock.patch.object(project_toc, 'build_toc', wraps=project_toc.build_toc) as build:
+            toc, count, version = project_toc.get_toc(pro_id)
+            order, index, previous_id, next_id = project_toc.get_doc_position(pro_id, 0)
+        expected, expected_count = project_toc.build_toc(pro_id)
+        self.assertEqual(toc, expected)
+        self.assertEqual(count, expected_count)
+        self.assertEqual(order, project_toc.get_reading_order(expected))
+        if incremental:
+            build.assert_not_called()
+        return version
+
+    def test_toc_json_etag(self):
+        chain = self.create_chain(2)
+        url = '/project-{}/toc/'.format(self.project.id)
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()['total'], 4)
+        etag = resp['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # 只修改内容不改变目录，ETag 不变
+        with self.captureOnCommitCallbacks(execute=True):
+            Doc.objects.filter(id=chain[0].id).update(pre_content='只修改内容')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_doc('新文档', chain[1])
+        resp = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotEqual(resp['ETag'], etag)
+        self.assertEqual(resp.json()['total'], 5)
+
+    def test_toc_json_status_codes(self):
+        private = self.create_project(name='私密文集', role=1)
+        self.assertEqual(self.client.get('/project-{}/toc/'.format(private.id)).status_code, 403)
+        self.assertEqual(self.client.get('/project-{}/toc/'.format(private.id + 100)).status_code, 404)
+
+    def test_one_toc_row_per_project(self):
+        version = project_toc.get_version(self.project.id)
+        self.assertEqual(project_toc.get_version(self.project.id), version)
+        self.assertEqual(ProjectToc.objects.filter(project=self.project).count(), 1)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            ProjectToc.objects.create(project=self.project, value='')
+
+    def test_version_bumps_on_publish_only(self):
+        chain = self.create_chain(3)
+        version = self.assertTocCurrent(incremental=False)
+        doc = Doc.objects.get(id=chain[2].id)
+        with self.captureOnCommitCallbacks(execute=True):
+            doc.pre_content = '只修改内容'
+            doc.save()
+        self.assertEqual(project_toc.get_toc(self.project.id)[2], version)
+        with self.captureOnCommitCallbacks(execute=True):
+            draft = self.create_doc('草稿', chain[1], status=0)
+        self.assertEqual(project_toc.get_toc(self.project.id)[2], version)
+        with self.captureOnCommitCallbacks(execute=True):
+            draft.status = 1
+            draft.save()
+        self.assertNotEqual(project_toc.get_toc(self.project.id)[2], version)
+        self.assertTocCurrent()
+
+    def test_previous_next_across_levels(self):
+        chain = self.create_chain(5)
+        self.assertTocCurrent(incremental=False)
+        order, index, previous_id, next_id = project_toc.get_doc_position(self.project.id, chain[4].id)
+        # 最深层的文档之后是上一层的同级文档
+        self.assertEqual(order[index - 1], chain[4].id)
+        self.assertEqual(previous_id, chain[3].id)
+        self.assertEqual(Doc.objects.get(id=next_id).name, 'S4')
+        last = Doc.objects.get(id=order[-1])
+        self.assertEqual(last.name, 'S0')
+        self.assertIsNone(project_toc.get_doc_position(self.project.id, last.id)[3])
+        self.assertIsNone(project_toc.get_doc_position(self.project.id, chain[0].id)[2])
+
+    def test_incremental_update_matches_full_build(self):
+        chain = self.create_chain(5)
+        self.assertTocCurrent(incremental=False)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            doc = Doc.objects.get(id=chain[3].id)
+            doc.name = '改名'
+            doc.sort = 100
+            doc.save()
+        self.assertTocCurrent()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            doc = Doc.objects.get(id=chain[1].id)
+            doc.status = 0
+            doc.save()
+        self.assertTocCurrent()
+
+        # 重新发布后下级文档随之出现在目录中
+        with self.captureOnCommitCallbacks(execute=True):
+            doc.status = 1
+            doc.save()
+        self.assertTocCurrent()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            moved_ids = doc_path.move_subtree(Doc.objects.get(id=chain[2].id), 0, self.project.id)
+            project_toc.invalidate(self.project.id, doc_ids=moved_ids)
+        self.assertTocCurrent()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            project_toc.invalidate_docs(doc_path.delete_subtrees(Doc.objects.filter(id=chain[2].id)))
+        self.assertTocCurrent()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Doc.objects.get(id=chain[1].id).delete()
+        self.assertTocCurrent()
+
+    def test_move_between_projects(self):
+        chain = self.create_chain(4)
+        target = self.create_project(name='目标文集')
+        self.create_chain(2, target)
+        self.assertTocCurrent(incremental=False)
+        self.assertTocCurrent(target.id, incremental=False)
+        self.client.force_login(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            resp = self.client.post('/move_doc/', {
+                'doc_id': chain[1].id, 'pro_id': target.id, 'parent_id': '0', 'move_type': '2'
+            })
+        self.assertTrue(resp.json()['status'])
+        self.assertTocCurrent()
+        self.assertTocCurrent(target.id)
+
+    def test_cycle_falls_back_to_full_build(self):
+        chain = self.create_chain(4)
+        self.assertTocCurrent(incremental=False)
+        # 绕过移动文档接口的检查，把文档移到自己的下级文档下
+        with self.captureOnCommitCallbacks(execute=True):
+            doc = Doc.objects.get(id=chain[1].id)
+            doc.parent_doc = chain[3].id
+            doc.save()
+        toc, count, version = project_toc.get_toc(self.project.id)
+        self.assertEqual((toc, count), project_toc.build_toc(self.project.id))
+        self.assertNotIn(chain[3].id, project_toc.get_doc_position(self.project.id, chain[3].id)[0])
+
+    def test_project_invalidate_rebuilds(self):
+        self.create_chain(3)
+        self.assertTocCurrent(incremental=False)
+        with self.captureOnCommitCallbacks(execute=True):
+            Doc.objects.filter(top_doc=self.project.id).update(sort=F('id') * -1)
+            project_toc.invalidate(self.project.id)
+        with mock.patch.object(project_toc, 'update_toc') as update:
+            self.assertTocCurrent(incremental=False)
+        update.assert_not_called()
+
+
+class TrigramIndexTest(DocTestMixin, TestCase):
+
+    CONTENTS = [
+        'Hello World\n第二行内容',
+        'HELLO world',
+        'hel\nlo 跨行不匹配',
+        'ǅungla ǆ DŽ',
+        'İstanbul istanbul',
+        'ΣΊΣΥΦΟΣ σίσυφος ς',
+        'Kelvin K kelvin',
+        'foo123bar foo_bar',
+        '中文全文检索搜索',
+        'ſtraße STRASSE',
+    ]
+    PATTERNS = [
+        'hello', 'Hello World', 'hel+o', 'wor(ld|d)', 'ǆung', 'dž', 'istanbul', 'İstan',
+        'σίσυφος', 'ΣΊΣ', 'kelvin', 'Kelvin', r'foo\d+bar', 'foo.bar', '全文检索', '检索|搜索',
+        'stra', 'ſtr', '[a-z]+', 'x?yz',
+    ]
+
+    def setUp(self):
+        super().setUp()
+        for i, content in enumerate(self.CONTENTS):
+            self.create_doc('文档{}'.format(i), content=content, pre_content=content)
+        trigram_index.rebuild()
+
+    def brute_force(self, pattern):
+        return {
+            doc.id for doc in Doc.objects.all()
+            if any(pattern.search(line) for line in trigram_index.doc_search_text(doc).split('\n'))
+        }
+
+    def test_candidates_include_all_matches(self):
+        docs_query = Doc.objects.filter(status=1)
+        for text in self.PATTERNS:
+            for flags in (0, re.IGNORECASE):
+                pattern = re.compile(text, flags)
+                candidates = trigram_index.candidate_doc_ids(pattern.pattern, docs_query)
+                if candidates is None:
+                    continue
+                self.assertLessEqual(self.brute_force(pattern), candidates, (text, flags))
+
+    def test_candidates_are_selective(self):
+        candidates = trigram_index.candidate_doc_ids('hello', Doc.objects.filter(status=1))
+        self.assertEqual(candidates, self.brute_force(re.compile('hello', re.IGNORECASE)))
+        self.assertIsNone(trigram_index.candidate_doc_ids('[a-z]+', Doc.objects.filter(status=1)))
+
+    def test_stale_docs_are_candidates(self):
+        doc = Doc.objects.get(name='文档8')
+        Doc.objects.filter(id=doc.id).update(
+            content='新增 hello 内容', modify_time=doc.modify_time + datetime.timedelta(seconds=1)
+        )
+        self.assertIn(doc.id, trigram_index.candidate_doc_ids('hello', Doc.objects.filter(status=1)))
+
+
+@override_settings(SEARCH_RESULT_CACHE_TIMEOUT=300)
+class ResultCacheTest(DocTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.generation = 1
+        patcher = mock.patch.object(result_cache, 'get_index_generation', side_effect=lambda: self.generation)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        return [self.calls]
+
+    def get(self, query='关键词', scope=None, **params):
+        return result_cache.get_or_compute('test', query, self.compute, scope=scope, **params)
+
+    def test_hit_with_same_query_and_scope(self):
+        self.assertEqual(self.get(scope=[1, 2]), [1])
+        self.assertEqual(self.get(' 关键词  ', scope={2, 1}), [1])
+        self.assertEqual(self.calls, 1)
+
+    def test_key_changes_with_index_generation(self):
+        self.get()
+        self.generation = 2
+        self.assertEqual(self.get(), [2])
+        self.assertEqual(self.get(), [2])
+
+    def test_key_changes_with_scope_and_params(self):
+        self.get(scope=[1])
+        self.assertEqual(self.get(scope=[1, 2]), [2])
+        self.assertEqual(self.get(scope=None), [3])
+        self.assertEqual(self.get(scope=[1], mode='regex'), [4])
+        self.assertEqual(self.get(scope=[1]), [1])
+
+    def test_not_cached_without_generation_or_when_not_cacheable(self):
+        self.generation = None
+        self.get()
+        self.get()
+        self.assertEqual(self.calls, 2)
+        self.generation = 1
+        result_cache.get_or_compute('test', '部分结果', self.compute, cacheable=lambda value: False)
+        result_cache.get_or_compute('test', '部分结果', self.compute, cacheable=lambda value: False)
+        self.assertEqual(self.calls, 4)
+
+
+@override_settings(SEARCH_LOG_ROLLUP_DELAY=0)
+class SearchRollupTest(DocTestMixin, TestCase):
+
+    def add_logs(self, query_text, n, days_ago=0):
+        created_at = datetime.datetime.now() - datetime.timedelta(days=days_ago)
+        SearchLog.objects.bulk_create([SearchLog(query_text=query_text, created_at=created_at) for _ in range(n)])
+
+    @override_settings(SEARCH_LOG_ROLLUP_DELAY=300)
+    def test_late_committed_lower_id_is_counted(self):
+        now = datetime.datetime.now()
+        old = now - datetime.timedelta(minutes=10)
+        SearchLog.objects.create(id=10, query_text='文档', created_at=old)
+        SearchLog.objects.create(id=30, query_text='文档', created_at=now)
+        self.assertEqual(search_utils.rollup_search_logs(), 1)
+        # 较小ID的日志在汇总之后才提交
+        SearchLog.objects.create(id=20, query_text='文档', created_at=old)
+        self.assertEqual(search_utils.rollup_search_logs(), 1)
+        SearchLog.objects.filter(id=30).update(created_at=old)
+        self.assertEqual(search_utils.rollup_search_logs(), 1)
+        self.assertEqual(sum(self.daily_counts().values()), 3)
+        self.assertEqual(search_utils.rollup_search_logs(), 0)
+
+    def daily_counts(self):
+        return {(d.query_text, d.day): d.search_count for d in SearchKeywordDaily.objects.all()}
+
+    def test_rollup_only_reads_logs_past_high_water_mark(self):
+        today = datetime.date.today()
+        self.add_logs('文档', 3)
+        self.add_logs('搜索', 2, days_ago=1)
+        self.add_logs('', 2)
+        self.assertEqual(search_utils.rollup_search_logs(batch_size=2), 5)
+        self.assertEqual(self.daily_counts(), {
+            ('文档', today): 3, ('搜索', today - datetime.timedelta(days=1)): 2,
+        })
+        state = SearchRollupState.objects.get(name=search_utils.HOT_KEYWORD_ROLLUP)
+        self.assertEqual(state.last_log_id, SearchLog.objects.order_by('-id').values_list('id', flat=True)[0])
+
+        self.assertEqual(search_utils.rollup_search_logs(), 0)
+        self.add_logs('文档', 1)
+        self.assertEqual(search_utils.rollup_search_logs(), 1)
+        self.assertEqual(self.daily_counts()[('文档', today)], 4)
+
+    def test_concurrent_rollup_does_not_double_count(self):
+        self.add_logs('文档', 3)
+        state = SearchRollupState.objects.create(name=search_utils.HOT_KEYWORD_ROLLUP)
+        original = SearchRollupState.objects.get_or_create
+
+        def get_or_create(**kwargs):
+            # 读取进度后，另一个汇总已处理完这些日志
+            result = original(**kwargs)
+            SearchRollupState.objects.filter(id=state.id).update(last_log_id=SearchLog.objects.latest('id').id)
+            return result
+
+        with mock.patch.object(SearchRollupState.objects, 'get_or_create', side_effect=get_or_create):
+            self.assertEqual(search_utils.rollup_search_logs(), 0)
+        self.assertFalse(SearchKeywordDaily.objects.exists())
+
+    def test_hot_keywords_use_decayed_daily_counts(self):
+        self.add_logs('文档', 2)
+        self.add_logs('文档', 2, days_ago=6)
+        self.add_logs('搜索', 3, days_ago=10)
+        self.assertEqual(search_utils.update_hot_keywords(days=7, min_count=2), 1)
+        hot = SearchHotKeyword.objects.get(keyword='文档')
+        self.assertEqual(hot.search_count, 4)
+        self.assertAlmostEqual(hot.hot_score, 2 + 2 / 7)
+
+        self.add_logs('文档', 1)
+        search_utils.update_hot_keywords(days=7, min_count=2)
+        hot.refresh_from_db()
+        self.assertEqual(hot.search_count, 5)
+        self.assertFalse(SearchHotKeyword.objects.filter(keyword='搜索').exists())
+
+
+class DocTreeTest(DocTestMixin, TestCase):
+
+    def make_item(self, row, level):
+        return {'id': row['id'], 'level': level}
+
+    def flatten(self, tree):
+        items = []
+        for node in tree:
+            items.append((node['id'], node['level']))
+            items.extend(self.flatten(node.get('children', [])))
+        return items
+
+    def test_build_deep_tree(self):
+        rows = [{'id': i, 'parent_doc': i - 1} for i in range(1, 8)] + [{'id': 20, 'parent_doc': 3}]
+        tree, count = doc_tree.build_doc_tree(rows, self.make_item)
+        self.assertEqual(count, 8)
+        self.assertEqual(self.flatten(tree), [(1, 1), (2, 2), (3, 3), (4, 4), (5, 5), (6, 6), (7, 7), (20, 4)])
+
+    def test_cycles_and_orphans_are_skipped(self):
+        rows = [
+            {'id': 1, 'parent_doc': 0},
+            {'id': 2, 'parent_doc': 3},
+            {'id': 3, 'parent_doc': 2},
+            {'id': 4, 'parent_doc': 4},
+            {'id': 5, 'parent_doc': 99},
+            {'id': 6, 'parent_doc': 1},
+        ]
+        tree, count = doc_tree.build_doc_tree(rows, self.make_item)
+        self.assertEqual(count, 2)
+        self.assertEqual(tree, [{'id': 1, 'level': 1, 'children': [{'id': 6, 'level': 2}]}])
+
+    def test_doc_tree_view_uses_one_query(self):
+        chain = self.create_chain(6)
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.client.post('/get_pro_doc_tree/', {'pro_id': self.project.id})
+        data = resp.json()['data']
+        self.assertEqual(len([q for q in queries.captured_queries if 'app_doc_doc' in q['sql']]), 1)
+        node = {'children': data}
+        for doc in chain:
+            node = next(item for item in node['children'] if item['id'] == doc.id)
+        self.assertEqual(node['id'], chain[-1].id)
+
+    def test_sort_data_of_any_depth(self):
+        sort_data = [{'id': 1, 'children': [{'id': 2, 'children': [{'id': 3, 'children': [{'id': 4}]}]}, {'id': 5}]}]
+        self.assertEqual(
+            sorted(doc_tree.iter_sort_data(sort_data)),
+            [(1, 0, 10), (2, 1, 10), (3, 2, 10), (4, 3, 10), (5, 1, 20)],
+        )
+
+
+class DocChildrenApiTest(DocTestMixin, TestCase):
+
+    def get_children(self, parent_id=0, **params):
+        return self.client.get('/get_pro_doc_children/', dict(
+            {'pro_id': self.project.id, 'parent_id': parent_id}, **params
+        )).json()
+
+    def test_cursor_pages_through_level(self):
+        parent = self.create_doc('上级文档')
+        children = [self.create_doc('下级{}'.format(i), parent, sort=i % 3) for i in range(8)]
+        self.create_doc('更深一级', children[0])
+        expected = [d.id for d in sorted(children, key=lambda d: (d.sort, d.id))]
+
+        ids, cursor, pages = [], None, 0
+        while True:
+            data = self.get_children(parent.id, limit=3, **({'cursor': cursor} if cursor else {}))
+            self.assertTrue(data['status'])
+            self.assertLessEqual(len(data['data']), 3)
+            ids += [item['id'] for item in data['data']]
+            pages += 1
+            cursor = data['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(ids, expected)
+        self.assertEqual(pages, 3)
+
+        first = self.get_children(parent.id, limit=50)['data']
+        self.assertEqual([item['id'] for item in first if item['has_children']], [children[0].id])
+        self.assertEqual([item['id'] for item in self.get_children()['data']], [parent.id])
+
+    def test_path_to_deep_doc(self):
+        chain = self.create_chain(6)
+        data = self.client.get('/get_pro_doc_path/', {'doc_id': chain[-1].id}).json()
+        self.assertTrue(data['status'])
+        self.assertEqual([item['id'] for item in data['data']], [d.id for d in chain])
+        # 每一级有路径上的文档和一个同级文档，路径上的文档排在前面
+        self.assertEqual({(item['index'], item['total']) for item in data['data']}, {(0, 2)})
+        # 从每一级的游标开始加载同级文档，第一个就是路径上的文档
+        for item in data['data']:
+            page = self.get_children(item['parent_id'], cursor=item['cursor'], limit=1)['data']
+            self.assertEqual(page[0]['id'], item['id'])
+
+    def test_path_query_count_does_not_grow_with_depth(self):
+        shallow = self.create_chain(2)
+        deep = self.create_chain(12)
+        # 第一次请求会读取并缓存站点设置
+        self.client.get('/get_pro_doc_path/', {'doc_id': shallow[0].id})
+        with CaptureQueriesContext(connection) as shallow_queries:
+            self.client.get('/get_pro_doc_path/', {'doc_id': shallow[-1].id})
+        with CaptureQueriesContext(connection) as deep_queries:
+            data = self.client.get('/get_pro_doc_path/', {'doc_id': deep[-1].id}).json()
+        self.assertEqual(len(data['data']), 12)
+        self.assertEqual(len(deep_queries), len(shallow_queries))
+
+    def test_path_index_and_inclusive_cursor(self):
+        parent = self.create_doc('上级文档')
+        children = [self.create_doc('下级{}'.format(i), parent, sort=1) for i in range(5)]
+        data = self.client.get('/get_pro_doc_path/', {'doc_id': children[3].id}).json()['data']
+        self.assertEqual((data[-1]['index'], data[-1]['total']), (3, 5))
+        page = self.get_children(parent.id, cursor=data[-1]['cursor'])['data']
+        self.assertEqual([item['id'] for item in page], [d.id for d in children[3:]])
+        # 下一页游标不包含游标所在的文档
+        after = self.get_children(parent.id, limit=3)['next_cursor']
+        page = self.get_children(parent.id, cursor=after)['data']
+        self.assertEqual([item['id'] for item in page], [d.id for d in children[3:]])
+
+    def test_error_status_codes(self):
+        doc = self.create_doc('文档')
+        for params in ({'pro_id': 'x'}, {'pro_id': self.project.id, 'cursor': '1_2'},
+                       {'pro_id': self.project.id, 'cursor': 'before_1_2'}):
+            self.assertEqual(self.client.get('/get_pro_doc_children/', params).status_code, 400)
+        self.assertEqual(self.client.get('/get_pro_doc_children/', {'pro_id': 0}).status_code, 404)
+        self.assertEqual(self.client.get('/get_pro_doc_path/', {'doc_id': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get('/get_pro_doc_path/', {'doc_id': doc.id + 100}).status_code, 404)
+        draft = self.create_doc('草稿', status=0)
+        child = self.create_doc('草稿的下级文档', draft)
+        self.assertEqual(self.client.get('/get_pro_doc_path/', {'doc_id': child.id}).status_code, 404)
+
+    def test_private_project_is_hidden(self):
+        private = self.create_project(name='私密文集', role=1)
+        doc = self.create_doc('私密文档', project=private)
+        self.assertEqual(self.client.get('/get_pro_doc_children/', {'pro_id': private.id}).status_code, 403)
+        self.assertEqual(self.client.get('/get_pro_doc_path/', {'doc_id': doc.id}).status_code, 403)
+        self.client.force_login(self.user)
+        self.assertEqual(
+            [item['id'] for item in self.client.get('/get_pro_doc_children/', {'pro_id': private.id}).json()['data']],
+            [doc.id],
+        )
+
+
+class SynonymTest(DocTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        synonyms._synonyms = None
+        self.addCleanup(setattr, synonyms, '_synonyms', None)
+        SearchSynonym.objects.create(word='Python', synonyms='py, 蟒蛇')
+
+    def test_expand_term(self):
+        from whoosh import query as whoosh_query
+        q = synonyms.expand_query_tree(whoosh_query.And([
+            whoosh_query.Term('text', 'python'), whoosh_query.Term('text', '文档'),
+        ]))
+        self.assertEqual(q, whoosh_query.And([
+            whoosh_query.Or([
+                whoosh_query.Term('text', 'python'),
+                whoosh_query.Term('text', 'py'),
+                whoosh_query.Term('text', '蟒蛇'),
+            ]),
+            whoosh_query.Term('text', '文档'),
+        ]))
+
+    def test_edit_reloads_synonyms_in_every_process(self):
+        version = synonyms.get_version()
+        self.assertIn('python', synonyms.get_synonyms())
+        SearchSynonym.objects.create(word='文档', synonyms='文件')
+        self.assertEqual(synonyms.get_version(), version + 1)
+        self.assertIn('文档', synonyms.get_synonyms())
+        # 其他进程修改同义词：只增加数据库中的版本号，本进程的缓存仍能失效
+        SearchSynonym.objects.filter(word='文档').update(is_active=False)
+        AccessScopeVersion.objects.filter(key=synonyms.VERSION_KEY).update(version=F('version') + 1)
+        self.assertNotIn('文档', synonyms.get_synonyms())
+
+    def test_version_is_stable_without_edits(self):
+        self.assertEqual(synonyms.get_version(), synonyms.get_version())
+        cache.clear()
+        self.assertEqual(synonyms.get_version(), synonyms.get_version())
+
+
+class SqlFtsBackendTest(DocTestMixin, TestCase):
+    """数据库全文搜索后端与 Whoosh 后端对同一批文档返回相同的结果"""
+
+    def setUp(self):
+        super().setUp()
+        index_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, index_dir, True)
+        docs = [
+            ('Python 入门', '使用 Python 编写数据库程序'),
+            ('数据库设计', '关系数据库的范式与索引'),
+            ('全文搜索', '中文搜索需要先分词再建立倒排索引'),
+            ('部署文档', 'kelvin 负责维护部署文档'),
+        ]
+        other = self.create_project(name='其他文集')
+        for i, (name, content) in enumerate(docs):
+            self.create_doc(name, project=other if i % 2 else None, pre_content=content, editor_mode=1)
+        self.create_doc('草稿数据库', status=0, pre_content='未发布的数据库文档', editor_mode=1)
+        self.pids = [self.project.id, other.id]
+
+        unified_index = haystack_connections['default'].get_unified_index()
+        self.backends = {}
+        for name in ('whoosh', 'sql'):
+            options = dict(settings.HAYSTACK_CONNECTIONS['default'], PATH=index_dir)
+            backend = import_string(settings.SEARCH_ENGINE_MAP[name]).backend('default', **options)
+            for model in (Doc, Project):
+                index = unified_index.get_index(model)
+                backend.update(index, index.index_queryset())
+            self.backends[name] = backend
+
+    def search(self, sqs):
+        query = sqs.query
+        params = query.build_params()
+        params.pop('result_class', None)
+        hits = {}
+        for name, backend in self.backends.items():
+            results = backend.search(query.build_query(), **params)
+            hits[name] = (results['hits'], sorted(result.pk for result in results['results']))
+        return hits
+
+    def assertSameHits(self, sqs, expected_count):
+        hits = self.search(sqs)
+        self.assertEqual(hits['sql'], hits['whoosh'])
+        self.assertEqual(hits['sql'][0], expected_count)
+
+    def test_keyword_search(self):
+        self.assertSameHits(SearchQuerySet().models(Doc).auto_query('数据库'), 2)
+        self.assertSameHits(SearchQuerySet().models(Doc).auto_query('数据库').exclude(content='范式'), 1)
+        self.assertSameHits(SearchQuerySet().models(Doc).auto_query('"倒排索引"'), 1)
+        self.assertSameHits(SearchQuerySet().models(Doc).auto_query('不存在的词'), 0)
+
+    def test_field_and_scope_filters(self):
+        self.assertSameHits(SearchQuerySet().models(Doc).filter(title__contains='数据库'), 1)
+        self.assertSameHits(SearchQuerySet().models(Doc).filter(content__contains='kelvin'), 1)
+        self.assertSameHits(search_utils.narrow_to_projects(SearchQuerySet(), self.pids[:1]).auto_query('数据库'), 1)
+        self.assertSameHits(search_utils.narrow_to_projects(SearchQuerySet(), []).auto_query('数据库'), 0)
+
+    def test_remove_document(self):
+        doc = Doc.objects.get(name='数据库设计')
+        for backend in self.backends.values():
+            backend.remove(doc)
+        self.assertSameHits(SearchQuerySet().models(Doc).auto_query('数据库'), 1)
+
+
+@override_settings(SEARCH_TOKEN_CACHE=False)
+class ChineseTokenizerTest(TestCase):
+
+    def tokens(self, value, **kwargs):
+        return [
+            (t.text, t.pos, t.startchar, t.endchar)
+            for t in ChineseTokenizer()(value, positions=True, chars=True, **kwargs)
+        ]
+
+    def test_repeated_words_get_their_own_offsets(self):
+        value = '文档搜索\n文档 搜索文档'
+        tokens = self.tokens(value)
+        self.assertEqual([t[0] for t in tokens], ['文档', '搜索', '文档', '搜索', '文档'])
+        self.assertEqual([t[2] for t in tokens], [0, 2, 5, 8, 10])
+        self.assertEqual([t[1] for t in tokens], list(range(5)))
+        for text, pos, start, end in tokens:
+            self.assertEqual(value[start:end], text)
+
+    def test_offsets_are_exact_on_long_text(self):
+        line = '全文搜索引擎使用 jieba 分词，Python 文档。\n'
+        value = line * 200
+        tokens = self.tokens(value, start_pos=3, start_char=10)
+        self.assertEqual(tokens[0][1], 3)
+        for text, pos, start, end in tokens:
+            self.assertEqual(value[start - 10:end - 10], text)
+        # 每一行重复出现的词都位于所在的行，而不是第一次出现的位置
+        per_line = len(tokens) // 200
+        first = [(t[0], t[2]) for t in tokens[:per_line]]
+        last = [(t[0], t[2] - len(line) * 199) for t in tokens[-per_line:]]
+        self.assertEqual(last, first)
+
+    def test_search_mode_splits_long_words(self):
+        words = [t[0] for t in self.tokens('中华人民共和国')]
+        self.assertIn('中华人民共和国', words)
+        self.assertIn('中华', words)
+
+
+class TokenCacheTest(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir, True)
+        cache_settings = override_settings(
+            SEARCH_TOKEN_CACHE=True, SEARCH_TOKEN_CACHE_PATH=os.path.join(cache_dir, 'tokens.sqlite3')
+        )
+        cache_settings.enable()
+        self.addCleanup(cache_settings.disable)
+        self.clear_memory()
+        self.addCleanup(self.clear_memory)
+
+    def clear_memory(self):
+        token_cache._line_cache.clear()
+        token_cache._pending.clear()
+
+    def test_unchanged_text_is_not_segmented_again(self):
+        value = '全文搜索引擎使用 jieba 分词。\n' * 50
+        expected = token_cache.segment(value)
+        token_cache.flush()
+        # 模拟重建索引的新进程：进程内缓存为空，从持久化缓存读取
+        self.clear_memory()
+        with mock.patch.object(jieba, 'tokenize', side_effect=AssertionError('不应重新分词')):
+            self.assertEqual(token_cache.segment(value), expected)
+        with mock.patch.object(jieba, 'tokenize', wraps=jieba.tokenize) as tokenize:
+            token_cache.segment(value + '新增的内容')
+        self.assertTrue(tokenize.called)
+
+    def test_fields_share_line_segmentation(self):
+        title = '全文搜索引擎'
+        with mock.patch.object(jieba, 'tokenize', wraps=jieba.tokenize) as tokenize:
+            # 文档的 text 字段包含标题和内容，title 字段再次分词时直接使用同一行的结果
+            token_cache.segment(title + '\n' + '正文内容')
+            token_cache.segment(title)
+        self.assertEqual(tokenize.call_count, 2)
+
+    def test_short_text_is_not_persisted(self):
+        token_cache.segment('短文本')
+        self.assertEqual(token_cache._pending, {})
+
+
+class WhooshIndexMixin:
+    """使用临时目录中的 Whoosh 索引作为默认搜索后端"""
+
+    def setUp(self):
+        super().setUp()
+        self.index_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.index_dir, True)
+        options = dict(settings.HAYSTACK_CONNECTIONS['default'], PATH=self.index_dir)
+        self.backend = import_string(settings.SEARCH_ENGINE_MAP['whoosh']).backend('default', **options)
+        patcher = mock.patch.object(haystack_connections['default'], 'get_backend', return_value=self.backend)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(searcher_pool._pools.pop, self.index_dir, None)
+        self.addCleanup(searcher_pool.clear, self.index_dir)
+
+    def update_index(self, model=Doc):
+        index = haystack_connections['default'].get_unified_index().get_index(model)
+        self.backend.update(index, index.index_queryset())
+
+
+class ParallelIndexTest(WhooshIndexMixin, DocTestMixin, TestCase):
+    """工作进程在当前进程内按顺序运行，使用测试数据库和临时索引目录"""
+
+    def setUp(self):
+        super().setUp()
+        for i in range(7):
+            self.create_doc('并行文档{}'.format(i), pre_content='并行重建索引的文档', editor_mode=1)
+        self.create_doc('草稿', status=0)
+
+    def fake_context(self, exitcodes=None):
+        exitcodes = exitcodes or {}
+
+        class Process:
+            def __init__(self, target, args):
+                self.target, self.args, self.exitcode = target, args, None
+
+            def start(self):
+                worker_no = self.args[0]
+                if worker_no in exitcodes:
+                    # 模拟工作进程崩溃：不发送任何消息直接退出
+                    self.exitcode = exitcodes[worker_no]
+                    return
+                self.target(*self.args)
+                self.exitcode = 0
+
+            def is_alive(self):
+                return False
+
+            def join(self):
+                pass
+
+        return mock.Mock(Queue=queue.Queue, Process=Process)
+
+    def test_jobs_are_spread_across_workers(self):
+        shards, total = parallel_index._collect_jobs('default', 3)
+        self.assertEqual(total, 8)
+        sizes = [sum(len(pks) for label, pks in jobs) for jobs in shards]
+        self.assertEqual(sum(sizes), total)
+        self.assertLessEqual(max(sizes) - min(sizes), 2)
+
+    def test_rebuild_registers_every_worker_segment(self):
+        with mock.patch.object(parallel_index.multiprocessing, 'get_context', return_value=self.fake_context()):
+            self.assertEqual(parallel_index.rebuild(3, batch_size=2), 8)
+        self.backend.setup()
+        self.assertEqual(self.backend.index.doc_count(), 8)
+        self.assertGreaterEqual(len(self.backend.index._segments()), 3)
+        self.assertEqual(self.backend.search('并行')['hits'], 7)
+
+    def test_crashed_worker_fails_rebuild_and_releases_lock(self):
+        context = self.fake_context(exitcodes={1: -9})
+        with mock.patch.object(parallel_index.multiprocessing, 'get_context', return_value=context):
+            with self.assertRaises(CommandError):
+                parallel_index.rebuild(3, batch_size=2, lock_timeout=0)
+        # 写锁已释放，可以再次写入
+        self.backend.setup()
+        writer = self.backend.index.writer(timeout=0)
+        writer.cancel()
+
+
+class SearcherPoolTest(WhooshIndexMixin, DocTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.create_doc('搜索器复用', pre_content='复用搜索器的文档', editor_mode=1)
+        self.update_index()
+
+    def stats(self):
+        return searcher_pool.get_stats()[self.index_dir]
+
+    def test_searcher_is_reused_until_index_changes(self):
+        self.assertEqual(self.backend.search('复用')['hits'], 1)
+        self.assertEqual(self.backend.search('复用')['hits'], 1)
+        stats = self.stats()
+        self.assertEqual((stats['misses'], stats['hits'], stats['reopens'], stats['idle']), (1, 1, 0, 1))
+
+        self.create_doc('新的文档', pre_content='索引变化后重新打开搜索器', editor_mode=1)
+        self.update_index()
+        self.assertEqual(self.backend.search('复用 OR 重新打开')['hits'], 2)
+        stats = self.stats()
+        self.assertEqual((stats['reopens'], stats['idle']), (1, 1))
+        self.assertEqual(stats['generation'], self.backend.index.latest_generation())
+
+    def test_searchers_are_not_shared_between_concurrent_requests(self):
+        with self.backend._searcher() as first, self.backend._searcher() as second:
+            self.assertIsNot(first, second)
+        self.assertEqual(self.stats()['idle'], 2)
+        with override_settings(SEARCH_SEARCHER_POOL_SIZE=0):
+            searcher_pool._pools.pop(self.index_dir)
+            with self.backend._searcher() as searcher:
+                pass
+        self.assertTrue(searcher.is_closed)
+
+
+class NarrowFilterCacheTest(WhooshIndexMixin, DocTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.projects = [self.project] + [self.create_project(name='文集{}'.format(i)) for i in range(3)]
+        for project in self.projects:
+            self.create_doc('权限范围文档', project=project, pre_content='权限范围', editor_mode=1)
+        self.update_index()
+
+    def search(self, project_ids):
+        sqs = search_utils.narrow_to_projects(SearchQuerySet().models(Doc), project_ids).auto_query('权限范围')
+        return sorted(int(result.pk) for result in sqs)
+
+    def stats(self):
+        return searcher_pool.get_stats()[self.index_dir]
+
+    def test_equivalent_scopes_share_cached_filter(self):
+        ids = [p.id for p in self.projects[:3]]
+        expected = sorted(Doc.objects.filter(top_doc__in=ids).values_list('id', flat=True))
+        self.assertEqual(self.search(ids), expected)
+        # 顺序和重复不同的相同权限范围复用同一个过滤结果
+        self.assertEqual(self.search(list(reversed(ids)) + ids[:1]), expected)
+        stats = self.stats()
+        self.assertEqual((stats['filters'], stats['filter_misses'], stats['filter_hits']), (2, 2, 2))
+
+        self.search(ids[:1])
+        self.assertEqual(self.stats()['filters'], 3)
+
+    def test_filter_cache_is_dropped_when_index_changes(self):
+        ids = [p.id for p in self.projects[:2]]
+        self.search(ids)
+        doc = self.create_doc('新增文档', project=self.projects[1], pre_content='权限范围', editor_mode=1)
+        self.update_index()
+        self.assertIn(doc.id, self.search(ids))
+        stats = self.stats()
+        self.assertEqual((stats['filter_hits'], stats['filter_misses']), (0, 4))
+
+
+@override_settings(SEARCH_SHARDS=True)
+class ShardedIndexTest(WhooshIndexMixin, DocTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.root = shards.get_root(self.index_dir)
+        self.addCleanup(shutil.rmtree, self.root, True)
+        self.other = self.create_project(name='另一个文集')
+        self.docs = {
+            project.id: [
+                self.create_doc('分片文档{}'.format(i), project=project, pre_content='分片搜索', editor_mode=1)
+                for i in range(3)
+            ]
+            for project in (self.project, self.other)
+        }
+        self.update_index()
+        # 写入时定位旧分片会打开全局搜索器，从空的搜索器池开始统计
+        self.drop_pools()
+        self.addCleanup(self.drop_pools)
+
+    def drop_pools(self):
+        for key in [key for key in searcher_pool._pools if str(key).startswith(self.root)]:
+            searcher_pool.clear(key)
+            searcher_pool._pools.pop(key, None)
+
+    def search(self, project_ids):
+        sqs = search_utils.narrow_to_projects(SearchQuerySet().models(Doc), project_ids).auto_query('分片搜索')
+        return sorted(int(result.pk) for result in sqs)
+
+    def doc_ids(self, *projects):
+        return sorted(doc.id for project in projects for doc in self.docs[project.id])
+
+    def opened(self):
+        return {
+            key for key, stats in searcher_pool.get_stats().items()
+            if str(key).startswith(self.root) and stats['misses']
+        }
+
+    def test_documents_are_written_to_project_shards(self):
+        self.assertTrue(self.backend.sharded)
+        names = [shards.project_shard(self.project.id), shards.project_shard(self.other.id)]
+        self.assertEqual(self.backend.index.shard_names(), sorted(names))
+        for name in names:
+            self.assertEqual(self.backend.index.shard_index(name).doc_count(), 3)
+        # 未分片的索引目录不写入
+        self.assertFalse(os.listdir(self.index_dir))
+
+    def test_project_search_opens_only_its_shard(self):
+        self.assertEqual(self.search([self.other.id]), self.doc_ids(self.other))
+        self.assertEqual(self.opened(), {self.backend.index.shard_path(shards.project_shard(self.other.id))})
+        # 没有分片的文集直接返回空结果
+        self.assertEqual(self.search([self.other.id + 100]), [])
+
+    def test_global_search_merges_all_shards(self):
+        self.assertEqual(self.search([self.project.id, self.other.id]), self.doc_ids(self.project, self.other))
+        self.assertEqual(self.opened(), {self.root})
+        results = self.backend.search('分片搜索', end_offset=4)
+        self.assertEqual(results['hits'], 6)
+        self.assertEqual(len(results['results']), 4)
+
+    def test_moved_document_leaves_old_shard(self):
+        doc = self.docs[self.project.id][0]
+        Doc.objects.filter(id=doc.id).update(top_doc=self.other.id)
+        self.update_index()
+        counts = {
+            name: self.backend.index.shard_index(name).doc_count()
+            for name in self.backend.index.shard_names()
+        }
+        self.assertEqual(counts, {
+            shards.project_shard(self.project.id): 2,
+            shards.project_shard(self.other.id): 4,
+        })
+        self.assertIn(doc.id, self.search([self.other.id]))
+        self.assertNotIn(doc.id, self.search([self.project.id]))
+
+
+class HighlighterTest(TestCase):
+
+    def highlighter(self, query='搜索', max_length=200):
+        return MyHighLighter(query, max_length=max_length)
+
+    def test_window_covers_densest_hits(self):
+        highlighter = self.highlighter()
+        highlighter.text_block = 'x' * 3000
+        self.assertEqual(highlighter.find_window({'搜索': [5, 500, 510, 520, 2000]}), (490, 690))
+        # 命中数相同时使用靠前的窗口
+        self.assertEqual(highlighter.find_window({'搜索': [300, 310], '文档': [1000, 1010]}), (290, 490))
+        self.assertEqual(highlighter.find_window({'搜索': [2900]})[0], 2800)
+        self.assertEqual(highlighter.find_window({}), (0, 200))
+
+    def test_window_matches_brute_force(self):
+        rng = random.Random(0)
+        highlighter = self.highlighter()
+        for _ in range(50):
+            hits = sorted(rng.sample(range(20000), 60))
+            start, end = highlighter.find_window({'搜索': hits})
+            start += 10
+            best = max(sum(1 for h in hits if s <= h < s + 200) for s in hits)
+            self.assertEqual(sum(1 for h in hits if start <= h < start + 200), best)
+
+    def test_highlight_long_text(self):
+        text = '无关内容。' * 20000 + '全文搜索的文档。' * 3 + '无关内容。' * 20000
+        html = self.highlighter('搜索').highlight(text)
+        self.assertIn('<span class="highlighted">搜索</span>', html)
+        self.assertEqual(html.count('highlighted'), 3)
+        self.assertLessEqual(len(strip_tags(html)), 203)
+
+    def test_analyzer_and_query_words_are_reused(self):
+        get_query_words.cache_clear()
+        first, second = self.highlighter('全文搜索'), self.highlighter('全文搜索')
+        self.assertIs(first.query_words, second.query_words)
+        self.assertEqual(get_query_words.cache_info().hits, 1)
+        self.assertIs(get_analyzer(), get_analyzer())
+
+
+class SearchLogBufferTest(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.reset_buffer()
+        self.addCleanup(self.reset_buffer)
+        # 不启动后台写入线程，由测试调用 flush
+        patcher = mock.patch.object(log_buffer, 'ensure_worker')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def reset_buffer(self):
+        log_buffer._buffer = None
+        log_buffer.dropped = 0
+
+    def test_search_does_not_wait_for_log_write(self):
+        with CaptureQueriesContext(connection) as queries:
+            for i in range(5):
+                search_utils.log_search('搜索词{}'.format(i), results_count=i)
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(SearchLog.objects.count(), 0)
+        self.assertEqual(log_buffer.get_stats()['pending'], 5)
+
+        with override_settings(SEARCH_LOG_BATCH_SIZE=2), \
+                mock.patch.object(SearchLog.objects, 'bulk_create', wraps=SearchLog.objects.bulk_create) as bulk_create:
+            self.assertEqual(log_buffer.flush(), 5)
+        self.assertEqual(bulk_create.call_count, 3)
+        self.assertEqual(
+            list(SearchLog.objects.order_by('id').values_list('query_text', flat=True)),
+            ['搜索词{}'.format(i) for i in range(5)],
+        )
+        self.assertEqual(log_buffer.get_stats()['pending'], 0)
+
+    def test_log_keeps_search_time(self):
+        search_log = search_utils.log_search('搜索时间')
+        with mock.patch('django.utils.timezone.now', return_value=search_log.created_at + datetime.timedelta(minutes=5)):
+            log_buffer.flush()
+        self.assertEqual(SearchLog.objects.get().created_at, search_log.created_at)
+
+    def test_full_buffer_drops_oldest(self):
+        with override_settings(SEARCH_LOG_BUFFER_SIZE=3):
+            for i in range(5):
+                search_utils.log_search('搜索词{}'.format(i))
+        self.assertEqual(log_buffer.get_stats(), {'pending': 3, 'dropped': 2})
+        log_buffer.flush()
+        self.assertEqual(
+            sorted(SearchLog.objects.values_list('query_text', flat=True)), ['搜索词2', '搜索词3', '搜索词4']
+        )
+
+    def test_failed_write_keeps_logs_for_next_flush(self):
+        search_utils.log_search('写入失败')
+        with mock.patch.object(SearchLog.objects, 'bulk_create', side_effect=RuntimeError('数据库被锁定')):
+            self.assertEqual(log_buffer.flush(), 0)
+        self.assertEqual(log_buffer.get_stats()['pending'], 1)
+        self.assertEqual(log_buffer.flush(), 1)
+        self.assertTrue(SearchLog.objects.filter(query_text='写入失败').exists())
+
+    @override_settings(SEARCH_LOG_BUFFER=False)
+    def test_buffer_can_be_disabled(self):
+        search_utils.log_search('同步写入')
+        self.assertTrue(SearchLog.objects.filter(query_text='同步写入').exists())
+        self.assertEqual(log_buffer.get_stats()['pending'], 0)
+
+
+@contextmanager
+def expire_search_budget(count):
+    """全文搜索收集 count 个文档后视为超出时间预算，不启动计时线程"""
+    def collect(collector, sub_docnum):
+        collector.collected += 1
+        if collector.collected >= count:
+            collector.timedout = True
+        return collector.child.collect(sub_docnum)
+
+    with mock.patch('whoosh.collectors.threading.Timer'), \
+            mock.patch.object(BudgetCollector, 'collect', autospec=True, side_effect=collect):
+        yield
+
+
+class TimeBudgetTest(WhooshIndexMixin, DocTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        for i in range(40):
+            self.create_doc('预算文档{}'.format(i), pre_content='时间预算', editor_mode=1)
+        self.update_index()
+
+    def test_exceeded_budget_returns_partial_results(self):
+        with expire_search_budget(5):
+            results = self.backend.search('时间预算')
+        self.assertTrue(results['partial'])
+        self.assertEqual(len(results['results']), 5)
+        # 估算的命中总数不少于已收集的数量，也不超过索引中的文档数
+        self.assertGreaterEqual(results['hits'], 5)
+        self.assertLessEqual(results['hits'], self.backend.index.doc_count())
+
+    def test_within_budget_returns_complete_results(self):
+        results = self.backend.search('时间预算')
+        self.assertFalse(results['partial'])
+        self.assertEqual(results['hits'], 40)
+        with override_settings(SEARCH_TIME_BUDGET=0), \
+                mock.patch.object(self.backend, '_search_page_with_budget') as with_budget:
+            self.assertEqual(self.backend.search('时间预算')['hits'], 40)
+        with_budget.assert_not_called()
+
+    def test_partial_query_is_not_searched_again(self):
+        sqs = SearchQuerySet().models(Doc).auto_query('时间预算')
+        with expire_search_budget(3), \
+                mock.patch.object(self.backend, 'search', wraps=self.backend.search) as search:
+            results = list(sqs[:20])
+        self.assertTrue(sqs.query.is_partial())
+        self.assertEqual(len(results), 3)
+        self.assertEqual(sqs.query.estimated_hits(), sqs.count())
+        search.assert_called_once()
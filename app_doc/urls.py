@@ -9,6 +9,9 @@ urlpatterns = [
     path('create_project/', views.create_project, name='create_project'),  # 新建文集
     path('get_pro_doc/', views.get_pro_doc, name="get_pro_doc"),  # 获取某个文集的下级文档
     path('get_pro_doc_tree/', views.get_pro_doc_tree, name="get_pro_doc_tree"),  # 获取某个文集的下级文档树数据
+    path('project-<int:pro_id>/toc/', views.get_pro_toc_json, name="get_pro_toc_json"),  # 获取文集目录JSON（支持ETag）
+    path('get_pro_doc_children/', views.get_pro_doc_children, name="get_pro_doc_children"),  # 按层级获取文集的下级文档
+    path('get_pro_doc_path/', views.get_pro_doc_path, name="get_pro_doc_path"),  # 获取文档的上级文档链
     path('modify_pro/',views.modify_project,name='modify_project'), # 修改文集
     path('manage_project/',views.manage_project,name="manage_project"), # 管理文集
     path('del_project/',views.del_project,name='del_project'), # 删除文集
@@ -15,14 +15,18 @@ from rest_framework.views import APIView # 视图
 from rest_framework.response import Response # 响应
 from rest_framework.pagination import PageNumberPagination # 分页
 from rest_framework.authentication import SessionAuthentication # 认证
-from django.db.models import Q
+from django.db.models import Count, Q
 from django.db import transaction
 from django.utils.html import strip_tags,escape
+from django.utils.cache import get_conditional_response,patch_cache_control
+from django.utils.http import quote_etag
 from django.utils.translation import gettext_lazy as _
 from loguru import logger
 from app_api.serializers_app import *
 from app_doc.report_utils import *
 from app_doc.utils import check_user_project_writer_role, refresh_doc_index
+from app_doc import access_scope, doc_path, project_toc
+from app_doc.doc_tree import get_doc_tree,iter_sort_data
 from app_admin.models import UserOptions,SysSetting
 from app_admin.decorators import check_headers,allow_report_file
 from app_admin.utils import is_zip_bomb
@@ -105,91 +109,22 @@ def remove_markdown_tag(docs):
         except Exception as e:
             doc.pre_content = doc.pre_content[:201]
 
+# 文集文档排序、文档树接口的节点格式
+def sort_tree_item(doc,level):
+    item = {
+        'id': doc['id'],
+        'field': doc['name'],
+        'title': doc['name'],
+        'level': level
+    }
+    if level == 1:
+        item['spread'] = True
+    return item
+
 # 获取文集的文档目录
 def get_pro_toc(pro_id):
-    # try:
-    #     project = Project.objects.get(id=pro_id)
-    #     pro_toc = ProjectToc.objects.get(project=project)
-    #     doc_list = json.loads(pro_toc.value)
-    #     print("使用缓存")
-    # except:
-    # print("重新生成")
-    # 查询存在上级文档的文档
-    parent_id_list = Doc.objects.filter(
-        top_doc=pro_id,
-        status=1
-    ).exclude(parent_doc=0).values_list('parent_doc',flat=True)
-    # 获取存在上级文档的上级文档ID
-    # print(parent_id_list)
-    doc_list = []
-    n = 0
-    # 获取一级文档
-    top_docs = Doc.objects.filter(top_doc=pro_id, parent_doc=0, status=1).values('id', 'name','open_children','editor_mode').order_by('sort')
-    # 遍历一级文档
-    for doc in top_docs:
-        top_item = {
-            'id': doc['id'],
-            'name': doc['name'],
-            'open_children':doc['open_children'],
-            'editor_mode':doc['editor_mode']
-            # 'spread': True,
-            # 'level': 1
-        }
-        # 如果一级文档存在下级文档，查询其二级文档
-        if doc['id'] in parent_id_list:
-            # 获取二级文档
-            sec_docs = Doc.objects.filter(
-                top_doc=pro_id,
-                parent_doc=doc['id'],
-                status=1
-            ).values('id', 'name','open_children','editor_mode').order_by('sort')
-            top_item['children'] = []
-            for doc in sec_docs:
-                sec_item = {
-                    'id': doc['id'],
-                    'name': doc['name'],
-                    'open_children': doc['open_children'],
-                    'editor_mode': doc['editor_mode']
-                    # 'level': 2
-                }
-                # 如果二级文档存在下级文档，查询第三级文档
-                if doc['id'] in parent_id_list:
-                    # 获取三级文档
-                    thr_docs = Doc.objects.filter(
-                        top_doc=pro_id,
-                        parent_doc=doc['id'],
-                        status=1
-                    ).values('id','name','editor_mode').order_by('sort')
-                    sec_item['children'] = []
-                    for doc in thr_docs:
-                        item = {
-                            'id': doc['id'],
-                            'name': doc['name'],
-                            'editor_mode': doc['editor_mode']
-                            # 'level': 3
-                        }
-                        sec_item['children'].append(item)
-                        n += 1
-                    top_item['children'].append(sec_item)
-                    n += 1
-                else:
-                    top_item['children'].append(sec_item)
-                    n += 1
-            doc_list.append(top_item)
-            n += 1
-        # 如果一级文档没有下级文档，直接保存
-        else:
-            doc_list.append(top_item)
-            n += 1
-    # 将文集的大纲目录写入数据库
-    # ProjectToc.objects.create(
-    #     project = project,
-    #     value = json.dumps(doc_list)
-    # )
-    # print(doc_list,n)
-    # if n > 999:
-    #     return ([],n)
-    # else:
+    # 文集目录缓存在 ProjectToc 和进程内，文档变化后按版本号失效
+    doc_list,n,version = project_toc.get_toc(pro_id)
     return (doc_list,n)
 
 
@@ -236,7 +171,7 @@ def project_list(request):
 
     # 没有搜索 and 认证用户 and 没有筛选
     if (is_kw is False) and (is_auth) and (is_role is False):
-        colla_list = [i.project.id for i in ProjectCollaborator.objects.filter(user=request.user)] # 用户的协作文集列表
+        colla_list = access_scope.get_collaborated_project_ids(request.user) # 用户的协作文集列表
         project_list = Project.objects.filter(
             Q(role__in=role_list) | \
             Q(role=2,role_value__contains=str(request.user.username)) | \
@@ -257,7 +192,7 @@ def project_list(request):
         elif role in ['3',3]:
             project_list = Project.objects.filter(role=3).order_by('-is_top',"{}create_time".format(sort_str))
         elif role in ['99',99]:
-            colla_list = [i.project.id for i in ProjectCollaborator.objects.filter(user=request.user)] # 用户的协作文集列表
+            colla_list = access_scope.get_collaborated_project_ids(request.user) # 用户的协作文集列表
             project_list = Project.objects.filter(id__in=colla_list).order_by('-is_top',"{}create_time".format(sort_str))
         else:
             return render(request,'404.html')
@@ -277,7 +212,7 @@ def project_list(request):
 
     # 有搜索 and 认证用户 and 没有筛选
     elif (is_kw) and (is_auth) and (is_role is False):
-        colla_list = [i.project.id for i in ProjectCollaborator.objects.filter(user=request.user)] # 用户的协作文集
+        colla_list = access_scope.get_collaborated_project_ids(request.user) # 用户的协作文集
         # 查询所有可显示的文集
         project_list = Project.objects.filter(
             Q(role__in=[0, 3]) | \
@@ -311,7 +246,7 @@ def project_list(request):
                 role=3
             ).order_by('-is_top',"{}create_time".format(sort_str))
         elif role in ['99',99]:
-            colla_list = [i.project.id for i in ProjectCollaborator.objects.filter(user=request.user)] # 用户的协作文集列表
+            colla_list = access_scope.get_collaborated_project_ids(request.user) # 用户的协作文集列表
             project_list = Project.objects.filter(
                 Q(name__icontains=kw) | Q(intro__icontains=kw),
                 id__in=colla_list
@@ -556,6 +491,8 @@ def modify_project_role(request,pro_id):
                             role_value=role_value,
                             modify_time=datetime.datetime.now()
                         )
+                    # update() 不触发模型信号，手动失效公开文集缓存
+                    access_scope.invalidate_public()
                     pro = Project.objects.get(id=int(pro_id))
                     # return render(request, 'app_doc/manage/manage_project_role.html', locals())
                     return JsonResponse({'status':True,'data':'ok'})
@@ -702,58 +639,8 @@ def manage_project_doc_sort(request,pro_id):
         pro_colla = ProjectCollaborator.objects.filter(project=pro,user=request.user,role=1)
         # 文集的创建者和文集高级权限协作者允许操作
         if (pro.create_user == request.user) or pro_colla.count() > 0:
-            # 查询存在上级文档的文档
-            parent_id_list = Doc.objects.filter(top_doc=pro_id, status=1).exclude(parent_doc=0).values_list(
-                'parent_doc', flat=True)
-            # 获取存在上级文档的上级文档ID
-            doc_list = []
-            # 获取一级文档
-            top_docs = Doc.objects.filter(top_doc=pro_id, parent_doc=0, status=1).values('id', 'name').order_by('sort')
-            # 遍历一级文档
-            for doc in top_docs:
-                top_item = {
-                    'id': doc['id'],
-                    'field': doc['name'],
-                    'title': doc['name'],
-                    'spread': True,
-                    'level': 1
-                }
-                # 如果一级文档存在下级文档，查询其二级文档
-                if doc['id'] in parent_id_list:
-                    # 获取二级文档
-                    sec_docs = Doc.objects.filter(top_doc=pro_id, parent_doc=doc['id'], status=1).values('id',
-                                                                                                         'name').order_by(
-                        'sort')
-                    top_item['children'] = []
-                    for doc in sec_docs:
-                        sec_item = {
-                            'id': doc['id'],
-                            'field': doc['name'],
-                            'title': doc['name'],
-                            'level': 2
-                        }
-                        # 如果二级文档存在下级文档，查询第三级文档
-                        if doc['id'] in parent_id_list:
-                            # 获取三级文档
-                            thr_docs = Doc.objects.filter(top_doc=pro_id, parent_doc=doc['id'], status=1).values('id',
-                                                                                                                 'name').order_by(
-                                'sort')
-                            sec_item['children'] = []
-                            for doc in thr_docs:
-                                item = {
-                                    'id': doc['id'],
-                                    'field': doc['name'],
-                                    'title': doc['name'],
-                                    'level': 3
-                                }
-                                sec_item['children'].append(item)
-                            top_item['children'].append(sec_item)
-                        else:
-                            top_item['children'].append(sec_item)
-                    doc_list.append(top_item)
-                # 如果一级文档没有下级文档，直接保存
-                else:
-                    doc_list.append(top_item)
+            # 获取文集的文档树
+            doc_list,doc_cnt = get_doc_tree(pro_id,('name',),sort_tree_item)
             return render(request,'app_doc/manage/manage_project_doc_sort.html',locals())
         else:
             return render(request, '403.html')
@@ -775,25 +662,11 @@ def manage_project_doc_sort(request,pro_id):
         pro_colla = ProjectCollaborator.objects.filter(project=pro, user=request.user, role=1)
         # 文集的创建者和文集高级权限协作者允许操作
         if (pro.create_user == request.user) or pro_colla.count() > 0:
-            # 文档排序
-            n = 10
-            # 第一级文档
-            for data in sort_data:
-                # print(data)
-                Doc.objects.filter(id=data['id']).update(sort=n,parent_doc=0)
-                n += 10
-                # 存在第二级文档
-                if 'children' in data.keys():
-                    n1 = 10
-                    for c1 in data['children']:
-                        Doc.objects.filter(id=c1['id']).update(sort=n1, parent_doc=data['id'])
-                        n1 += 10
-                        # 存在第三级文档
-                        if 'children' in c1.keys():
-                            n2 = 10
-                            for c2 in c1['children']:
-                                Doc.objects.filter(id=c2['id']).update(sort=n2, parent_doc=c1['id'])
-                                n2 += 10
+            # 文档排序，支持任意层级
+            for doc_id,parent_id,sort in iter_sort_data(sort_data):
+                Doc.objects.filter(id=doc_id).update(sort=sort,parent_doc=parent_id)
+            doc_path.rebuild_project(pro.id)
+            project_toc.invalidate(pro.id)
 
             return JsonResponse({'status': True, 'data': 'ok'})
         else:
@@ -904,6 +777,7 @@ def manage_project_collaborator(request,pro_id):
                 user = User.objects.get(username=username)
                 pro_colla = ProjectCollaborator.objects.filter(project=project[0], user=user)
                 pro_colla.update(role=role)
+                access_scope.invalidate_user(user.id)
                 return JsonResponse({'status':True,'data':_('修改成功')})
             except:
                 logger.exception(_("修改协作权限出错"))
@@ -1087,13 +961,10 @@ def doc(request,pro_id,doc_id):
             except ObjectDoesNotExist:
                 is_share = False
 
-            # 计算当前文档在文集中的序号和总数（用于分页导航）
-            all_docs = Doc.objects.filter(top_doc=pro_id, status=1).order_by('sort', 'create_time')
-            doc_list = list(all_docs.values_list('id', flat=True))
-            try:
-                doc_index = doc_list.index(int(doc_id)) + 1  # 当前文档序号（从1开始）
-                doc_total = len(doc_list)  # 文集总文档数
-            except ValueError:
+            # 当前文档在文集阅读顺序中的序号、总数和上下篇（用于分页导航），随文集目录缓存
+            doc_list,doc_index,previous_doc_id,next_doc_id = project_toc.get_doc_position(pro_id,doc.id)
+            doc_total = len(doc_list)  # 文集总文档数
+            if doc_index is None:
                 doc_index = 1
                 doc_total = 1
 
@@ -1191,14 +1062,11 @@ def doc_id(request,doc_id):
         except ObjectDoesNotExist:
             is_share = False
 
-        # 计算当前文档在文集中的序号和总数（用于分页导航）
+        # 当前文档在文集阅读顺序中的序号、总数和上下篇（用于分页导航），随文集目录缓存
         pro_id = doc.top_doc
-        all_docs = Doc.objects.filter(top_doc=pro_id, status=1).order_by('sort', 'create_time')
-        doc_list = list(all_docs.values_list('id', flat=True))
-        try:
-            doc_index = doc_list.index(int(doc_id)) + 1  # 当前文档序号（从1开始）
-            doc_total = len(doc_list)  # 文集总文档数
-        except ValueError:
+        doc_list,doc_index,previous_doc_id,next_doc_id = project_toc.get_doc_position(pro_id,doc.id)
+        doc_total = len(doc_list)  # 文集总文档数
+        if doc_index is None:
             doc_index = 1
             doc_total = 1
 
@@ -1397,8 +1265,11 @@ def modify_doc(request,doc_id):
                             doc.editor_mode = int(editor_mode)
                             doc.open_children = open_children
                             doc.show_children = show_children
-                            doc.save()
-                            refresh_doc_index([doc.id])
+                            # 只写入修改的字段，层级路径由 app_doc.doc_path 维护，不写回读取后可能已被移动的路径
+                            doc.save(update_fields=[
+                                'name','content','pre_content','parent_doc','sort','status',
+                                'editor_mode','open_children','show_children','modify_time'
+                            ])
                             # 更新文档标签
                             doc_tag_list = doc_tags.split(",") if doc_tags != "" else []
                             # print(doc_tags,doc_tag_list)
@@ -1466,15 +1337,10 @@ def del_doc(request):
                         or (colla_user_role == 1) \
                         or (request.user == project.create_user)\
                         or (request.user.is_superuser):
-                    # 修改状态为删除
-                    doc.status = 3
-                    doc.modify_time = datetime.datetime.now()
-                    doc.save()
-                    # 修改其下级所有文档状态为删除
-                    chr_doc = Doc.objects.filter(parent_doc=doc_id) # 获取下级文档
-                    chr_doc_ids = chr_doc.values_list('id',flat=True) # 提取下级文档的ID
-                    chr_doc.update(status=3,modify_time=datetime.datetime.now()) # 修改下级文档的状态为删除
-                    Doc.objects.filter(parent_doc__in=list(chr_doc_ids)).update(status=3,modify_time=datetime.datetime.now()) # 修改下级文档的下级文档状态
+                    # 修改文档及其下级所有文档的状态为删除
+                    deleted_ids = doc_path.delete_subtrees(Doc.objects.filter(id=doc.id))
+                    refresh_doc_index(deleted_ids)
+                    project_toc.invalidate_docs(deleted_ids)
 
                     return JsonResponse({'status': True, 'data': _('删除完成')})
                 else:
@@ -1484,11 +1350,11 @@ def del_doc(request):
                 try:
                     # 管理员无需验证权限
                     if request.user.is_superuser:
-                        Doc.objects.filter(id__in=docs).update(status=3,modify_time=datetime.datetime.now())
-                        Doc.objects.filter(parent_doc__in=docs).update(status=3, modify_time=datetime.datetime.now())
+                        deleted_ids = doc_path.delete_subtrees(Doc.objects.filter(id__in=docs))
                     else:
-                        Doc.objects.filter(id__in=docs,create_user=request.user).update(status=3,modify_time=datetime.datetime.now())
-                        Doc.objects.filter(parent_doc__in=docs).update(status=3,modify_time=datetime.datetime.now())
+                        deleted_ids = doc_path.delete_subtrees(Doc.objects.filter(id__in=docs,create_user=request.user))
+                    refresh_doc_index(deleted_ids)
+                    project_toc.invalidate_docs(deleted_ids)
                     return JsonResponse({'status': True, 'data': _('删除完成')})
                 except:
                     return JsonResponse({'status': False, 'data': _('非法请求')})
@@ -1606,7 +1472,7 @@ def manage_doc(request):
 def move_doc(request):
     doc_id = request.POST.get('doc_id','') # 文档ID
     pro_id = request.POST.get('pro_id','') # 移动的文集ID
-    move_type = request.POST.get('move_type','') # 移动的类型 0复制 1移动 2连同下级文档移动
+    move_type = request.POST.get('move_type','') # 移动的类型 0复制 1移动 2连同下级文档移动 3连同下级文档复制
     parent_id = request.POST.get('parent_id',0)
     # 判断文集是否存在且有权限
     try:
@@ -1655,35 +1521,43 @@ def move_doc(request):
     # 移动文档，下级文档更改到根目录
     elif move_type == '1':
         try:
-            # 修改文档的所属文集和上级文档实现移动文档
-            Doc.objects.filter(id=int(doc_id)).update(parent_doc=int(parent_id),top_doc=int(pro_id))
-            # 修改其子文档为顶级文档
-            Doc.objects.filter(parent_doc=doc_id).update(parent_doc=0)
-            refresh_doc_index([int(doc_id)])
+            # 下级文档改为一级文档后只移动文档自身
+            with transaction.atomic():
+                affected_ids = doc_path.lift_children(doc)
+                affected_ids += doc_path.move_subtree(doc,parent_id,pro_id)
+            refresh_doc_index(affected_ids)
+            project_toc.invalidate(doc.top_doc,pro_id,doc_ids=affected_ids)
             return JsonResponse({'status':True,'data':{'pro_id':pro_id,'doc_id':doc_id}})
+        except ValueError as e:
+            return JsonResponse({'status':False,'data':_(str(e))})
         except:
             logger.exception(_("移动文档异常"))
             return JsonResponse({'status':False,'data':_('移动文档失败')})
     # 包含下级文档一起移动
     elif move_type == '2':
         try:
-            # 修改文档的所属文集和上级文档实现移动文档
-            Doc.objects.filter(id=int(doc_id)).update(parent_doc=int(parent_id), top_doc=int(pro_id))
-            # 修改其子文档的文集归属
-            child_doc = Doc.objects.filter(parent_doc=doc_id)
-            child_ids = list(child_doc.values_list('id', flat=True))
-            child_doc.update(top_doc=int(pro_id))
-            # 遍历子文档，如果其存在下级文档，那么继续修改所属文集
-            affected_ids = {int(doc_id)}.union(set(child_ids))
-            for child in child_doc:
-                grandchild_ids = list(Doc.objects.filter(parent_doc=child.id).values_list('id', flat=True))
-                Doc.objects.filter(parent_doc=child.id).update(top_doc=int(pro_id))
-                affected_ids.update(grandchild_ids)
+            # 按文档路径一次修改全部下级文档的所属文集
+            affected_ids = doc_path.move_subtree(doc,parent_id,pro_id)
             refresh_doc_index(affected_ids)
+            project_toc.invalidate(doc.top_doc,pro_id,doc_ids=affected_ids)
             return JsonResponse({'status': True, 'data':{'pro_id':pro_id,'doc_id':doc_id}})
+        except ValueError as e:
+            return JsonResponse({'status':False,'data':_(str(e))})
         except:
             logger.exception(_("移动包含下级的文档异常"))
             return JsonResponse({'status': False, 'data': _('移动文档失败')})
+    # 包含下级文档一起复制
+    elif move_type == '3':
+        try:
+            copy_doc,copy_ids = doc_path.copy_subtree(doc,parent_id,pro_id,request.user)
+            refresh_doc_index(copy_ids)
+            project_toc.invalidate(pro_id,doc_ids=copy_ids)
+            return JsonResponse({'status':True,'data':{'pro_id':pro_id,'doc_id':copy_doc.id}})
+        except ValueError as e:
+            return JsonResponse({'status':False,'data':_(str(e))})
+        except:
+            logger.exception(_("复制包含下级的文档异常"))
+            return JsonResponse({'status':False,'data':_('复制文档失败')})
     else:
         return JsonResponse({'status':False,'data':_('移动类型错误')})
 
@@ -1800,7 +1674,7 @@ def doc_recycle(request):
                         # 修改状态为草稿
                         doc.status = 0
                         doc.modify_time = datetime.datetime.now()
-                        doc.save()
+                        doc.save(update_fields=['status','modify_time'])
                     # 删除文档
                     elif types == 'del':
                         # 删除文档历史、分享、标签
@@ -1858,7 +1732,7 @@ def fast_publish_doc(request):
         try:
             doc.status = 1
             doc.modify_time = datetime.datetime.now()
-            doc.save()
+            doc.save(update_fields=['status','modify_time'])
             return JsonResponse({'status':True,'data':_('发布成功')})
         except:
             logger.exception(_("文档一键发布失败"))
@@ -2255,6 +2129,160 @@ def find_doc_index(toc_list, doc_id):
 
     return search_in_tree(toc_list)
 
+# 判断用户是否可以浏览文集，与文集页的浏览权限一致
+def check_project_view_role(request,project):
+    if project.id in access_scope.get_visible_project_ids(request.user):
+        return True
+    # 指定用户可见文集
+    if project.role == 2:
+        return request.user.is_authenticated and request.user.username in project.role_value
+    # 访问码可见文集
+    elif project.role == 3:
+        return request.COOKIES.get('viewcode-{}'.format(project.id)) == project.role_value
+    return False
+
+
+# 获取文集目录JSON，以目录版本号作为 ETag，目录未变化时浏览器可直接使用已缓存的目录
+@require_GET
+@logger.catch()
+def get_pro_toc_json(request,pro_id):
+    try:
+        project = Project.objects.get(id=int(pro_id))
+    except ObjectDoesNotExist:
+        return JsonResponse({'status':False,'data':_('文集不存在')},status=404)
+
+    if not check_project_view_role(request,project):
+        return JsonResponse({'status':False,'data':_('无权访问')},status=403)
+
+    toc_list,toc_cnt,version = project_toc.get_toc(project.id)
+    etag = quote_etag('toc-{}-{}-{}'.format(project.id,*version))
+    # If-None-Match 命中时返回 304
+    resp = get_conditional_response(request,etag=etag)
+    if resp is None:
+        resp = JsonResponse({'status':True,'data':jsonXssFilter(toc_list),'total':toc_cnt})
+        resp['ETag'] = etag
+    # 浏览权限与登录用户相关，只允许浏览器缓存，每次使用前向服务器验证
+    patch_cache_control(resp,private=True,no_cache=True)
+    return resp
+
+
+# 文档树按层级加载时的游标：after_排序值_文档ID 表示从该文档之后开始（下一页），
+# from_排序值_文档ID 表示从该文档开始（含该文档，用于展开到指定文档）
+DOC_TREE_CURSOR_KINDS = ('after','from')
+
+def doc_tree_cursor(sort,doc_id,inclusive=False):
+    return '{}_{}_{}'.format(DOC_TREE_CURSOR_KINDS[inclusive],sort,doc_id)
+
+
+# 解析文档树游标，返回同级文档的过滤条件，游标格式错误时抛出 ValueError
+def doc_tree_cursor_filter(cursor):
+    kind,sort,doc_id = cursor.split('_')
+    if kind not in DOC_TREE_CURSOR_KINDS:
+        raise ValueError(cursor)
+    sort,doc_id = int(sort),int(doc_id)
+    if kind == 'from':
+        return Q(sort__gt=sort) | Q(sort=sort,id__gte=doc_id)
+    return Q(sort__gt=sort) | Q(sort=sort,id__gt=doc_id)
+
+
+# 按层级获取文集的下级文档，每次只返回一个上级文档的一页下级文档，大文集无需生成整个文档树
+@require_GET
+@logger.catch()
+def get_pro_doc_children(request):
+    try:
+        pro_id = int(request.GET.get('pro_id',''))
+        parent_id = int(request.GET.get('parent_id',0) or 0)
+        limit = min(max(int(request.GET.get('limit',50)),1),200)
+        cursor = request.GET.get('cursor','')
+        cursor_filter = doc_tree_cursor_filter(cursor) if cursor else None
+    except ValueError:
+        return JsonResponse({'status':False,'data':_('参数错误')},status=400)
+    try:
+        project = Project.objects.get(id=pro_id)
+    except ObjectDoesNotExist:
+        return JsonResponse({'status':False,'data':_('文集不存在')},status=404)
+    if not check_project_view_role(request,project):
+        return JsonResponse({'status':False,'data':_('无权访问')},status=403)
+
+    docs = Doc.objects.filter(top_doc=pro_id,parent_doc=parent_id,status=1)
+    if cursor_filter is not None:
+        docs = docs.filter(cursor_filter)
+    # 多取一个判断是否还有下一页
+    docs = list(docs.order_by('sort','id').values('id','name','editor_mode','sort','modify_time')[:limit + 1])
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = doc_tree_cursor(docs[-1]['sort'],docs[-1]['id'])
+    # 一次查询本页文档中存在下级文档的文档
+    parent_ids = set(Doc.objects.filter(
+        top_doc=pro_id,parent_doc__in=[d['id'] for d in docs],status=1
+    ).values_list('parent_doc',flat=True).distinct())
+    data = [{
+        'id': d['id'],
+        'title': d['name'],
+        'editor_mode': d['editor_mode'],
+        'modify_time': d['modify_time'],
+        'has_children': d['id'] in parent_ids
+    } for d in docs]
+    return JsonResponse({'status':True,'data':jsonXssFilter(data),'next_cursor':next_cursor})
+
+
+# 获取文档的上级文档链，用于按层级加载的文档树展开到指定文档
+@require_GET
+@logger.catch()
+def get_pro_doc_path(request):
+    try:
+        doc_id = int(request.GET.get('doc_id',''))
+    except ValueError:
+        return JsonResponse({'status':False,'data':_('参数错误')},status=400)
+    fields = ('id','name','parent_doc','top_doc','sort','editor_mode')
+    doc = Doc.objects.filter(id=doc_id,status=1).values(*fields,'path').first()
+    if doc is None:
+        return JsonResponse({'status':False,'data':_('文档不存在')},status=404)
+    try:
+        project = Project.objects.get(id=doc['top_doc'])
+    except ObjectDoesNotExist:
+        return JsonResponse({'status':False,'data':_('文集不存在')},status=404)
+    if not check_project_view_role(request,project):
+        return JsonResponse({'status':False,'data':_('无权访问')},status=403)
+
+    # 文档路径为 /上级文档ID/.../文档ID/，一次查询获取全部上级文档
+    path_ids = [int(i) for i in (doc['path'] or doc_path.get_path(doc_id)).strip('/').split('/') if i]
+    if not path_ids:
+        return JsonResponse({'status':False,'data':_('文档层级过深')},status=400)
+    docs = {d['id']:d for d in Doc.objects.filter(
+        id__in=path_ids[:-1],top_doc=project.id,status=1
+    ).values(*fields)}
+    docs[doc_id] = doc
+    path = []
+    for i,path_id in enumerate(path_ids):
+        d = docs.get(path_id)
+        # 上级文档未发布或路径与上级关系不一致时，文档不在目录中
+        if d is None or d['parent_doc'] != (path_ids[i - 1] if i else 0):
+            return JsonResponse({'status':False,'data':_('文档不在文集目录中')},status=404)
+        path.append(d)
+
+    # 一次分组查询每一级同级文档的数量，以及路径上的文档之前的同级文档数量（即文档在同级文档中的位置）
+    before = Q()
+    for d in path:
+        before |= Q(parent_doc=d['parent_doc']) & (Q(sort__lt=d['sort']) | Q(sort=d['sort'],id__lt=d['id']))
+    counts = {c['parent_doc']:c for c in Doc.objects.filter(
+        top_doc=project.id,parent_doc__in=[d['parent_doc'] for d in path],status=1
+    ).order_by().values('parent_doc').annotate(index=Count('id',filter=before),total=Count('id'))}
+
+    data = [{
+        'id': d['id'],
+        'title': d['name'],
+        'editor_mode': d['editor_mode'],
+        'parent_id': d['parent_doc'],
+        'index': counts[d['parent_doc']]['index'],
+        'total': counts[d['parent_doc']]['total'],
+        # 从该文档开始加载同级文档的游标
+        'cursor': doc_tree_cursor(d['sort'],d['id'],inclusive=True)
+    } for d in path]
+    return JsonResponse({'status':True,'data':jsonXssFilter(data),'project':project.id})
+
+
 # 获取指定文集的文档树数据
 @require_http_methods(['POST'])
 @logger.catch()
@@ -2262,57 +2290,12 @@ def get_pro_doc_tree(request):
     pro_id = request.POST.get('pro_id', None)
     is_page = request.POST.get('is_page', False)
     if pro_id:
-        # 查询存在上级文档的文档
-        parent_id_list = Doc.objects.filter(top_doc=pro_id,status=1).exclude(parent_doc=0).values_list('parent_doc',flat=True)
-        # 获取存在上级文档的上级文档ID
-        # print(parent_id_list)
-        doc_list = []
-        # 获取一级文档
-        top_docs = Doc.objects.filter(top_doc=pro_id,parent_doc=0,status=1).values('id','name','modify_time').order_by('sort')
-        # 遍历一级文档
-        for doc in top_docs:
-            top_item = {
-                'id':doc['id'],
-                'field':doc['name'],
-                'title':doc['name'],
-                'modify_time':doc['modify_time'],
-                'spread':True,
-                'level':1
-            }
-            # 如果一级文档存在下级文档，查询其二级文档
-            if doc['id'] in parent_id_list:
-                # 获取二级文档
-                sec_docs = Doc.objects.filter(top_doc=pro_id,parent_doc=doc['id'],status=1).values('id','name','modify_time').order_by('sort')
-                top_item['children'] = []
-                for doc in sec_docs:
-                    sec_item = {
-                        'id': doc['id'],
-                        'field': doc['name'],
-                        'title': doc['name'],
-                        'modify_time': doc['modify_time'],
-                        'level':2
-                    }
-                    # 如果二级文档存在下级文档，查询第三级文档
-                    if doc['id'] in parent_id_list:
-                        # 获取三级文档
-                        thr_docs = Doc.objects.filter(top_doc=pro_id,parent_doc=doc['id'],status=1).values('id','name','modify_time').order_by('sort')
-                        sec_item['children'] = []
-                        for doc in thr_docs:
-                            item = {
-                                'id': doc['id'],
-                                'field': doc['name'],
-                                'title': doc['name'],
-                                'modify_time': doc['modify_time'],
-                                'level': 3
-                            }
-                            sec_item['children'].append(item)
-                        top_item['children'].append(sec_item)
-                    else:
-                        top_item['children'].append(sec_item)
-                doc_list.append(top_item)
-            # 如果一级文档没有下级文档，直接保存
-            else:
-                doc_list.append(top_item)
+        # 一次查询获取文集全部文档，组装为任意层级的文档树
+        doc_list,doc_cnt = get_doc_tree(
+            pro_id,
+            ('name','modify_time'),
+            lambda doc,level: dict(sort_tree_item(doc,level),modify_time=doc['modify_time'])
+        )
         doc_list = jsonXssFilter(doc_list)
         if is_page is False:
             return JsonResponse({'status':True,'data':doc_list})
@@ -2997,12 +2980,8 @@ def search(request):
         # 搜索文档
         if search_type == 'doc':
             if is_auth:
-                colla_list = [i.project.id for i in ProjectCollaborator.objects.filter(user=request.user)]  # 用户的协作文集
-                open_list = [i.id for i in Project.objects.filter(
-                    Q(role=0) | Q(create_user=request.user)
-                )]  # 公开文集
-
-                view_list = list(set(open_list).union(set(colla_list)))  # 合并上述两个文集ID列表
+                # 公开文集、自己创建的文集和协作文集
+                view_list = list(access_scope.get_visible_project_ids(request.user))
 
                 data_list = Doc.objects.filter(
                     Q(top_doc__in=view_list),  # 包含用户可浏览到的文集
@@ -3010,7 +2989,7 @@ def search(request):
                     Q(name__icontains=kw) | Q(content__icontains=kw) | Q(pre_content__icontains=kw)  # 筛选文档标题和内容中包含搜索词
                 ).order_by('-create_time')
             else:
-                view_list = [i.id for i in Project.objects.filter(role=0)]
+                view_list = list(access_scope.get_public_project_ids())
                 data_list = Doc.objects.filter(
                     Q(top_doc__in=view_list),
                     Q(create_time__gte=start_date, create_time__lte=end_date),  # 筛选创建时间
@@ -3021,7 +3000,7 @@ def search(request):
         elif search_type == 'pro':
             # 认证用户
             if is_auth:
-                colla_list = [i.project.id for i in ProjectCollaborator.objects.filter(user=request.user)]  # 用户的协作文集
+                colla_list = access_scope.get_collaborated_project_ids(request.user)  # 用户的协作文集
                 # 查询所有可显示的文集
                 data_list = Project.objects.filter(
                     Q(role=0) | \
@@ -3043,12 +3022,8 @@ def search(request):
         elif search_type == 'tag':
             # 认证用户
             if is_auth:
-                colla_list = [i.project.id for i in ProjectCollaborator.objects.filter(user=request.user)]  # 用户的协作文集
-                open_list = [i.id for i in Project.objects.filter(
-                    Q(role=0) | Q(create_user=request.user)
-                )]  # 公开文集和自己创建的文集
-
-                view_list = list(set(open_list).union(set(colla_list)))  # 合并上述两个文集ID列表
+                # 公开文集、自己创建的文集和协作文集
+                view_list = list(access_scope.get_visible_project_ids(request.user))
 
                 tag_list = Tag.objects.filter(name__icontains=kw) # 查询符合条件的标签
                 tag_doc_list = [i.doc.id for i in DocTag.objects.filter(tag__in=tag_list)] # 获取符合条件的标签文档
@@ -3060,9 +3035,7 @@ def search(request):
                 ).order_by('-create_time')
             # 游客
             else:
-                open_list = [i.id for i in Project.objects.filter(Q(role=0))]  # 公开文集
-
-                view_list = list(set(open_list))
+                view_list = list(access_scope.get_public_project_ids())  # 公开文集
 
                 tag_list = Tag.objects.filter(name__icontains=kw)  # 查询符合条件的标签
                 tag_doc_list = [i.doc.id for i in DocTag.objects.filter(tag__in=tag_list)]  # 获取符合条件的标签文档
@@ -3216,7 +3189,7 @@ def tag_docs(request,tag_id):
                 docs = DocTag.objects.filter(tag=tag,doc__status=1)
             else:
                 # 获取有权限的文档
-                colla_list = [i.project.id for i in ProjectCollaborator.objects.filter(user=request.user)]  # 用户的协作文集
+                colla_list = access_scope.get_collaborated_project_ids(request.user)  # 用户的协作文集
                 open_list = [i.id for i in Project.objects.filter(
                     Q(role=0) | Q(create_user=tag.create_user)
                 )]  # 公开文集
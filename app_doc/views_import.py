@@ -27,7 +27,9 @@ from loguru import logger
 from app_doc.report_utils import *
 from app_admin.decorators import check_headers,allow_report_file
 from app_doc.import_utils import *
-from app_doc.views import get_pro_toc,html_filter,jsonXssFilter
+from app_doc.views import get_pro_toc,html_filter,jsonXssFilter,sort_tree_item
+from app_doc.doc_tree import get_doc_tree,iter_sort_data
+from app_doc import access_scope, doc_path, project_toc
 from app_api.auth_app import AppAuth,AppMustAuth # 自定义认证
 import datetime
 import traceback
@@ -66,58 +68,8 @@ def import_project(request):
                         project = import_file.read_zip(temp_file_path,request.user) # 返回文集id或None
                         if project:
                             pro = Project.objects.get(id=project)
-                            docs = Doc.objects.filter(top_doc=project).values_list('id','name')
-                            # 查询存在上级文档的文档
-                            parent_id_list = Doc.objects.filter(top_doc=project).exclude(
-                                parent_doc=0).values_list('parent_doc', flat=True)
-                            # 获取存在上级文档的上级文档ID
-                            doc_list = []
-                            # 获取一级文档
-                            top_docs = Doc.objects.filter(
-                                top_doc=project,
-                                parent_doc=0).values('id','name').order_by('sort')
-                            for doc in top_docs:
-                                top_item = {
-                                    'id': doc['id'],
-                                    'field': doc['name'],
-                                    'title': doc['name'],
-                                    'spread': True,
-                                    'level': 1
-                                }
-                                # 如果一级文档存在下级文档，查询其二级文档
-                                if doc['id'] in parent_id_list:
-                                    sec_docs = Doc.objects.filter(
-                                        top_doc=project,
-                                        parent_doc=doc['id']).values('id','name').order_by('sort')
-                                    top_item['children'] = []
-                                    for doc in sec_docs:
-                                        sec_item = {
-                                            'id': doc['id'],
-                                            'field': doc['name'],
-                                            'title': doc['name'],
-                                            'level': 2
-                                        }
-                                        # 如果二级文档存在下级文档，查询第三级文档
-                                        if doc['id'] in parent_id_list:
-                                            thr_docs = Doc.objects.filter(
-                                                top_doc=project,
-                                                parent_doc=doc['id'],).values('id','name').order_by('sort')
-                                            sec_item['children'] = []
-                                            for doc in thr_docs:
-                                                item = {
-                                                    'id': doc['id'],
-                                                    'field': doc['name'],
-                                                    'title': doc['name'],
-                                                    'level': 3
-                                                }
-                                                sec_item['children'].append(item)
-                                            top_item['children'].append(sec_item)
-                                        else:
-                                            top_item['children'].append(sec_item)
-                                    doc_list.append(top_item)
-                                # 如果一级文档没有下级文档，直接保存
-                                else:
-                                    doc_list.append(top_item)
+                            # 获取导入文集的文档树（不限文档状态）
+                            doc_list,doc_cnt = get_doc_tree(project,('name',),sort_tree_item,status=None)
 
                             return JsonResponse({
                                 'status':True,
@@ -256,23 +208,13 @@ class ImportLocalDoc(APIView):
             sort_data = json.loads(sort_data)
         except Exception:
             return JsonResponse({'code': 5, 'data': _('文档参数错误')})
-        # 文档排序
-        n = 10
-        # 第一级文档
-        for data in sort_data:
-            Doc.objects.filter(id=data['id']).update(sort=n, status=1)
-            n += 10
-            # 存在第二级文档
-            if 'children' in data.keys():
-                n1 = 10
-                for c1 in data['children']:
-                    Doc.objects.filter(id=c1['id']).update(sort=n1, parent_doc=data['id'], status=1)
-                    n1 += 10
-                    # 存在第三级文档
-                    if 'children' in c1.keys():
-                        n2 = 10
-                        for c2 in c1['children']:
-                            Doc.objects.filter(id=c2['id']).update(sort=n2, parent_doc=c1['id'], status=1)
+        # 文档排序，支持任意层级
+        doc_ids = []
+        for doc_id,parent_id,sort in iter_sort_data(sort_data):
+            Doc.objects.filter(id=doc_id).update(sort=sort, parent_doc=parent_id, status=1)
+            doc_ids.append(doc_id)
+        doc_path.rebuild_docs(doc_ids)
+        project_toc.invalidate_docs(doc_ids)
 
         return Response({'code':0,'data':'ok'})
 
@@ -305,23 +247,13 @@ def project_doc_sort(request):
         intro = desc,
         role = role
     )
-    # 文档排序
-    n = 10
-    # 第一级文档
-    for data in sort_data:
-        Doc.objects.filter(id=data['id']).update(sort = n,status=doc_status)
-        n += 10
-        # 存在第二级文档
-        if 'children' in data.keys():
-            n1 = 10
-            for c1 in data['children']:
-                Doc.objects.filter(id=c1['id']).update(sort = n1,parent_doc=data['id'],status=doc_status)
-                n1 += 10
-                # 存在第三级文档
-                if 'children' in c1.keys():
-                    n2 = 10
-                    for c2 in c1['children']:
-                        Doc.objects.filter(id=c2['id']).update(sort=n2,parent_doc=c1['id'],status=doc_status)
+    # update() 不触发模型信号，手动失效公开文集缓存
+    access_scope.invalidate_public()
+    # 文档排序，支持任意层级
+    for doc_id,parent_id,sort in iter_sort_data(sort_data):
+        Doc.objects.filter(id=doc_id).update(sort=sort,parent_doc=parent_id,status=doc_status)
+    doc_path.rebuild_project(project_id)
+    project_toc.invalidate(project_id)
 
     return JsonResponse({'status':True,'data':'ok'})
 
@@ -10,6 +10,9 @@ from django.db.models import Q
 from haystack.views import SearchView
 from haystack.query import SearchQuerySet
 from app_doc.models import *
+from app_doc.search_utils import narrow_to_projects
+from app_doc import access_scope
+from app_doc.search import result_cache
 import datetime
 import time
 
@@ -90,28 +93,16 @@ class DocSearchView(SearchView):
 
         # 获取可搜索的文集列表
         if is_auth:
-            colla_list = [i.project.id for i in
-                          ProjectCollaborator.objects.filter(user=self.request.user)]  # 用户的协作文集
-            open_list = [i.id for i in Project.objects.filter(
-                Q(role=0) | Q(create_user=self.request.user)
-            )]  # 公开文集
-
-            view_list = list(set(open_list).union(set(colla_list)))  # 合并上述两个文集ID列表
-        else:
-            view_list = [i.id for i in Project.objects.filter(role=0)] # 公开文集
-
-        if len(view_list) > 0:
-            sqs = SearchQuerySet().filter(
-                top_doc__in=view_list
-            ).filter(
-                modify_time__gte=start_date,
-                modify_time__lte=end_date)
+            # 公开文集、自己创建的文集和协作文集
+            view_list = list(access_scope.get_visible_project_ids(self.request.user))
         else:
-            sqs = SearchQuerySet().filter(
-                top_doc__in=None
-            ).filter(
-                modify_time__gte=start_date,
-                modify_time__lte=end_date)
+            view_list = list(access_scope.get_public_project_ids()) # 公开文集
+
+        # 文集权限范围使用可缓存的过滤查询，见 narrow_to_projects
+        sqs = narrow_to_projects(SearchQuerySet(), view_list).filter(
+            modify_time__gte=start_date,
+            modify_time__lte=end_date
+        )
 
         self.form = self.build_form(form_kwargs={'searchqueryset': sqs})
         self.query = self.get_query().replace("\n",'').replace("\r",'')
@@ -133,6 +124,12 @@ class DocSearchView(SearchView):
             # search_field == 'all' 时使用默认的全文搜索，不需要额外处理
 
         self.results = self.get_results()
+        if self.query:
+            # 相同搜索条件和文集范围的结果ID列表按索引代数缓存，翻页时只加载当前页的文档
+            self.results = result_cache.cached_results(
+                'doc_search', self.request.GET.get('q', ''), self.results, scope=view_list,
+                mode=search_mode, field=search_field, d_type=date_type, d_range=date_range,
+            )
 
         # 记录搜索日志
         if SEARCH_LOG_ENABLED and self.query:
@@ -158,6 +155,9 @@ class DocSearchView(SearchView):
             'date_range': self.request.GET.get('d_range', 'all'),
             'search_mode': self.request.GET.get('mode', 'or'),
             'search_field': self.request.GET.get('field', 'all'),
+            # 搜索超出时间预算时只显示已收集到的部分结果，另外显示估算的结果数量
+            'search_partial': getattr(self.results, 'partial', False),
+            'search_estimated_total': getattr(self.results, 'estimated_total', None),
         }
         return context
 
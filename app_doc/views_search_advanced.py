@@ -10,6 +10,8 @@ from django.db.models import Q
 from haystack.views import SearchView
 from haystack.query import SearchQuerySet
 from app_doc.models import *
+from app_doc.search_utils import narrow_to_projects
+from app_doc import access_scope
 import datetime
 from django.http import JsonResponse
 from django.views import View
@@ -75,30 +77,17 @@ class AdvancedDocSearchView(SearchView):
 
         # 获取可搜索的文集列表
         if is_auth:
-            colla_list = [i.project.id for i in
-                          ProjectCollaborator.objects.filter(user=self.request.user)]  # 用户的协作文集
-            open_list = [i.id for i in Project.objects.filter(
-                Q(role=0) | Q(create_user=self.request.user)
-            )]  # 公开文集
-            view_list = list(set(open_list).union(set(colla_list)))  # 合并上述两个文集ID列表
+            # 公开文集、自己创建的文集和协作文集
+            view_list = list(access_scope.get_visible_project_ids(self.request.user))
         else:
-            view_list = [i.id for i in Project.objects.filter(role=0)]  # 公开文集
+            view_list = list(access_scope.get_public_project_ids()) # 公开文集
 
         # 构建基础查询集
-        if len(view_list) > 0:
-            sqs = SearchQuerySet().filter(
-                top_doc__in=view_list
-            ).filter(
-                modify_time__gte=start_date,
-                modify_time__lte=end_date
-            )
-        else:
-            sqs = SearchQuerySet().filter(
-                top_doc__in=None
-            ).filter(
-                modify_time__gte=start_date,
-                modify_time__lte=end_date
-            )
+        # 文集权限范围使用可缓存的过滤查询，见 narrow_to_projects
+        sqs = narrow_to_projects(SearchQuerySet(), view_list).filter(
+            modify_time__gte=start_date,
+            modify_time__lte=end_date
+        )
 
         # 构建表单
         self.form = self.build_form(form_kwargs={'searchqueryset': sqs})
@@ -116,7 +116,7 @@ def view_hot_keywords(limit=20):
     if not keywords:
         print("暂无热门关键词数据")
         print("\n提示: 运行以下命令更新热门关键词:")
-        print("  python update_hot_keywords.py")
+        print("  python manage.py update_hot_keywords")
         return
 
     print(f"{'关键词':<30} {'搜索次数':<12} {'热度分数':<12} {'最后搜索时间':<20}")